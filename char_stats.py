@@ -0,0 +1,87 @@
+import unicodedata
+from functools import lru_cache
+import numpy as np
+
+# -> character-class counts for the line / document filters of cleaning_stages/ and data_stage/
+# -> a document is encoded to UTF-32 once, every code point gets its class flags from a lookup
+# -> table and the per-line counts come from one cumulative sum, instead of a python generator
+# -> expression over every character of every line
+# -> lines are those of text.split('\n'); counts and lengths are in characters, exactly what
+# -> len(line) and sum(1 for c in line if ...) give
+# -> scripts living in a subfolder put the repo root on sys.path to import it:
+# ->   sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+ALPHA = 1       # -> str.isalpha(), same as unicodedata.category(c) starting with "L"
+ALNUM = 2       # -> str.isalnum()
+SPACE = 4       # -> str.isspace()
+OTHER = 8       # -> unicodedata.category(c) starting with "C" (control, format, unassigned, ...)
+
+def _char_flags(c: str) -> int:
+    return (ALPHA * c.isalpha() | ALNUM * c.isalnum() | SPACE * c.isspace()
+            | OTHER * (unicodedata.category(c)[0] == "C"))
+
+@lru_cache(maxsize=None)
+def _bmp_table() -> np.ndarray:
+    # -> flags of U+0000..U+FFFF, built on first use (~30ms); rarer code points are looked up one by one
+    return np.array([_char_flags(chr(i)) for i in range(0x10000)], dtype=np.uint8)
+
+def codepoints(text: str) -> np.ndarray:
+    # -> one uint32 per character (lone surrogates included, so len(text) == len(result))
+    return np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+
+def char_flags(cp: np.ndarray) -> np.ndarray:
+    table = _bmp_table()
+    bmp = cp < 0x10000
+    if bmp.all():
+        return table[cp]
+    flags = np.empty(len(cp), dtype=np.uint8)
+    flags[bmp] = table[cp[bmp]]
+    astral, inverse = np.unique(cp[~bmp], return_inverse=True)
+    flags[~bmp] = np.array([_char_flags(chr(c)) for c in astral.tolist()], dtype=np.uint8)[inverse]
+    return flags
+
+@lru_cache(maxsize=64)
+def _char_set(chars: str) -> np.ndarray:
+    return np.array(sorted(set(map(ord, chars))), dtype=np.uint32)
+
+class CharStats:
+    # -> one document; the count methods return an int64 array with one entry per line
+    def __init__(self, text: str):
+        self.cp = codepoints(text)
+        self.flags = char_flags(self.cp)
+        nl = np.flatnonzero(self.cp == 10)
+        self.starts = np.concatenate(([0], nl + 1))
+        self.ends = np.append(nl, len(self.cp))
+
+    def lengths(self) -> np.ndarray:
+        return self.ends - self.starts
+
+    def per_line(self, mask: np.ndarray) -> np.ndarray:
+        # -> number of True entries of a per-character mask on every line
+        cs = np.zeros(len(mask) + 1, dtype=np.int64)
+        np.cumsum(mask, out=cs[1:])
+        return cs[self.ends] - cs[self.starts]
+
+    def has(self, flag: int) -> np.ndarray:
+        return (self.flags & flag) != 0
+
+    def in_chars(self, chars: str) -> np.ndarray:
+        return np.isin(self.cp, _char_set(chars))
+
+    def alpha(self) -> np.ndarray:
+        return self.per_line(self.has(ALPHA))
+
+    def special(self, allowed: str = "") -> np.ndarray:
+        # -> characters that are neither alphanumeric, whitespace nor one of `allowed`
+        return self.per_line(~(self.has(ALNUM | SPACE) | self.in_chars(allowed)))
+
+    def above(self, code: int) -> np.ndarray:
+        # -> characters with ord(c) > code
+        return self.per_line(self.cp > code)
+
+def drop_chars(text: str, drop: np.ndarray, cp: np.ndarray | None = None) -> str:
+    # -> text without the characters where `drop` (a per-character mask) is set
+    if not drop.any():
+        return text
+    if cp is None:
+        cp = codepoints(text)
+    return cp[~drop].tobytes().decode("utf-32-le", "surrogatepass")
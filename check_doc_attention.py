@@ -0,0 +1,86 @@
+import sys, argparse
+import numpy as np
+import torch
+from transformers import (
+    LlamaConfig, LlamaForCausalLM,
+    MistralConfig, MistralForCausalLM,
+    FalconConfig, FalconForCausalLM,
+)
+from doc_attention import block_position_ids, doc_attention_mask
+
+# -> CPU correctness check for document-aware packing (doc_attention.py): tiny random Llama, Mistral
+# -> and Falcon models (same attention layouts as train_model.py) run one packed block with
+# -> per-document position_ids + 4D mask, and every document of the block on its own; the logits
+# -> of each document must match, otherwise the script exits with status 1
+# -> "leak" is the same comparison for the plain causal packed pass, it should be far from 0
+# ->   python check_doc_attention.py --block 64 --blocks 5 [--dtype bfloat16]
+VOCAB = 128
+
+def tiny_models(block: int):
+    common = dict(vocab_size=VOCAB, hidden_size=64, num_hidden_layers=2, num_attention_heads=4,
+                  max_position_embeddings=block, tie_word_embeddings=True)
+    yield "llama_gqa", LlamaForCausalLM, LlamaConfig(**common, num_key_value_heads=2, intermediate_size=128)
+    # -> window smaller than the documents, so the window has to survive the custom mask
+    yield "mistral_sliding", MistralForCausalLM, MistralConfig(**common, num_key_value_heads=2, intermediate_size=128,
+                                                               sliding_window=max(2, block // 8))
+    yield "falcon_mqa", FalconForCausalLM, FalconConfig(**common, num_kv_heads=1, parallel_attn=True,
+                                                        new_decoder_architecture=True, bias=False)
+
+def random_block(rng, block: int) -> tuple[np.ndarray, list[int]]:
+    # -> token ids of one block and the lengths of its documents (the last one cut at the block edge)
+    lengths = []
+    while sum(lengths) < block:
+        lengths.append(int(rng.integers(1, max(2, block // 2))))
+    lengths[-1] -= sum(lengths) - block
+    return rng.integers(0, VOCAB, block), lengths
+
+@torch.no_grad()
+def compare(model, ids: np.ndarray, lengths: list[int], sliding_window) -> tuple[float, float]:
+    # -> (max |packed - per document| with document attention, the same without it)
+    starts = np.cumsum([0] + lengths[:-1])
+    input_ids = torch.from_numpy(ids)[None]
+    position_ids = torch.from_numpy(block_position_ids(starts, len(ids)))[None]
+    packed = model(input_ids=input_ids, position_ids=position_ids,
+                   attention_mask=doc_attention_mask(position_ids, model.dtype, sliding_window)).logits[0]
+    plain = model(input_ids=input_ids).logits[0]
+    err = leak = 0.0
+    for a, n in zip(starts.tolist(), lengths):
+        alone = model(input_ids=input_ids[:, a:a + n]).logits[0]
+        err = max(err, (packed[a:a + n] - alone).float().abs().max().item())
+        leak = max(leak, (plain[a:a + n] - alone).float().abs().max().item())
+    return err, leak
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="check packed per-document attention against unpacked forward passes")
+    ap.add_argument("--block", type=int, default=64, help="tokens per packed block (default: %(default)s)")
+    ap.add_argument("--blocks", type=int, default=5, help="random blocks per model (default: %(default)s)")
+    ap.add_argument("--attn", nargs="+", default=["eager", "sdpa"], help="attention implementations (default: %(default)s)")
+    ap.add_argument("--dtype", choices=["float32", "bfloat16"], default="float32",
+                    help="model and mask dtype (default: %(default)s)")
+    ap.add_argument("--atol", type=float, default=None,
+                    help="allowed logit difference (default: 1e-4 for float32, 5e-2 for bfloat16)")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    dtype = getattr(torch, args.dtype)
+    atol = args.atol if args.atol is not None else (1e-4 if dtype == torch.float32 else 5e-2)
+
+    failed = False
+    for name, model_class, config in tiny_models(args.block):
+        for impl in args.attn:
+            torch.manual_seed(args.seed)
+            config._attn_implementation = impl
+            model = model_class(config).to(dtype).eval()
+            rng = np.random.default_rng(args.seed)
+            results = [compare(model, *random_block(rng, args.block), getattr(config, "sliding_window", None))
+                       for _ in range(args.blocks)]
+            err = max(r[0] for r in results)
+            leak = max(r[1] for r in results)
+            ok = err <= atol
+            failed |= not ok
+            print(f"{name:16s} {impl:6s} max diff {err:.2e}  leak without doc attention {leak:.2e}  "
+                  f"{'ok' if ok else 'FAIL'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
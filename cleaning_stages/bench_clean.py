@@ -0,0 +1,42 @@
+import sys, time, argparse
+from pathlib import Path
+from clean_text import clean, clean_steps
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))     # -> repo root, for jsonl_io
+from jsonl_io import iter_texts
+
+# -> golden-output check + benchmark for the fused stage-1 clean()
+# -> every doc of the sample goes through clean_steps() (one pass per filter, the reference) and
+# -> clean() (single line loop); any difference is printed and the script exits with status 1,
+# -> otherwise both timings are reported
+# ->   python cleaning_stages/bench_clean.py sample.jsonl --docs 5000
+# -> tests/test_clean_equivalence.py runs the same comparison on the committed tests/data sample
+
+def timed(fn, docs: list[str]) -> tuple[list[str], float]:
+    t0 = time.perf_counter()
+    out = [fn(d) for d in docs]
+    return out, time.perf_counter() - t0
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="check clean() against clean_steps() and time both")
+    ap.add_argument("sample", help=".jsonl (or .jsonl.zst) sample of raw documents")
+    ap.add_argument("--docs", type=int, default=None, help="only use the first N docs")
+    ap.add_argument("--show", type=int, default=5, help="differences printed (default: %(default)s)")
+    args = ap.parse_args()
+
+    docs = list(iter_texts(args.sample, limit=args.docs))
+    golden, t_ref = timed(clean_steps, docs)
+    fused, t_new = timed(clean, docs)
+
+    bad = [i for i, (a, b) in enumerate(zip(golden, fused)) if a != b]
+    for i in bad[:args.show]:
+        print(f"doc {i} differs:\n  steps: {golden[i][:200]!r}\n  fused: {fused[i][:200]!r}")
+    mb = sum(len(d.encode()) for d in docs) / 2**20
+    print(f"{len(docs):,} docs ({mb:.1f}MB), {len(bad):,} differ")
+    print(f"clean_steps {t_ref:.2f}s ({mb / t_ref:.1f}MB/s)   clean {t_new:.2f}s ({mb / t_new:.1f}MB/s)"
+          f"   -> {t_ref / t_new:.2f}x")
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
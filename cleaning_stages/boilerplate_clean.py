@@ -0,0 +1,125 @@
+import re, argparse
+from functools import partial
+from multiprocessing import Pool
+from pathlib import Path
+import numpy as np
+from tqdm import tqdm
+from count_min import CountMinSketch
+from dedup_index import fingerprint
+from engine import (Stage, clean_corpus, expand_inputs, tasks_from, ordered_results, task_texts,
+                    add_engine_args, engine_options)
+
+# -> corpus-wide boilerplate line removal, a two-pass stage
+# -> pass 1: every line of every doc is normalized (lowercase, collapsed whitespace, digit runs -> 0)
+# ->         and the doc's distinct line hashes go into a count-min sketch -> for each line, roughly
+# ->         how many docs contain it, in fixed memory (--sketch-mb) however big the corpus is
+# -> pass 2: the engine drops every line that at least --min-docs docs contain (menus, footers,
+# ->         "toate drepturile rezervate", share buttons, ...) and docs left empty
+# -> the sketch can only over-count, so a rare line is removed only through a collision, which at the
+# -> default size (64M counters) needs tens of millions of distinct lines per counter row
+# -> lines shorter than --min-chars (after normalization) are never counted or removed, so short
+# -> dialogue lines ("— Da.") that recur across books stay
+# -> the sketch is saved next to the output (<output>.cms.npy); with --resume an existing sketch is
+# -> reused and only pass 2 resumes, workers memory-map it instead of each loading a copy
+# -> two passes over the input can't be chained into fused_clean's single pass, so this runs on its own
+MIN_DOCS = 200      # -> a line in at least this many docs is boilerplate
+MIN_CHARS = 20      # -> shorter normalized lines are left alone
+SKETCH_MB = 256
+
+_DIGITS = re.compile(r'\d+')
+
+def normalize_line(ln: str) -> str:
+    return _DIGITS.sub('0', ' '.join(ln.lower().split()))
+
+def line_keys(text: str, min_chars: int = MIN_CHARS) -> np.ndarray:
+    # -> fingerprints of the distinct countable lines of a doc
+    keys = {fingerprint(n) for n in map(normalize_line, text.splitlines()) if len(n) >= min_chars}
+    return np.fromiter(keys, dtype=np.uint64, count=len(keys))
+
+def _range_keys(task, min_chars: int) -> np.ndarray:
+    keys = [line_keys(text, min_chars) for text in task_texts(task)]
+    return np.concatenate(keys) if keys else np.empty(0, dtype=np.uint64)
+
+def count_lines(files: list[Path], sketch: CountMinSketch, min_chars: int = MIN_CHARS,
+                workers: int = 1, chunk_mb: int = 64) -> None:
+    tasks = tasks_from(files, chunk_mb << 20)
+    count = partial(_range_keys, min_chars=min_chars)
+    bar = tqdm(desc="counting lines", unit="range", dynamic_ncols=True)
+    if workers > 1:
+        with Pool(workers) as pool:
+            for _, keys in ordered_results(pool, count, tasks, 2 * workers):
+                sketch.add(keys)
+                bar.update(1)
+    else:
+        for task, _ in tasks:
+            sketch.add(count(task))
+            bar.update(1)
+    bar.close()
+
+class BoilerplateFilter:
+    # -> stage transform; holds only the sketch path so it pickles cheaply into pool workers,
+    # -> each process memory-maps the sketch on first use
+    def __init__(self, sketch_path: Path, min_docs: int = MIN_DOCS, min_chars: int = MIN_CHARS):
+        self.sketch_path = sketch_path
+        self.min_docs = min_docs
+        self.min_chars = min_chars
+        self._sketch = None
+
+    def __getstate__(self) -> dict:
+        return {**self.__dict__, "_sketch": None}
+
+    def __call__(self, text: str) -> str:
+        lines = text.splitlines()
+        norm = [normalize_line(ln) for ln in lines]
+        cand = [i for i, n in enumerate(norm) if len(n) >= self.min_chars]
+        if not cand:
+            return text
+        if self._sketch is None:
+            self._sketch = CountMinSketch.load(self.sketch_path, mmap=True)
+        est = self._sketch.estimate(np.fromiter((fingerprint(norm[i]) for i in cand),
+                                                dtype=np.uint64, count=len(cand)))
+        drop = {cand[j] for j in np.flatnonzero(est >= self.min_docs).tolist()}
+        if not drop:
+            return text
+        return "\n".join(ln for i, ln in enumerate(lines) if i not in drop).strip()
+
+def is_empty(text: str) -> bool:
+    return not text
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="remove lines repeated across many docs (boilerplate)")
+    ap.add_argument("paths", nargs="+", help="input .jsonl file(s) or folder(s)")
+    ap.add_argument("-o", "--output", default="clean_boilerplate.jsonl",
+                    help="destination file (default: %(default)s)")
+    ap.add_argument("--min-docs", type=int, default=MIN_DOCS,
+                    help="remove lines found in at least N docs (default: %(default)s)")
+    ap.add_argument("--min-chars", type=int, default=MIN_CHARS,
+                    help="ignore normalized lines shorter than this (default: %(default)s)")
+    ap.add_argument("--sketch-mb", type=int, default=SKETCH_MB,
+                    help="memory of the count-min sketch (default: %(default)s)")
+    add_engine_args(ap)
+    args = ap.parse_args()
+
+    in_paths = [Path(p).expanduser() for p in args.paths]
+    out_path = Path(args.output).expanduser()
+    sketch_path = out_path.with_name(out_path.name + ".cms.npy")
+    opts = engine_options(args)
+
+    if opts["resume"] and sketch_path.exists():
+        print(f"reusing line counts from {sketch_path}")
+    else:
+        sketch = CountMinSketch.for_memory(max(1, args.sketch_mb))
+        count_lines(expand_inputs(in_paths), sketch, args.min_chars, opts["workers"], opts["chunk_mb"])
+        sketch.save(sketch_path)
+        del sketch
+
+    stage = Stage("boilerplate", transform=BoilerplateFilter(sketch_path, args.min_docs, args.min_chars),
+                  drop=is_empty)
+    total_raw, total_kept = clean_corpus(in_paths, out_path, [stage], desc="Boilerplate",
+                                         flush_every=10_000, **opts)
+
+    print(f"\n {total_raw:,} raw -> {total_kept:,} kept   ->  {out_path.resolve()}")
+
+
+if __name__ == "__main__":
+    main()
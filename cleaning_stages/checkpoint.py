@@ -0,0 +1,54 @@
+import json, os
+from pathlib import Path
+from dedup_index import DedupIndex, fsync_dir
+
+# -> periodic checkpoints for the cleaning engine, kept in <output>.ckpt/ next to the output file
+# -> a checkpoint is state.json (input position, output byte offset, counters, run settings) plus one
+# -> <stage>.<gen>.npy dedup index per stage; the indexes of generation `gen` are fully written and
+# -> fsynced (files and directory) before state.json is atomically replaced to point at them, and the
+# -> previous generation is only deleted once that replace is durable, so a crash or a pulled drive
+# -> at any moment leaves either the previous or the new checkpoint intact, never a mix of the two
+# -> the output is fsynced before every checkpoint, so on --resume it is truncated back to the
+# -> recorded offset and nothing is written twice or lost
+
+class Checkpoint:
+    def __init__(self, directory: Path):
+        self.dir = directory
+        self.state_path = directory / "state.json"
+
+    def exists(self) -> bool:
+        return self.state_path.exists()
+
+    def save(self, state: dict, seen: dict[str, DedupIndex]) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        old = self._read_state()
+        gen = old["gen"] + 1 if old else 0
+        for name, index in seen.items():
+            index.save(self.dir / f"{name}.{gen}.npy")     # -> fsyncs the file and the directory
+        tmp = self.state_path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as fh:
+            json.dump({**state, "gen": gen}, fh, ensure_ascii=False, indent=2)
+            fh.flush()
+            os.fsync(fh.fileno())
+        tmp.replace(self.state_path)
+        fsync_dir(self.dir)
+        if old:
+            for name in seen:
+                (self.dir / f"{name}.{old['gen']}.npy").unlink(missing_ok=True)
+
+    def load(self) -> tuple[dict, dict[str, DedupIndex]]:
+        state = self._read_state()
+        seen = {name: DedupIndex.load(self.dir / f"{name}.{state['gen']}.npy") for name in state["stages"]}
+        return state, seen
+
+    def clear(self) -> None:
+        if self.dir.exists():
+            for p in self.dir.iterdir():
+                p.unlink()
+            self.dir.rmdir()
+
+    def _read_state(self) -> dict | None:
+        if not self.state_path.exists():
+            return None
+        with self.state_path.open(encoding="utf-8") as fh:
+            return json.load(fh)
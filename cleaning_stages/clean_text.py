@@ -1,34 +1,51 @@
 
-import re, json, sys, hashlib, unicodedata, argparse, os
+import re, sys, unicodedata, argparse
 from pathlib import Path
-from typing import Iterator
-from tqdm import tqdm
+from keyword_matcher import KeywordMatcher
+from engine import Stage, clean_corpus, add_engine_args, engine_options
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))     # -> repo root, for char_stats
+from char_stats import CharStats
+
+# -> clean() = the document-level steps (fix_diacritics .. normalize_ws) followed by the line filters
+# -> (rm_code .. rm_noise); clean_steps() runs the filters one after another, each splitting and
+# -> re-joining the text, clean() applies all of them in a single loop over the lines
+# -> both give the same text, bench_clean.py checks that on a sample and times the two
+_HTML_RE = re.compile(r'<[^>]*>')
+# -> (literal every match contains, pattern) -> the regex only runs on docs that contain the literal
+_EMAIL_URL_RES = [('@', re.compile(r'\b\S+@\S+\.\S+\b')), ('http', re.compile(r'https?://\S+')),
+                  ('www.', re.compile(r'www\.\S+'))]
+_NOT_WHITELISTED = re.compile(r"[^0-9A-Za-zăâîșțĂÂÎȘȚ.,;:!?()\"'–\-\n\s]")
+_DOT_SPACE_RE = re.compile(r'(\.)\s*([A-ZĂÂÎȘȚ])')
+_PARA_RE = re.compile(r'\n{2,}')
+_WS_RUN_RE = re.compile(r'\s{2,}')
 
 def fix_diacritics(t: str) -> str:
-    return t.translate(str.maketrans({'ş': 'ș', 'Ş': 'Ș', 'ţ': 'ț', 'Ţ': 'Ț'}))
+    # -> cedilla -> comma below; four replace() calls beat translate() on non-ascii text
+    return t.replace('ş', 'ș').replace('Ş', 'Ș').replace('ţ', 'ț').replace('Ţ', 'Ț')
 
 def strip_html(t: str) -> str:
-    t = re.sub(r'<[^>]*>', '', t)
+    t = _HTML_RE.sub('', t)
     return t.replace('&lt;poem&gt;', '').replace('&lt;/poem&gt;', '')
 
 def strip_emails_urls(t: str) -> str:
-    pats = [r'\b\S+@\S+\.\S+\b', r'https?://\S+', r'www\.\S+']
-    for p in pats:
-        t = re.sub(p, '', t)
+    for literal, p in _EMAIL_URL_RES:
+        if literal in t:
+            t = p.sub('', t)
     return t
 
 def strip_nbsp(t: str) -> str:
     return t.replace('\u00A0', ' ').replace('&nbsp;', ' ')
 
 def whitelist_chars(t: str) -> str:
-    return re.sub(r"[^0-9A-Za-zăâîșțĂÂÎȘȚ.,;:!?()\"'–\-\n\s]", "", t)
+    return _NOT_WHITELISTED.sub("", t)
 
 def fix_dot_space(t: str) -> str:
-    return re.sub(r'(\.)\s*([A-ZĂÂÎȘȚ])', r'\1 \2', t)
+    return _DOT_SPACE_RE.sub(r'\1 \2', t)
 
 def normalize_ws(t: str) -> str:
-    t = re.sub(r'\n{2,}', '<<<P>>>', t).replace('\n', ' ')
-    t = re.sub(r'\s{2,}', ' ', t)
+    t = _PARA_RE.sub('<<<P>>>', t).replace('\n', ' ')
+    t = _WS_RUN_RE.sub(' ', t)
     return t.replace('<<<P>>>', '\n\n').strip()
 
 _SPAM = {"sex", "porno", "porn", "xxx", "bbw", "milf", "lesbian", "lesbiene",
@@ -37,16 +54,27 @@ _SPAM = {"sex", "porno", "porn", "xxx", "bbw", "milf", "lesbian", "lesbiene",
          "anunțuri", "escort", "fetish", "nud", "fund", "penis", "pula",
          "hardcore"}
 
+_SPAM_MATCH = KeywordMatcher(_SPAM, whole_words=True)
+_WORD_RE = re.compile(r'\b\w+\b')
+_SENT_END = re.compile(r'[.!?]')
+
+def _is_spam(ln: str) -> bool:
+    norm = unicodedata.normalize('NFKD', ln).lower()
+    hits = _SPAM_MATCH.count(norm)
+    # -> with <4 spam words the line can only be spam through the title-case rule,
+    # -> which needs a line without sentence punctuation -> skip tokenizing prose lines
+    if hits < 4 and _SENT_END.search(ln):
+        return False
+    w = _WORD_RE.findall(norm)
+    if len(w) < 6:
+        return False
+    if hits >= 4:
+        return True
+    titled = sum(tok[0].isupper() for tok in _WORD_RE.findall(ln))
+    return titled / len(w) > 0.6
+
 def rm_keyword_spam(text: str) -> str:
-    def spam(ln: str) -> bool:
-        w = re.findall(r'\b\w+\b', unicodedata.normalize('NFKD', ln).lower())
-        if len(w) < 6:
-            return False
-        if sum(tok in _SPAM for tok in w) >= 4:
-            return True
-        titled = sum(tok[0].isupper() for tok in re.findall(r'\b\w+\b', ln))
-        return titled / len(w) > 0.6 and not re.search(r'[.!?]', ln)
-    return '\n'.join(l for l in text.splitlines() if not spam(l.strip()))
+    return '\n'.join(l for l in text.splitlines() if not _is_spam(l.strip()))
 
 _AD_WORDS = {"pret", "preț", "oferte", "comparatii", "reducere", "magazine",
              "lei", "ron", "eur", "€", "în stoc", "cumpără", "comandă",
@@ -54,13 +82,17 @@ _AD_WORDS = {"pret", "preț", "oferte", "comparatii", "reducere", "magazine",
 _PRICE_RE = re.compile(
     r'\b\d{1,3}(?:[.,]\d{3})*[.,]\d{2}\s*(ron|lei|eur|€|\$)', re.I)
 
+_AD_MATCH = KeywordMatcher(_AD_WORDS)
+
+def _is_ad(ln: str, n_words: int) -> bool:
+    if n_words >= 2:
+        return True
+    return bool(_PRICE_RE.search(ln.lower()))
+
 def rm_ad_lines(text: str) -> str:
-    def is_ad(ln: str) -> bool:
-        low = ln.lower()
-        if _PRICE_RE.search(low):
-            return True
-        return sum(w in low for w in _AD_WORDS) >= 2
-    return '\n'.join(ln for ln in text.splitlines() if not is_ad(ln.strip()))
+    lines = text.splitlines()
+    hits = _AD_MATCH.line_counts(text.lower())
+    return '\n'.join(ln for ln, n in zip(lines, hits) if not _is_ad(ln.strip(), n))
 
 _CODE = re.compile(r'''(?xi)
     ^\s*(function|var|const|let|class|import|export|return)\b |
@@ -70,35 +102,48 @@ _CODE = re.compile(r'''(?xi)
 def rm_code(text: str) -> str:
     return '\n'.join(ln for ln in text.splitlines() if not _CODE.search(ln))
 
+_WIKI_LINK_RE = re.compile(r'\[\[.*]]')
+_RULE_RE = re.compile(r'[-–—]{3,}')
+
+def _is_table(ln: str) -> bool:
+    if ln.count('|') >= 2:
+        return True
+    if _WIKI_LINK_RE.search(ln):
+        return True
+    if _RULE_RE.fullmatch(ln):
+        return True
+    return False
+
 def rm_table(text: str) -> str:
-    def looks_tbl(ln):
-        if ln.count('|') >= 2:
-            return True
-        if re.search(r'\[\[.*]]', ln):
-            return True
-        if re.fullmatch(r'[-–—]{3,}', ln):
-            return True
-        return False
     return '\n'.join(ln for ln in text.splitlines()
-                     if not looks_tbl(ln.strip()))
+                     if not _is_table(ln.strip()))
+
+_BOX_RE = re.compile(r'[│─┌┐└┘├┤┬┴┼═║╔╗╝╚•·◦\s]+')
+_NUMERIC_RE = re.compile(r'[0-9\s.,:/()%+\-]+')
+_NON_LETTER_RE = re.compile(r'[^A-Za-zĂÂÎȘȚăâîșț]')
+
+def _is_noise(ln: str, n_alpha: int) -> bool:
+    # -> n_alpha = number of str.isalpha() characters of ln
+    if len(ln) < 5 or len(ln.split()) <= 2:
+        return True
+    if _BOX_RE.fullmatch(ln):
+        return True
+    if _NUMERIC_RE.fullmatch(ln):
+        return True
+    if (len(ln) - n_alpha) / len(ln) > .8:
+        return True
+    alpha = _NON_LETTER_RE.sub('', ln)
+    return alpha.isupper() and len(alpha) > 3
+
+def _stripped_lines(text: str) -> tuple[list[str], list[str], list[int]]:
+    # -> (lines, stripped lines, letters per stripped line)
+    raw = text.splitlines()
+    lines = [ln.strip() for ln in raw]
+    return raw, lines, CharStats('\n'.join(lines)).alpha().tolist()
 
 def rm_noise(text: str) -> str:
-    out = []
-    for ln in text.splitlines():
-        ln = ln.strip()
-        if len(ln) < 5 or len(ln.split()) <= 2:
-            continue
-        if re.fullmatch(r'[│─┌┐└┘├┤┬┴┼═║╔╗╝╚•·◦\s]+', ln):
-            continue
-        if re.fullmatch(r'[0-9\s.,:/()%+\-]+', ln):
-            continue
-        if sum(not c.isalpha() for c in ln) / len(ln) > .8:
-            continue
-        alpha = re.sub(r'[^A-Za-zĂÂÎȘȚăâîșț]', '', ln)
-        if alpha.isupper() and len(alpha) > 3:
-            continue
-        out.append(ln)
-    return '\n'.join(out)
+    _, lines, n_alpha = _stripped_lines(text)
+    return '\n'.join(ln for ln, n in zip(lines, n_alpha) if not _is_noise(ln, n))
 
 def to_chunks(text: str, max_chars: int = 3000) -> list[str]:
     sents = re.split(r'(?<=[.!?])\s+(?=[A-ZĂÂÎȘȚ])', text)
@@ -117,7 +162,7 @@ def to_chunks(text: str, max_chars: int = 3000) -> list[str]:
         cur.append(buf)
     return cur
 
-def clean(text: str) -> str:
+def normalize_doc(text: str) -> str:
     text = fix_diacritics(str(text))
     text = strip_html(text)
     text = strip_emails_urls(text)
@@ -125,6 +170,11 @@ def clean(text: str) -> str:
     text = whitelist_chars(text)
     text = fix_dot_space(text)
     text = normalize_ws(text)
+    return text
+
+def clean_steps(text: str) -> str:
+    # -> reference pipeline, one filter pass per step
+    text = normalize_doc(text)
     text = rm_code(text)
     text = rm_table(text)
     text = rm_keyword_spam(text)
@@ -132,22 +182,22 @@ def clean(text: str) -> str:
     text = rm_noise(text)
     return text
 
-def iter_input(paths: list[Path]) -> Iterator[str]:
-    for p in paths:
-        if p.is_dir():
-            for f in p.rglob("*.jsonl"):
-                yield from iter_input([f])
-        elif p.suffix == ".jsonl":
-            with p.open(encoding="utf-8") as fh:
-                for ln in fh:
-                    try:
-                        obj = json.loads(ln)
-                        if "text" in obj:
-                            yield obj["text"]
-                    except json.JSONDecodeError:
-                        continue
-        else:
-            yield p.read_text(encoding="utf-8")
+def clean(text: str) -> str:
+    # -> every filter above only looks at its own line, so a line survives the chain iff it passes
+    # -> all of them -> one loop, cheapest checks first, a line is stripped once like rm_noise does
+    out = []
+    for raw, ln, n_alpha in zip(*_stripped_lines(normalize_doc(text))):
+        if _is_noise(ln, n_alpha) or _CODE.search(raw) or _is_table(ln):
+            continue
+        if _is_ad(ln, _AD_MATCH.count(ln.lower(), limit=2)) or _is_spam(ln):
+            continue
+        out.append(ln)
+    return '\n'.join(out)
+
+def too_short(text: str) -> bool:
+    return len(text) < 50
+
+STAGE = Stage("stage1", transform=clean, drop=too_short, split=to_chunks)
 
 def main():
     ap = argparse.ArgumentParser(description="Clean Romanian .jsonl corpora")
@@ -155,42 +205,15 @@ def main():
                     help="input .jsonl file(s) or folder(s)")
     ap.add_argument("-o", "--output", default="clean_ro.jsonl",
                     help="output file")
+    add_engine_args(ap)
     args = ap.parse_args()
 
     in_paths = [Path(p) for p in args.paths]
     out_path = Path(args.output)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-
-    fh = out_path.open("w", encoding="utf-8")
-    flush_every = 10_000
-
-    seen_sha = set()
-    total_raw = total_kept = written = 0
-
-    for text in tqdm(iter_input(in_paths), desc="Cleaning", unit="obj",
-                     dynamic_ncols=True, smoothing=0.1):
-        total_raw += 1
-        txt = clean(text)
-        if len(txt) < 50:
-            continue
-        sha = hashlib.sha1(txt.encode()).hexdigest()
-        if sha in seen_sha:
-            continue
-        seen_sha.add(sha)
-
-        for chunk in to_chunks(txt):
-            json.dump({"text": chunk}, fh, ensure_ascii=False)
-            fh.write("\n")
-            total_kept += 1
-            written += 1
-
-            if written % flush_every == 0:
-                fh.flush()
-                os.fsync(fh.fileno())
 
-    fh.flush()
-    os.fsync(fh.fileno())
-    fh.close()
+    total_raw, total_kept = clean_corpus(in_paths, out_path, [STAGE],
+                                         desc="Cleaning", flush_every=10_000,
+                                         **engine_options(args))
 
     print(f"\n{total_raw:,} raw -> {total_kept:,} cleaned parts")
     print(f"saved to {out_path.resolve()}")
@@ -0,0 +1,54 @@
+from pathlib import Path
+import numpy as np
+
+# -> count-min sketch over 64-bit keys, fixed memory whatever the number of distinct keys
+# -> `depth` rows of `width` uint32 counters; a key increments one counter per row and its estimate
+# -> is the smallest of those counters -> never below the true count, above it only through
+# -> collisions (by at most ~ e * total / width with probability 1 - e^-depth)
+# -> row indices are multiplicative hashes of the key (one odd multiplier per row, top bits),
+# -> so width is a power of two and add / estimate work on whole numpy arrays of keys
+# -> saved as a plain (depth, width) .npy; load(mmap=True) lets pool workers share the pages
+MULTIPLIERS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93,
+                         0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53, 0x94D049BB133111EB, 0xBF58476D1CE4E5B9],
+                        dtype=np.uint64)
+
+class CountMinSketch:
+    def __init__(self, width: int = 1 << 24, depth: int = 4, table: np.ndarray | None = None):
+        if table is None:
+            if width & (width - 1) or not 1 <= depth <= len(MULTIPLIERS):
+                raise ValueError(f"width must be a power of two and depth 1..{len(MULTIPLIERS)}")
+            table = np.zeros((depth, width), dtype=np.uint32)
+        self.table = table
+        self.depth, self.width = table.shape
+        self._shift = np.uint64(64 - (self.width.bit_length() - 1))
+
+    @classmethod
+    def for_memory(cls, mb: int, depth: int = 4) -> "CountMinSketch":
+        # -> the widest power-of-two sketch that fits in `mb` megabytes
+        width = 1 << max(10, ((mb << 20) // (4 * depth)).bit_length() - 1)
+        return cls(width, depth)
+
+    def _rows(self, keys: np.ndarray) -> np.ndarray:
+        # -> (depth, n) counter index of every key in every row
+        keys = np.asarray(keys, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            return (keys[None, :] * MULTIPLIERS[:self.depth, None]) >> self._shift
+
+    def add(self, keys) -> None:
+        for row, idx in zip(self.table, self._rows(keys)):
+            np.add.at(row, idx, 1)
+
+    def estimate(self, keys) -> np.ndarray:
+        idx = self._rows(keys)
+        return np.min(self.table[np.arange(self.depth)[:, None], idx], axis=0)
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with tmp.open("wb") as fh:
+            np.save(fh, self.table)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = False) -> "CountMinSketch":
+        return cls(table=np.load(path, mmap_mode="r" if mmap else None))
@@ -0,0 +1,137 @@
+import hashlib, os
+from pathlib import Path
+import numpy as np
+
+# -> compact exact-dedup index for the cleaning stages
+# -> documents are reduced to 64-bit blake2b fingerprints instead of 40-char sha1 hex strings
+# -> (~8 bytes per doc instead of ~150 in a python set, collisions stay negligible: ~3e-4 for 10^8 docs)
+# -> fingerprints live in a sorted uint64 numpy array plus a small python set of recent additions
+# -> that is merged into the array every `merge_every` inserts
+# -> the index is saved as a plain .npy, so a later run (or a later corpus addition) can load it,
+# -> optionally memory-mapped, and keep deduplicating against everything seen before
+# -> an optional bloom filter in front answers most "never seen" lookups without touching the array
+
+def fingerprint(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+
+def fsync_dir(directory: Path) -> None:
+    # -> makes renames / new files in `directory` durable
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _sorted_unique(keys) -> np.ndarray:
+    keys = np.sort(np.asarray(keys, dtype=np.uint64))
+    if len(keys) > 1:
+        keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+    return keys
+
+class DedupIndex:
+    def __init__(self, keys: np.ndarray | None = None, merge_every: int = 1 << 20,
+                 bloom_bits_per_key: int = 0):
+        self._keys = _sorted_unique(keys) if keys is not None else np.empty(0, np.uint64)
+        self._pending: set[int] = set()
+        self.merge_every = merge_every
+        self.bloom_bits_per_key = bloom_bits_per_key
+        self._bloom = None
+        if bloom_bits_per_key:
+            self._build_bloom()
+
+    def __len__(self) -> int:
+        return len(self._keys) + len(self._pending)
+
+    def __contains__(self, key: int) -> bool:
+        if key in self._pending:
+            return True
+        if self._bloom is not None and not self._bloom_has(key):
+            return False
+        keys = self._keys
+        i = keys.searchsorted(np.uint64(key))     # -> a bare python int >= 2**63 would go through object compares
+        return i < len(keys) and int(keys[i]) == key
+
+    def add(self, key: int) -> None:
+        self._pending.add(key)
+        if self._bloom is not None:
+            self._bloom_add(key)
+        if len(self._pending) >= self.merge_every:
+            self.merge()
+
+    def update(self, keys) -> None:
+        # -> bulk insert (e.g. the keys a worker saw in one byte range)
+        keys = np.asarray(keys, dtype=np.uint64)
+        if len(keys) == 0:
+            return
+        self.merge()
+        self._keys = self._merge_sorted(self._keys, _sorted_unique(keys))
+        if self.bloom_bits_per_key:
+            self._build_bloom()
+
+    def merge(self) -> None:
+        if not self._pending:
+            return
+        new = np.fromiter(self._pending, dtype=np.uint64, count=len(self._pending))
+        new.sort()
+        self._keys = self._merge_sorted(self._keys, new)
+        self._pending.clear()
+        if self.bloom_bits_per_key and len(self._keys) * self.bloom_bits_per_key > 8 * len(self._bloom):
+            self._build_bloom()
+
+    @staticmethod
+    def _merge_sorted(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        # -> b sorted and unique; O(len(a) + len(b)) insert instead of re-sorting everything
+        if len(a) == 0:
+            return b
+        i = a.searchsorted(b)
+        hit = i < len(a)
+        hit[hit] = a[i[hit]] == b[hit]
+        return np.insert(a, i[~hit], b[~hit])
+
+    # -> bloom filter (k = 3 probes from double hashing the fingerprint, sized at build time)
+    def _probes(self, key: int):
+        m = 8 * len(self._bloom)
+        h1, h2 = key & 0xFFFFFFFF, (key >> 32) | 1
+        return [(h1 + i * h2) % m for i in range(3)]
+
+    def _bloom_has(self, key: int) -> bool:
+        bloom = self._bloom
+        return all(bloom[p >> 3] >> (p & 7) & 1 for p in self._probes(key))
+
+    def _bloom_add(self, key: int) -> None:
+        for p in self._probes(key):
+            self._bloom[p >> 3] |= 1 << (p & 7)
+
+    def _build_bloom(self) -> None:
+        n = max(len(self._keys) + len(self._pending), self.merge_every)
+        m = max(64, 2 * n * self.bloom_bits_per_key) // 8 * 8
+        bits = np.zeros(m // 8, dtype=np.uint8)
+        keys = np.concatenate([self._keys, np.fromiter(self._pending, np.uint64, len(self._pending))])
+        h1, h2 = keys & np.uint64(0xFFFFFFFF), (keys >> np.uint64(32)) | np.uint64(1)
+        for i in range(3):
+            pos = (h1 + np.uint64(i) * h2) % np.uint64(m)
+            np.bitwise_or.at(bits, pos >> np.uint64(3), (1 << (pos & np.uint64(7))).astype(np.uint8))
+        self._bloom = bytearray(bits.tobytes())
+
+    # -> persistence
+    def keys(self) -> np.ndarray:
+        self.merge()
+        return self._keys
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with tmp.open("wb") as fh:
+            np.save(fh, self.keys())
+            fh.flush()
+            os.fsync(fh.fileno())
+        tmp.replace(path)
+        fsync_dir(path.parent)
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = False, **kw) -> "DedupIndex":
+        index = cls(**kw)
+        index._keys = np.load(path, mmap_mode="r" if mmap else None)
+        if index.bloom_bits_per_key:
+            index._build_bloom()
+        return index
@@ -0,0 +1,383 @@
+import sys, time
+from collections import deque
+from dataclasses import dataclass
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Callable, Iterator
+from tqdm import tqdm
+from rules import profile_rows, write_profile
+from dedup_index import DedupIndex, fingerprint
+from checkpoint import Checkpoint
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))     # -> repo root, for jsonl_io
+from jsonl_io import (JsonlWriter, open_read, iter_blocks, iter_docs, block_docs, read_range, is_jsonl, is_zst,
+                      bounded_imap)
+from doc_index import DocIndex
+
+# -> streaming engine shared by all cleaning stages
+# -> each stage is a small recipe (transform -> drop -> dedup -> split) applied per document,
+# -> so chaining stages 1-4 reads, parses and writes the 20GB jsonl only once
+# -> the per-stage scripts are just presets that run a single stage through the same engine
+# -> with --workers N the input jsonl is cut into newline-aligned byte ranges that are cleaned
+# -> in a process pool; results come back in input order and dedup is merged globally
+# -> with --profile PATH the rule sets of the stages count hits / time per rule and the totals are
+# -> written to PATH (json, or csv by suffix) at the end of the run
+# -> --rule-warmup N sets how many docs each rule set times before re-sorting its rules by
+# -> cost / hit rate (0 = keep the declared order); keep/drop decisions are the same either way
+# -> dedup keys are 64-bit fingerprints kept in one DedupIndex per stage; with --dedup-index DIR the
+# -> indexes are loaded from / saved to DIR/<stage>.npy, so later runs and corpus additions dedup
+# -> against everything an earlier run of the same stage chain has seen
+# -> every --checkpoint-secs the output is fsynced and a checkpoint (input file + byte offset, output
+# -> byte offset, counters, dedup indexes) goes to <output>.ckpt/; --resume continues from it as if
+# -> the run had never stopped (--profile counters and the rule warm-up start over)
+# -> a run without --resume refuses to start while <output>.ckpt/ holds a checkpoint
+# -> inputs and output may be .jsonl.zst (see jsonl_io); a compressed input can't be cut into byte
+# -> ranges, so in parallel mode the parent decompresses it and hands the workers newline-aligned
+# -> chunks instead (offsets of .zst inputs are positions in the decompressed stream)
+# -> a plain input with a fresh document index (doc_index.py) is cut on the document starts it lists
+# -> the output is fsynced every `flush_every` kept docs (0 -> only at checkpoints and the end)
+
+@dataclass
+class Stage:
+    name: str
+    transform: Callable[[str], str] | None = None
+    drop: Callable[[str], bool] | None = None
+    split: Callable[[str], list[str]] | None = None
+    dedup: bool = True
+    rules: object | None = None     # -> RuleSet behind drop, profiled with --profile
+    # -> build drop from the stage's own RuleSet (drop=RULES.should_drop, not a module function that
+    # -> calls the global): a spawned worker unpickles its own copy of the stage, and only then do
+    # -> drop and rules share that copy, so --profile counts and --rule-warmup reach the rules it runs
+
+def expand_inputs(paths: list[Path]) -> list[Path]:
+    files = []
+    for p in paths:
+        if p.is_dir():
+            files.extend(sorted(f for f in p.rglob("*") if f.is_file() and is_jsonl(f)))
+        else:
+            files.append(p)
+    return files
+
+def iter_input(paths: list[Path]) -> Iterator[str]:
+    for _, _, text in iter_positions(expand_inputs(paths)):
+        yield text
+
+def iter_positions(files: list[Path], file_idx: int = 0, offset: int = 0) -> Iterator[tuple[int, int, str]]:
+    # -> (file index, byte offset, text) where (file index, byte offset) is the input position
+    # -> right after this doc, i.e. where a resumed run starts reading again
+    for fi in range(file_idx, len(files)):
+        p = files[fi]
+        if not is_jsonl(p):
+            with open_read(p) as fh:
+                yield fi + 1, 0, fh.read().decode("utf-8")
+            continue
+        pos = offset if fi == file_idx else 0
+        for pos, text in iter_docs(p, pos):
+            yield fi, pos, text
+
+def run_stages(text: str, stages: list[Stage], seen: dict) -> list[tuple[tuple[int, ...], str]]:
+    # -> push one document through every stage, a stage may fan out (stage 1 chunks)
+    # -> `seen` maps stage name -> set or DedupIndex of fingerprints
+    # -> every surviving doc is returned with its fingerprint at each dedup stage (in stage order),
+    # -> the keys the parallel mode uses to merge dedup across ranges
+    docs = [((), text)]
+    for st in stages:
+        out = []
+        for keys, doc in docs:
+            if st.transform is not None:
+                doc = st.transform(doc)
+            if st.drop is not None and st.drop(doc):
+                continue
+            if st.dedup:
+                key = fingerprint(doc)
+                if key in seen[st.name]:
+                    continue
+                seen[st.name].add(key)
+                keys = keys + (key,)
+            out.extend((keys, d) for d in (st.split(doc) if st.split is not None else [doc]))
+        docs = out
+        if not docs:
+            break
+    return docs
+
+def clean_corpus(in_paths: list[Path], out_path: Path, stages: list[Stage],
+                 desc: str = "Cleaning", flush_every: int = 10_000,
+                 workers: int = 1, shards: bool = False, chunk_mb: int = 64,
+                 profile: Path | None = None, rule_warmup: int | None = None,
+                 dedup_index: Path | None = None, checkpoint_secs: int = 600,
+                 resume: bool = False) -> tuple[int, int]:
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    ckpt = Checkpoint(out_path.with_name(out_path.name + ".ckpt"))
+    files = expand_inputs(in_paths)
+    state = None
+    if resume and ckpt.exists():
+        state, seen = ckpt.load()
+        _check_resume(state, files, stages)
+        print(f"resuming after {state['raw']:,} docs ({state['kept']:,} kept)")
+    else:
+        if resume:
+            print(f"no checkpoint in {ckpt.dir} -> starting from the beginning")
+        elif ckpt.exists():
+            # -> never throw away an interrupted run by forgetting --resume
+            raise SystemExit(f"{ckpt.dir} holds the checkpoint of an interrupted run: pass --resume to "
+                             f"continue it, or delete the directory to start over")
+        ckpt.clear()
+        seen = load_indexes(stages, dedup_index)
+    if rule_warmup is not None:
+        for st in stages:
+            if st.rules is not None:
+                st.rules.set_warmup(rule_warmup)
+    if profile is not None:
+        _enable_profile(stages)
+    run = _Run(files, stages, seen, ckpt, checkpoint_secs, state)
+    if workers > 1 or shards:
+        totals = _clean_parallel(run, out_path, desc, flush_every,
+                                 workers, shards, chunk_mb << 20, profile is not None)
+    else:
+        totals = _clean_serial(run, out_path, desc, flush_every)
+    if dedup_index is not None:
+        save_indexes(seen, dedup_index)
+    if profile is not None:
+        write_profile(profile, profile_rows(stages))
+    ckpt.clear()
+    return totals
+
+def _check_resume(state: dict, files: list[Path], stages: list[Stage]) -> None:
+    if state["stages"] != [st.name for st in stages]:
+        raise SystemExit(f"checkpoint was written for stages {state['stages']}, not {[st.name for st in stages]}")
+    if state["files"] != [str(p) for p in files]:
+        raise SystemExit("checkpoint was written for a different list of input files")
+
+class _Run:
+    # -> position + counters of a (possibly resumed) run and the periodic checkpointing
+    def __init__(self, files, stages, seen, ckpt, checkpoint_secs, state):
+        self.files, self.stages, self.seen = files, stages, seen
+        self.ckpt, self.checkpoint_secs = ckpt, checkpoint_secs
+        state = state or {"file": 0, "offset": 0, "raw": 0, "kept": 0, "out": None, "shard": 0}
+        self.file_idx, self.offset = state["file"], state["offset"]
+        self.total_raw, self.total_kept = state["raw"], state["kept"]
+        self.out_offset, self.shard = state["out"], state["shard"]
+        self._last = time.monotonic()
+
+    def open_output(self, path: Path, sync_every: int = 0) -> JsonlWriter:
+        # -> a resumed run cuts the output back to what the checkpoint had fsynced
+        return JsonlWriter(path, sync_every, self.out_offset)
+
+    def checkpoint_due(self) -> bool:
+        return self.checkpoint_secs > 0 and time.monotonic() - self._last >= self.checkpoint_secs
+
+    def checkpoint(self, fh) -> None:
+        if fh is not None:
+            self.out_offset = fh.sync()
+        self.ckpt.save({
+            "files": [str(p) for p in self.files], "stages": [st.name for st in self.stages],
+            "file": self.file_idx, "offset": self.offset, "raw": self.total_raw,
+            "kept": self.total_kept, "out": self.out_offset, "shard": self.shard,
+        }, self.seen)
+        self._last = time.monotonic()
+
+def load_indexes(stages: list[Stage], index_dir: Path | None) -> dict[str, DedupIndex]:
+    seen = {}
+    for st in stages:
+        path = index_dir / f"{st.name}.npy" if index_dir is not None else None
+        seen[st.name] = DedupIndex.load(path) if path is not None and path.exists() else DedupIndex()
+    return seen
+
+def save_indexes(seen: dict[str, DedupIndex], index_dir: Path) -> None:
+    for name, index in seen.items():
+        index.save(index_dir / f"{name}.npy")
+
+def _enable_profile(stages: list[Stage]) -> None:
+    for st in stages:
+        if st.rules is not None:
+            st.rules.enable_profile()
+
+def _clean_serial(run: _Run, out_path, desc, flush_every):
+    stages, seen = run.stages, run.seen
+
+    with run.open_output(out_path, flush_every) as fh:
+        for file_idx, offset, text in tqdm(iter_positions(run.files, run.file_idx, run.offset),
+                                           desc=desc, unit="obj", initial=run.total_raw,
+                                           dynamic_ncols=True, smoothing=0.1):
+            run.total_raw += 1
+            for _, doc in run_stages(text, stages, seen):
+                fh.write_text(doc)
+                run.total_kept += 1
+            run.file_idx, run.offset = file_idx, offset
+            if run.checkpoint_due():
+                run.checkpoint(fh)
+
+    return run.total_raw, run.total_kept
+
+# -> parallel mode
+# -> a task is (file, start, end) for jsonl files, (file, None, None) for plain text files and the
+# -> raw bytes of a chunk for compressed jsonl files
+# -> stages are pure per-document functions, so a doc survives iff it passes every filter and none
+# -> of its dedup-stage texts was seen earlier in input order (or is in an index loaded with
+# -> --dedup-index) -> workers dedup locally and return every kept doc with its key at each dedup
+# -> stage; the parent checks each key against that stage's index as it stood before the range,
+# -> giving the same output as serial mode, then folds every stage's range-local keys into that
+# -> stage's index (the union of the local sets is exactly what serial mode would have stored)
+
+def byte_ranges(path: Path, chunk_bytes: int, start: int = 0) -> list[tuple[int, int]]:
+    size = path.stat().st_size
+    ranges = []
+    idx = DocIndex.load(path)
+    if idx is not None:
+        # -> the range ends at the first document starting at or after start + chunk_bytes
+        while start < size:
+            end = min(start + chunk_bytes, size)
+            end = int(idx.offsets[np.searchsorted(idx.offsets, end)])
+            ranges.append((start, end))
+            start = end
+        return ranges
+    with path.open("rb") as fh:
+        while start < size:
+            end = min(start + chunk_bytes, size)
+            if end < size:
+                fh.seek(end)
+                fh.readline()
+                end = fh.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def tasks_from(files: list[Path], chunk_bytes: int, file_idx: int = 0, offset: int = 0) -> Iterator[tuple[object, tuple[int, int]]]:
+    # -> every task comes with the input position right after it (for checkpoints)
+    for fi in range(file_idx, len(files)):
+        p = files[fi]
+        start = offset if fi == file_idx else 0
+        if is_jsonl(p) and is_zst(p):
+            yield from ((data, (fi, end)) for end, data in iter_blocks(p, start, chunk_bytes))
+        elif is_jsonl(p):
+            yield from (((p, a, b), (fi, b)) for a, b in byte_ranges(p, chunk_bytes, start))
+        else:
+            yield (p, None, None), (fi + 1, 0)
+
+def ordered_results(pool, func, tasks, window: int):
+    # -> bounded_imap over (task, input position) pairs: (position, result) in input order, so
+    # -> decompressed chunks don't pile up in memory faster than the workers clean them
+    positions = deque()
+
+    def feed():
+        for task, pos in tasks:
+            positions.append(pos)
+            yield task
+
+    for res in bounded_imap(pool, func, feed(), window):
+        yield positions.popleft(), res
+
+_worker_stages: list[Stage] = []
+
+def _init_worker(stages: list[Stage], profile: bool = False) -> None:
+    global _worker_stages
+    _worker_stages = stages
+    if profile:
+        _enable_profile(stages)
+
+def _take_stats() -> dict[str, dict]:
+    return {st.name: st.rules.take_stats() for st in _worker_stages
+            if st.rules is not None and st.rules.stats is not None}
+
+def _range_keys(seen: dict[str, set]) -> dict[str, np.ndarray]:
+    return {name: np.fromiter(keys, dtype=np.uint64, count=len(keys)) for name, keys in seen.items()}
+
+def task_texts(task) -> list[str]:
+    # -> the docs of one task (see tasks_from)
+    if isinstance(task, bytes):
+        return block_docs(task)
+    path, start, end = task
+    if start is None:
+        with open_read(path) as fh:
+            return [fh.read().decode("utf-8")]
+    return block_docs(read_range(path, start, end))
+
+def _clean_range(task) -> tuple[int, list[tuple[tuple[int, ...], str]], dict, dict]:
+    # -> rule stats cover the docs that reached each filter in this range, so a doc that is only
+    # -> a duplicate across ranges is still counted (serial mode would have deduped it earlier)
+    seen = {st.name: set() for st in _worker_stages}
+    texts = task_texts(task)
+    kept = []
+    for text in texts:
+        kept.extend(run_stages(text, _worker_stages, seen))
+    return len(texts), kept, _take_stats(), _range_keys(seen)
+
+def _clean_parallel(run: _Run, out_path, desc, flush_every, workers, shards, chunk_bytes,
+                    profile=False):
+    stages, seen = run.stages, run.seen
+    tasks = tasks_from(run.files, chunk_bytes, run.file_idx, run.offset)
+    n_tasks = None
+    if not any(is_zst(p) for p in run.files):
+        tasks = list(tasks)     # -> byte ranges are cheap to list up front -> progress bar with a total
+        n_tasks = len(tasks)
+    dedup_indexes = [seen[st.name] for st in stages if st.dedup]
+    fh = None if shards else run.open_output(out_path, flush_every)
+
+    by_name = {st.name: st for st in stages}
+
+    with Pool(workers, initializer=_init_worker, initargs=(stages, profile)) as pool, \
+         tqdm(total=n_tasks, desc=desc, unit="range", dynamic_ncols=True) as bar:
+        for pos, (n_raw, kept, stats, range_keys) in ordered_results(pool, _clean_range, tasks, 2 * workers):
+            run.total_raw += n_raw
+            for name, rule_stats in stats.items():
+                by_name[name].rules.merge_stats(rule_stats)
+            if shards:
+                fh = JsonlWriter(shard_path(out_path, run.shard))
+
+            for keys, doc in kept:
+                if any(key in index for key, index in zip(keys, dedup_indexes)):
+                    continue
+                fh.write_text(doc)
+                run.total_kept += 1
+            for st in stages:
+                if st.dedup:
+                    seen[st.name].update(range_keys[st.name])
+
+            if shards:
+                fh.close()
+                run.shard += 1
+            run.file_idx, run.offset = pos
+            if run.checkpoint_due():
+                run.checkpoint(None if shards else fh)
+            bar.update(1)
+
+    if not shards:
+        fh.close()
+
+    return run.total_raw, run.total_kept
+
+def shard_path(out_path: Path, i: int) -> Path:
+    # -> clean.jsonl -> clean.00003.jsonl, clean.jsonl.zst -> clean.00003.jsonl.zst
+    suffix = "".join(out_path.suffixes[-2:]) if is_zst(out_path) else out_path.suffix
+    stem = out_path.name[:len(out_path.name) - len(suffix)]
+    return out_path.with_name(f"{stem}.{i:05d}{suffix}")
+
+def add_engine_args(ap) -> None:
+    ap.add_argument("--workers", type=int, default=1,
+                    help="worker processes, >1 cleans byte ranges in parallel (default: %(default)s)")
+    ap.add_argument("--shards", action="store_true",
+                    help="write one numbered shard per byte range instead of a single ordered file")
+    ap.add_argument("--chunk-mb", type=int, default=64,
+                    help="size of the byte ranges handed to workers (default: %(default)s)")
+    ap.add_argument("--profile", metavar="PATH",
+                    help="record per-rule evaluated / fired / first-hit / time counts and write "
+                         "them to PATH (.csv or .json)")
+    ap.add_argument("--dedup-index", metavar="DIR",
+                    help="load / save the per-stage dedup fingerprints in DIR so later runs skip "
+                         "documents an earlier run already saw")
+    ap.add_argument("--checkpoint-secs", type=int, metavar="N", default=600,
+                    help="write a resumable checkpoint to <output>.ckpt/ every N seconds, "
+                         "0 disables it (default: %(default)s)")
+    ap.add_argument("--resume", action="store_true",
+                    help="continue an interrupted run from its last checkpoint")
+    ap.add_argument("--rule-warmup", type=int, metavar="N", default=1000,
+                    help="docs timed before the drop rules are re-ordered by cost / hit rate, "
+                         "0 keeps the declared order (default: %(default)s)")
+
+def engine_options(args) -> dict:
+    return {"workers": max(1, args.workers), "shards": args.shards, "chunk_mb": max(1, args.chunk_mb),
+            "profile": Path(args.profile).expanduser() if args.profile else None,
+            "rule_warmup": max(0, args.rule_warmup),
+            "dedup_index": Path(args.dedup_index).expanduser() if args.dedup_index else None,
+            "checkpoint_secs": max(0, args.checkpoint_secs), "resume": args.resume}
@@ -1,21 +1,7 @@
-import re, json, os, argparse, hashlib
+import re, argparse
 from pathlib import Path
-from typing   import Iterator
-from tqdm     import tqdm
-
-def iter_text(p: Path) -> Iterator[str]:
-    if p.is_dir():
-        for f in p.rglob("*.jsonl"):
-            yield from iter_text(f)
-        return
-    with p.open(encoding="utf-8") as fh:
-        for ln in fh:
-            try:
-                obj = json.loads(ln)
-                if "text" in obj:
-                    yield obj["text"]
-            except json.JSONDecodeError:
-                continue
+from rules    import RuleSet, Count, Present, Literal, word_count
+from engine   import Stage, clean_corpus, add_engine_args, engine_options
 
 DATE_RE = re.compile(r'\d{2}\.\d{2}\.\d{4}')
 _HAS_URL = re.compile(r'https?://\S+|www\.\S+|\b\w+\.(?:com|net|org|info|gov|edu|ro|eu|uk|de|fr|it|es|pl|cz|co)\b', re.I)
@@ -35,34 +21,53 @@ _SCOALA_RE    = re.compile(r'\bSCOALA\s+CU\s+CLASELE', re.I)
 _ARCHIVE_RE   = re.compile(r'\bArchives\s+-', re.I)
 _HOTEL_DIST   = re.compile(r'Distanța\s+de\s+la\s+.+?km', re.I)
 
-def admin_footer(t):   return _ADMIN_FOOTER.search(t) and token_count(t) < 40
-def flight_table(t):   return (len(DATE_RE.findall(t)) >= 20 and FLIGHT_RE.search(t)) or _RYANAIR_RE.search(t)
-def it_school_dump(t): return _IT_BLOG_RE.search(t) or _COURSE_RE.search(t)
-def forum_reply_dump(t): return len(_FORUM_REPLY.findall(t)) >= 2
-def tractor_list(t):   return _TRACTOR_HEAD.search(t) and len(re.findall(r'\d{3,4}', t)) > 100
-def firm_catalog(t):   return _TERMENE.search(t) and 'LISTA FIRME' in t.upper()
-def sonde_log(t):      return _SONDE_RE.search(t) and 'RELE' in t.upper()
-def parish_stub(t):    return _RUGACIUNE_RE.search(t)
-def isj_dolj_dropdown(t): return _ISJ_DOLJ_RE.search(t) or len(_SCOALA_RE.findall(t)) >= 40
-def misc_lists(t):     return _ARCHIVE_RE.search(t) or _HOTEL_DIST.search(t)
-def has_url(t):        return bool(_HAS_URL.search(t))
-def brainly(t):        return 'brainly.ro' in t.lower()
+_DIGITS_3_4   = re.compile(r'\d{3,4}')
+
+FEATURES = {
+    "tokens":       word_count,
+    "brainly":      Literal("brainly.ro"),
+    "url":          Present(_HAS_URL),
+    "admin_footer": Present(_ADMIN_FOOTER),
+    "dates":        Count(DATE_RE),
+    "flight":       Present(FLIGHT_RE),
+    "ryanair":      Present(_RYANAIR_RE),
+    "it_blog":      Present(_IT_BLOG_RE),
+    "course":       Present(_COURSE_RE),
+    "forum_reply":  Count(_FORUM_REPLY),
+    "tractor_head": Present(_TRACTOR_HEAD),
+    "digits_3_4":   Count(_DIGITS_3_4),
+    "termene":      Present(_TERMENE),
+    "lista_firme":  Literal("LISTA FIRME", upper=True),
+    "sonde":        Present(_SONDE_RE),
+    "rele":         Literal("RELE", upper=True),
+    "rugaciune":    Present(_RUGACIUNE_RE),
+    "isj_dolj":     Present(_ISJ_DOLJ_RE),
+    "scoala":       Count(_SCOALA_RE),
+    "archive":      Present(_ARCHIVE_RE),
+    "hotel_dist":   Present(_HOTEL_DIST),
+}
+
+# -> any rule that fires drops the doc; this is the order used before the warm-up re-sort and by --profile
+RULES = RuleSet(FEATURES, {
+    "too_few_tokens":    "tokens < 75",
+    "brainly":           "brainly",
+    "has_url":           "url",
+    "admin_footer":      "admin_footer & tokens < 40",
+    "flight_table":      "flight & dates >= 20 | ryanair",
+    "it_school_dump":    "it_blog | course",
+    "forum_reply_dump":  "forum_reply >= 2",
+    "tractor_list":      "tractor_head & digits_3_4 > 100",
+    "firm_catalog":      "termene & lista_firme",
+    "sonde_log":         "sonde & rele",
+    "parish_stub":       "rugaciune",
+    "isj_dolj_dropdown": "isj_dolj | scoala >= 40",
+    "misc_lists":        "archive | hotel_dist",
+})
 
 def should_drop(txt: str) -> bool:
-    if token_count(txt) < 75:          return True
-    if brainly(txt):                   return True
-    if has_url(txt):                   return True
-    if admin_footer(txt):              return True
-    if flight_table(txt):              return True
-    if it_school_dump(txt):            return True
-    if forum_reply_dump(txt):          return True
-    if tractor_list(txt):              return True
-    if firm_catalog(txt):              return True
-    if sonde_log(txt):                 return True
-    if parish_stub(txt):               return True
-    if isj_dolj_dropdown(txt):         return True
-    if misc_lists(txt):                return True
-    return False
+    return RULES.should_drop(txt)
+
+STAGE = Stage("stage4", drop=RULES.should_drop, rules=RULES)
 
 FLUSH_EVERY = 1_000 
 def main() -> None:
@@ -70,36 +75,14 @@ def main() -> None:
     ap.add_argument("input",  help="stage-3 / stage-4 source .jsonl (or folder)")
     ap.add_argument("-o", "--output", default="clean_stage4f.jsonl",
                     help="destination file (default: %(default)s)")
+    add_engine_args(ap)
     args = ap.parse_args()
 
     src, dst = Path(args.input).expanduser(), Path(args.output).expanduser()
-    dst.parent.mkdir(parents=True, exist_ok=True)
-
-    seen_sha = set()
-    kept = 0
-
-    with dst.open("w", encoding="utf-8") as fh_out:
-        for raw in tqdm(iter_text(src), desc="Stage-4 f", unit="obj",
-                        dynamic_ncols=True, smoothing=0.1):
-
-            if should_drop(raw):
-                continue
-            sha = hashlib.sha1(raw.encode()).hexdigest()
-            if sha in seen_sha:
-                continue
-            seen_sha.add(sha)
-
-            json.dump({"text": raw}, fh_out, ensure_ascii=False)
-            fh_out.write("\n")
-            kept += 1
-
-            if kept % FLUSH_EVERY == 0:
-                fh_out.flush()
-                os.fsync(fh_out.fileno())
 
-        # final sync
-        fh_out.flush()
-        os.fsync(fh_out.fileno())
+    _, kept = clean_corpus([src], dst, [STAGE],
+                           desc="Stage-4 f", flush_every=FLUSH_EVERY,
+                           **engine_options(args))
 
     print(f"\nkept {kept:,} chunks  →  {dst.resolve()}  (flushed every {FLUSH_EVERY})")
 
@@ -0,0 +1,50 @@
+import argparse
+from pathlib import Path
+from engine import clean_corpus, add_engine_args, engine_options
+import clean_text, second_stage_clean, third_stage_clean, four_stage_clean
+from lang_id import lang_stage
+
+# -> runs cleaning stages 1-4 in a single streaming pass over the raw corpus
+# -> same keep/drop decisions as running the four scripts one after another,
+# -> but the 20GB jsonl is parsed, hashed and written once and no intermediate files are left behind
+# -> with --lang-model the cheap language / quality prefilter (lang_id.py) runs first, so docs that
+# -> are not Romanian prose never reach the regex work of the stages
+STAGES = {
+    "1": clean_text.STAGE,
+    "2": second_stage_clean.STAGE,
+    "3": third_stage_clean.STAGE,
+    "4": four_stage_clean.STAGE,
+}
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="fused corpus cleaner (stages 1-4 in one pass)")
+    ap.add_argument("paths", nargs="+", help="input .jsonl file(s) or folder(s)")
+    ap.add_argument("-o", "--output", default="clean_fused.jsonl",
+                    help="destination file (default: %(default)s)")
+    ap.add_argument("--stages", default="1,2,3,4",
+                    help="comma separated stages to chain, in order (default: %(default)s)")
+    ap.add_argument("--flush", type=int, metavar="N", default=10_000,
+                    help="fsync the output every N lines, 0 = only at checkpoints and the end (default: %(default)s)")
+    ap.add_argument("--lang-model", metavar="PATH",
+                    help="language model from lang_id.py train; drops non-Romanian / garbage docs first")
+    ap.add_argument("--lang-threshold", type=float, default=None,
+                    help="override the model's rejection threshold (average log2 prob per char)")
+    add_engine_args(ap)
+    args = ap.parse_args()
+
+    stages = [STAGES[s.strip()] for s in args.stages.split(",")]
+    if args.lang_model:
+        stages.insert(0, lang_stage(Path(args.lang_model).expanduser(), args.lang_threshold))
+    in_paths = [Path(p).expanduser() for p in args.paths]
+    out_path = Path(args.output).expanduser()
+
+    total_raw, total_kept = clean_corpus(in_paths, out_path, stages,
+                                         desc="Stages " + ("lang," if args.lang_model else "") + args.stages,
+                                         flush_every=max(0, args.flush),
+                                         **engine_options(args))
+
+    print(f"\n {total_raw:,} raw -> {total_kept:,} kept   ->  {out_path.resolve()}")
+
+
+if __name__ == "__main__":
+    main()
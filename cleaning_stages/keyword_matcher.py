@@ -0,0 +1,82 @@
+import re
+from bisect import bisect_right
+from itertools import islice
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# -> shared multi-keyword matcher for the spam / ad / forum / CTA / legal word lists
+# -> every list is compiled once at import, a text is then scanned once for all of its keywords
+# -> substring lists use an Aho-Corasick automaton (pyahocorasick) when it is installed, otherwise
+# -> they fall back to C-level `in` checks over a prebuilt tuple (a regex alternation is slower than that)
+# -> whole-word lists are one \b(...)\b regex, counted in a single findall
+
+_LINE_BREAK = re.compile(r'\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+
+class KeywordMatcher:
+    def __init__(self, words, whole_words: bool = False):
+        self.words = tuple(dict.fromkeys(words))
+        self.whole_words = whole_words
+        self._automaton = None
+        self._regex = None
+        if whole_words:
+            alts = "|".join(re.escape(w) for w in sorted(self.words, key=len, reverse=True))
+            self._regex = re.compile(r'\b(?:' + alts + r')\b')
+        elif ahocorasick is not None and self.words:
+            self._automaton = ahocorasick.Automaton()
+            for i, w in enumerate(self.words):
+                self._automaton.add_word(w, i)
+            self._automaton.make_automaton()
+
+    def count(self, text: str, limit: int | None = None) -> int:
+        # -> substring lists: number of distinct keywords occurring in text
+        # -> whole-word lists: number of words of text that are keywords
+        # -> with limit, counting stops as soon as limit is reached
+        if self._regex is not None:
+            if limit is None:
+                return len(self._regex.findall(text))
+            return sum(1 for _ in islice(self._regex.finditer(text), limit))
+        if self._automaton is not None:
+            hits = set()
+            for _, i in self._automaton.iter(text):
+                hits.add(i)
+                if limit is not None and len(hits) >= limit:
+                    break
+            return len(hits)
+        n = 0
+        for w in self.words:
+            if w in text:
+                n += 1
+                if limit is not None and n >= limit:
+                    break
+        return n
+
+    def found(self, text: str) -> set[str]:
+        # -> the set of keywords occurring in text (substring lists only)
+        if self._automaton is not None:
+            return {self.words[i] for _, i in self._automaton.iter(text)}
+        return {w for w in self.words if w in text}
+
+    def search(self, text: str) -> bool:
+        return self.count(text, limit=1) > 0
+
+    def line_counts(self, text: str, limit: int | None = None) -> list[int]:
+        # -> count() for every line of text.splitlines() in one scan of the whole text
+        # -> (limit only shortens the per-line fallback, the automaton scan counts exactly)
+        lines = text.splitlines()
+        if self._automaton is None:
+            return [self.count(ln, limit) for ln in lines]
+        counts = [0] * len(lines)
+        matches = list(self._automaton.iter(text))
+        if not matches:
+            return counts
+        starts = [0] + [m.end() for m in _LINE_BREAK.finditer(text)]
+        seen = set()
+        for end, i in matches:
+            line = bisect_right(starts, end) - 1
+            if (line, i) not in seen:
+                seen.add((line, i))
+                counts[line] += 1
+        return counts
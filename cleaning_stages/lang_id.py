@@ -0,0 +1,205 @@
+import sys, argparse
+from pathlib import Path
+import numpy as np
+from tqdm import tqdm
+from engine import Stage, expand_inputs, tasks_from, task_texts
+from count_min import MULTIPLIERS     # -> one odd multiplier per gram position
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))     # -> repo root, for char_stats
+from char_stats import SPACE, codepoints, char_flags
+
+# -> cheap Romanian language / quality prefilter, run before stage 1 (fused_clean --lang-model)
+# -> a character 4-gram model trained on the books: P(c | 3 previous chars) from hashed counts of
+# -> the 4-grams and of their 3-char contexts; a doc's score is its average log2 probability per
+# -> character (the negative cross-entropy) -> Romanian prose sits around -2, English around -4,
+# -> other languages and character soup (OCR noise, mojibake, random symbols) at -5 or lower
+# -> scoring is a few numpy passes over the code points of the doc, no regex and no python loop
+# -> per character, so non-Romanian and garbage docs are dropped before clean() and the
+# -> should_drop chains of stages 2-4 ever run on them
+# -> the rejection threshold is calibrated at training time: 1 in 20 windows of the books is held
+# -> out and the threshold sits `margin` bits below their median score, i.e. a doc fails when its
+# -> characters are on average ~3x less likely than those of typical book text (the median, unlike
+# -> a low quantile, doesn't move with the odd table of contents or index page among the books)
+# -> text is lowercased, then normalized on its code points: cedilla diacritics -> comma below,
+# -> whitespace runs -> one space, ascii digit runs -> one 0 (str.translate / re.sub cost more than
+# -> the whole scoring)
+#
+#   python lang_id.py train books.jsonl -o ro_lang.npz
+#   python lang_id.py score ro_lang.npz clean_ro.jsonl          # -> score distribution of a corpus
+#   python fused_clean.py raw.jsonl --lang-model ro_lang.npz
+ORDER = 4
+BUCKETS_LOG2 = 21               # -> 2M buckets per table, 16MB model
+ADD_K, VOCAB = 0.1, 100         # -> add-k smoothing over a ~100 symbol alphabet
+WINDOW = 1000                   # -> chars per training window
+HOLDOUT = 20                    # -> every HOLDOUT-th window is kept for calibration
+MARGIN = 1.5
+MIN_CHARS = 40                  # -> shorter docs are not scored, the later stages decide on them
+
+_MIX = np.uint64(0x94D049BB133111EB)
+
+def normalized_codepoints(text: str) -> np.ndarray:
+    cp = codepoints(' ' + text.lower() + ' ').copy()
+    cp[cp == 0x15F] = 0x219     # -> ş -> ș
+    cp[cp == 0x163] = 0x21B     # -> ţ -> ț
+    space = (char_flags(cp) & SPACE) != 0
+    digit = (cp - 48) < 10
+    cp[space] = 32
+    cp[digit] = 48
+    keep = np.ones(len(cp), dtype=bool)
+    keep[1:] = ~((space | digit)[1:] & (cp[1:] == cp[:-1]))
+    return cp[keep]
+
+def gram_hashes(cp: np.ndarray, order: int, bits: int) -> tuple[np.ndarray, np.ndarray]:
+    # -> bucket of every (order-1)-char context and of the order-gram it starts
+    n = len(cp) - order + 1
+    cp = cp.astype(np.uint64)
+    shift = np.uint64(64 - bits)
+    with np.errstate(over="ignore"):
+        h = cp[:n] * MULTIPLIERS[0]
+        for k in range(1, order - 1):
+            h = (h + cp[k:k + n]) * MULTIPLIERS[k]
+        full = h + cp[order - 1:order - 1 + n]
+        return (h * _MIX) >> shift, (full * _MIX) >> shift
+
+class LangModel:
+    # -> table[0] = log2 of smoothed context counts, table[1] = log2 of smoothed n-gram counts
+    def __init__(self, table: np.ndarray, order: int = ORDER, threshold: float = -np.inf):
+        self.table = table
+        self.order = order
+        self.threshold = threshold
+        self.bits = table.shape[1].bit_length() - 1
+
+    def score_codepoints(self, cp: np.ndarray) -> float:
+        ctx, full = gram_hashes(cp, self.order, self.bits)
+        return float(self.table[1][full].sum() - self.table[0][ctx].sum()) / len(full)
+
+    def score(self, text: str) -> float | None:
+        # -> average log2 P(char | context), None for docs too short to judge
+        cp = normalized_codepoints(text)
+        if len(cp) < MIN_CHARS:
+            return None
+        return self.score_codepoints(cp)
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("wb") as fh:
+            np.savez(fh, table=self.table, order=self.order, threshold=self.threshold)
+
+    @classmethod
+    def load(cls, path: Path) -> "LangModel":
+        with np.load(path) as z:
+            return cls(z["table"], int(z["order"]), float(z["threshold"]))
+
+def train(texts, order: int = ORDER, bits: int = BUCKETS_LOG2, margin: float = MARGIN) -> LangModel:
+    size = 1 << bits
+    counts = np.zeros((2, size), dtype=np.int64)
+    pending, held, n_windows = [], [], 0
+
+    def flush() -> None:
+        ctx = np.concatenate([c for c, _ in pending])
+        full = np.concatenate([f for _, f in pending])
+        counts[0] += np.bincount(ctx, minlength=size)
+        counts[1] += np.bincount(full, minlength=size)
+        pending.clear()
+
+    pending_grams = 0
+    for text in texts:
+        cp = normalized_codepoints(text)
+        for start in range(0, len(cp), WINDOW):
+            window = cp[start:start + WINDOW]
+            if len(window) < MIN_CHARS:
+                continue
+            n_windows += 1
+            if n_windows % HOLDOUT == 0:
+                held.append(window)
+                continue
+            pending.append(gram_hashes(window, order, bits))
+            pending_grams += len(window)
+            if pending_grams >= 1 << 24:
+                flush()
+                pending_grams = 0
+    if pending:
+        flush()
+    if not counts[1].any():
+        raise SystemExit("no training text")
+
+    table = np.stack([np.log2(counts[0] + ADD_K * VOCAB), np.log2(counts[1] + ADD_K)]).astype(np.float32)
+    model = LangModel(table, order)
+    if held:
+        model.threshold = float(np.median([model.score_codepoints(w) for w in held])) - margin
+    return model
+
+class LangFilter:
+    # -> stage drop predicate; holds only the model path so it pickles cheaply into pool workers,
+    # -> each process loads the model on first use
+    def __init__(self, model_path: Path, threshold: float | None = None):
+        self.model_path = model_path
+        self.threshold = threshold
+        self._model = None
+
+    def __getstate__(self) -> dict:
+        return {**self.__dict__, "_model": None}
+
+    def __call__(self, text: str) -> bool:
+        if self._model is None:
+            self._model = LangModel.load(self.model_path)
+            if self.threshold is not None:
+                self._model.threshold = self.threshold
+        score = self._model.score(text)
+        return score is not None and score < self._model.threshold
+
+def lang_stage(model_path: Path, threshold: float | None = None) -> Stage:
+    # -> raw docs are scored as they come, the dedup is left to stage 1
+    return Stage("langid", drop=LangFilter(model_path, threshold), dedup=False)
+
+def iter_corpus(paths: list[Path]):
+    for task, _ in tasks_from(expand_inputs(paths), 64 << 20):
+        yield from task_texts(task)
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Romanian character n-gram language / quality model")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    tr = sub.add_parser("train", help="train the model on Romanian text (the books)")
+    tr.add_argument("paths", nargs="+", help="training .jsonl / .txt file(s) or folder(s)")
+    tr.add_argument("-o", "--output", default="ro_lang.npz", help="model file (default: %(default)s)")
+    tr.add_argument("--order", type=int, default=ORDER, help="n-gram order (default: %(default)s)")
+    tr.add_argument("--buckets-log2", type=int, default=BUCKETS_LOG2,
+                    help="log2 of the hash buckets per table (default: %(default)s)")
+    tr.add_argument("--margin", type=float, default=MARGIN,
+                    help="threshold, in bits per char below the held-out median (default: %(default)s)")
+    sc = sub.add_parser("score", help="score distribution of a corpus under the model")
+    sc.add_argument("model", help="model file written by train")
+    sc.add_argument("paths", nargs="+", help=".jsonl file(s) or folder(s)")
+    sc.add_argument("--threshold", type=float, default=None, help="override the model's threshold")
+    sc.add_argument("--limit", type=int, default=100_000, help="docs scored (default: %(default)s)")
+    args = ap.parse_args()
+
+    if args.cmd == "train":
+        if not 2 <= args.order <= len(MULTIPLIERS):
+            raise SystemExit(f"--order must be 2..{len(MULTIPLIERS)}")
+        texts = tqdm(iter_corpus([Path(p).expanduser() for p in args.paths]), desc="training", unit="doc")
+        model = train(texts, args.order, args.buckets_log2, args.margin)
+        model.save(Path(args.output).expanduser())
+        print(f"\n threshold {model.threshold:.3f}  ->  {Path(args.output).resolve()}")
+        return
+
+    model = LangModel.load(Path(args.model).expanduser())
+    threshold = model.threshold if args.threshold is None else args.threshold
+    scores = []
+    for text in iter_corpus([Path(p).expanduser() for p in args.paths]):
+        if len(scores) >= args.limit:
+            break
+        s = model.score(text)
+        if s is not None:
+            scores.append(s)
+    if not scores:
+        raise SystemExit("nothing to score")
+    scores = np.array(scores)
+    pct = [0.1, 1, 5, 25, 50, 75, 95, 99]
+    print(f" {len(scores):,} docs   threshold {threshold:.3f}   rejected {np.mean(scores < threshold):.2%}")
+    for p, v in zip(pct, np.percentile(scores, pct)):
+        print(f"  p{p:<5} {v:8.3f}")
+
+
+if __name__ == "__main__":
+    main()
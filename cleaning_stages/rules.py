@@ -0,0 +1,307 @@
+import operator, json, csv
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from time import perf_counter
+import numpy as np
+from keyword_matcher import KeywordMatcher
+
+# -> declarative junk detectors for the cleaning stages
+# -> a stage declares named features (regex counts, literal hits, line matches, ...) and rules written
+# -> as small expressions like "comp_suffix >= 3 & dir_kw >= 4 | catalog_years >= 4"
+# -> ('&' binds tighter than '|', a bare feature name means "feature >= 1")
+# -> the RuleSet compiles all of that once and then evaluates a doc so that:
+# ->   - every feature is computed at most once per doc and only if a rule reaches it
+# ->   - lower()/upper()/splitlines() and each regex findall are shared between features
+# ->   - all literal substring features are answered by one KeywordMatcher scan per case
+# ->   - clauses short-circuit left to right, so the cheap & selective condition goes first
+# -> python's re can't report overlapping matches of independent patterns from one combined scan
+# -> without changing the counts, so regex features stay separate (but memoized) scans
+# -> adding a detector = one feature line + one rule line
+# -> with profiling on, every rule is evaluated on every doc (the first hit still decides the drop)
+# -> and per-rule evaluated / fired / first-to-fire / seconds are accumulated for a report;
+# -> a feature's cost is charged to the first rule that needs it
+# -> rules are pure predicates, so the order they are tried in can't change should_drop(), only
+# -> which rule gets the blame; during a warm-up of N docs every rule is timed in evaluation order on
+# -> one shared doc cache (so, as in profiling, a feature is charged to the first rule needing it and a
+# -> rule's cost is what it adds inside the chain), then the rules are re-sorted by cost / P(fire), the
+# -> order that minimises the expected cost of the short-circuit chain; profiling keeps the declared
+# -> order so first-hit counts stay comparable
+# -> feature_values() computes every feature of a doc (for the score sidecar, see sidecar.py) and
+# -> Rule.mask() evaluates a rule on whole columns of such values at once
+
+_OPS = {">=": operator.ge, ">": operator.gt, "<=": operator.le, "<": operator.lt, "==": operator.eq}
+
+# -> feature kinds (small classes instead of lambdas so stages stay picklable for --workers)
+@dataclass(frozen=True)
+class Count:
+    pattern: object
+    lower: bool = False
+    def __call__(self, doc):
+        return len(doc.findall(self.pattern, self.lower))
+
+@dataclass(frozen=True)
+class Present:
+    pattern: object
+    def __call__(self, doc):
+        return int(self.pattern.search(doc.text) is not None)
+
+@dataclass(frozen=True)
+class LineMatches:
+    pattern: object
+    def __call__(self, doc):
+        return sum(1 for ln in doc.lines if self.pattern.match(ln))
+
+@dataclass(frozen=True)
+class Keywords:
+    matcher: KeywordMatcher
+    def __call__(self, doc):
+        return self.matcher.count(doc.lower)
+
+@dataclass(frozen=True)
+class Literal:
+    # -> literal substring of text.lower() (or text.upper()), folded into one matcher per case
+    text: str
+    upper: bool = False
+
+def length(doc):       return len(doc.text)
+def line_count(doc):   return len(doc.lines)
+def word_count(doc):   return len(doc.text.split())
+
+class Doc:
+    # -> per-document cache shared by all features of a RuleSet
+    __slots__ = ("text", "_ruleset", "_lower", "_upper", "_lines", "_found", "_findall", "values")
+
+    def __init__(self, text: str, ruleset: "RuleSet"):
+        self.text = text
+        self._ruleset = ruleset
+        self._lower = self._upper = self._lines = None
+        self._found = {}
+        self._findall = {}
+        self.values = {}
+
+    @property
+    def lower(self) -> str:
+        if self._lower is None:
+            self._lower = self.text.lower()
+        return self._lower
+
+    @property
+    def upper(self) -> str:
+        if self._upper is None:
+            self._upper = self.text.upper()
+        return self._upper
+
+    @property
+    def lines(self) -> list[str]:
+        if self._lines is None:
+            self._lines = self.text.splitlines()
+        return self._lines
+
+    def findall(self, pattern, lower: bool = False) -> list:
+        key = (pattern, lower)
+        if key not in self._findall:
+            self._findall[key] = pattern.findall(self.lower if lower else self.text)
+        return self._findall[key]
+
+    def has_literal(self, lit: Literal) -> bool:
+        if lit.upper not in self._found:
+            matcher = self._ruleset._literals[lit.upper]
+            self._found[lit.upper] = matcher.found(self.upper if lit.upper else self.lower)
+        return lit.text in self._found[lit.upper]
+
+    def value(self, name: str):
+        if name not in self.values:
+            feat = self._ruleset.features[name]
+            self.values[name] = int(self.has_literal(feat)) if isinstance(feat, Literal) else feat(self)
+        return self.values[name]
+
+@dataclass(frozen=True)
+class Cond:
+    feature: str
+    op: str = ">="
+    value: float = 1
+
+    def holds(self, doc: Doc) -> bool:
+        return _OPS[self.op](doc.value(self.feature), self.value)
+
+    def mask(self, columns: dict[str, np.ndarray]) -> np.ndarray:
+        return _OPS[self.op](columns[self.feature], self.value)
+
+@dataclass
+class Rule:
+    name: str
+    clauses: list[list[Cond]]
+
+    def fires(self, doc: Doc) -> bool:
+        for clause in self.clauses:
+            for c in clause:
+                if not c.holds(doc):
+                    break
+            else:
+                return True
+        return False
+
+    def mask(self, columns: dict[str, np.ndarray]) -> np.ndarray:
+        # -> fires() for every row of a column store (feature name -> one value per doc)
+        fired = None
+        for clause in self.clauses:
+            hit = clause[0].mask(columns)
+            for c in clause[1:]:
+                hit = hit & c.mask(columns)
+            fired = hit if fired is None else fired | hit
+        return fired
+
+def parse_rule(name: str, expr: str) -> Rule:
+    clauses = []
+    for alt in expr.split("|"):
+        clause = []
+        for term in alt.split("&"):
+            parts = term.split()
+            if len(parts) == 1:
+                clause.append(Cond(parts[0]))
+            else:
+                feat, op, val = parts
+                if op not in _OPS:
+                    raise ValueError(f"rule {name}: unknown operator {op!r}")
+                clause.append(Cond(feat, op, float(val)))
+        clauses.append(clause)
+    return Rule(name, clauses)
+
+@dataclass
+class RuleStats:
+    evaluated: int = 0
+    fired: int = 0
+    first: int = 0
+    seconds: float = 0.0
+
+    def add(self, other: "RuleStats") -> None:
+        self.evaluated += other.evaluated
+        self.fired += other.fired
+        self.first += other.first
+        self.seconds += other.seconds
+
+class RuleSet:
+    def __init__(self, features: dict, rules: dict[str, str], warmup: int = 1000):
+        self.features = features
+        self.stats: dict[str, RuleStats] | None = None
+        self.exprs = dict(rules)
+        self.declared = [parse_rule(name, expr) for name, expr in rules.items()]
+        self.rules = list(self.declared)
+        self.set_warmup(warmup)
+        for rule in self.rules:
+            for clause in rule.clauses:
+                for c in clause:
+                    if c.feature not in features:
+                        raise KeyError(f"rule {rule.name}: unknown feature {c.feature!r}")
+        self._literals = {
+            case: KeywordMatcher([f.text for f in features.values()
+                                  if isinstance(f, Literal) and f.upper == case])
+            for case in (False, True)
+        }
+
+    def first_hit(self, text: str) -> str | None:
+        if self.stats is not None:
+            return self._first_hit_profiled(Doc(text, self))
+        if self._warm is not None:
+            return self._first_hit_warmup(text)
+        doc = Doc(text, self)
+        for rule in self.rules:
+            if rule.fires(doc):
+                return rule.name
+        return None
+
+    def _first_hit_profiled(self, doc: Doc) -> str | None:
+        first = None
+        for rule in self.rules:
+            st = self.stats[rule.name]
+            t0 = perf_counter()
+            hit = rule.fires(doc)
+            st.seconds += perf_counter() - t0
+            st.evaluated += 1
+            if hit:
+                st.fired += 1
+                if first is None:
+                    first = rule.name
+                    st.first += 1
+        return first
+
+    # -> adaptive order
+    def set_warmup(self, n: int) -> None:
+        # -> n = 0 keeps the declared order
+        self.rules = list(self.declared)
+        self.warmup = n
+        self._warm = {rule.name: RuleStats() for rule in self.rules} if n > 0 else None
+        self._warm_docs = 0
+
+    def _first_hit_warmup(self, text: str) -> str | None:
+        first = None
+        doc = Doc(text, self)
+        for rule in self.rules:
+            st = self._warm[rule.name]
+            t0 = perf_counter()
+            hit = rule.fires(doc)
+            st.seconds += perf_counter() - t0
+            st.evaluated += 1
+            if hit:
+                st.fired += 1
+                if first is None:
+                    first = rule.name
+        self._warm_docs += 1
+        if self._warm_docs >= self.warmup:
+            self._reorder()
+        return first
+
+    def _reorder(self) -> None:
+        def expected_cost(rule):
+            st = self._warm[rule.name]
+            p_fire = (st.fired + 1) / (st.evaluated + 2)
+            return st.seconds / st.evaluated / p_fire
+        self.rules.sort(key=expected_cost)
+        self._warm = None
+
+    # -> profiling
+    def enable_profile(self) -> None:
+        self.set_warmup(0)
+        self.stats = {rule.name: RuleStats() for rule in self.rules}
+
+    def take_stats(self) -> dict[str, RuleStats]:
+        # -> hand the counters over and start from zero (workers ship them per byte range)
+        stats, self.stats = self.stats, {rule.name: RuleStats() for rule in self.rules}
+        return stats
+
+    def merge_stats(self, stats: dict[str, RuleStats]) -> None:
+        for name, st in stats.items():
+            self.stats[name].add(st)
+
+    def should_drop(self, text: str) -> bool:
+        return self.first_hit(text) is not None
+
+    def feature_values(self, text: str) -> list[int]:
+        # -> every feature of the doc, in self.features order (no short-circuit)
+        doc = Doc(text, self)
+        return [doc.value(name) for name in self.features]
+
+def profile_rows(stages) -> list[dict]:
+    # -> one row per rule of every profiled stage, in evaluation order
+    rows = []
+    for st in stages:
+        if st.rules is None or st.rules.stats is None:
+            continue
+        for name, rs in st.rules.stats.items():
+            rows.append({
+                "stage": st.name, "rule": name, **asdict(rs),
+                "fire_rate": rs.fired / rs.evaluated if rs.evaluated else 0.0,
+                "us_per_eval": 1e6 * rs.seconds / rs.evaluated if rs.evaluated else 0.0,
+            })
+    return rows
+
+def write_profile(path: Path, rows: list[dict]) -> None:
+    # -> .csv -> one line per rule, anything else -> json list
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8", newline="") as fh:
+        if path.suffix == ".csv":
+            w = csv.DictWriter(fh, fieldnames=list(rows[0]) if rows else ["stage", "rule"])
+            w.writeheader()
+            w.writerows(rows)
+        else:
+            json.dump(rows, fh, ensure_ascii=False, indent=2)
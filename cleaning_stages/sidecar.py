@@ -0,0 +1,264 @@
+import sys, os, json, argparse
+from multiprocessing import Pool
+from pathlib import Path
+import numpy as np
+from tqdm import tqdm
+from engine import Stage, expand_inputs, tasks_from, ordered_results
+from rules import parse_rule
+from dedup_index import fingerprint, fsync_dir
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))     # -> repo root, for jsonl_io
+from jsonl_io import JsonlWriter, open_read, iter_lines, block_lines, line_docs, loads, read_range, is_jsonl
+
+# -> score once, filter many times
+# -> `score` runs the stage transform on every input doc and stores the value of every feature of
+# -> the stage's RuleSet (counts, hits, lengths) as one column per feature in a sidecar folder:
+# ->   file.npy, offset.npy   -> input position right after the doc (file index, byte offset), the key
+# ->   fp.npy                 -> fingerprint of the transformed text, for the stage's dedup
+# ->   feat.<name>.npy        -> feature values, each column in the smallest integer type that fits
+# ->   meta.json              -> stage, input files, feature names, rules at scoring time
+# -> meta.json is what makes a folder a sidecar: save() removes it first, writes every column to a
+# -> temp file that replaces the old one once fsynced, and writes meta.json the same way last, so a
+# -> crash while saving leaves a folder that load() refuses instead of a mix of old and new columns
+# -> `apply` evaluates the rules on the columns with numpy (declared rules, optionally overridden by
+# -> a policy json {"rule": "expression" | null}), dedups the kept docs like the engine does and
+# -> copies them to the output, re-running only the stage transform for the docs it keeps
+# -> with the rules unchanged, apply gives byte for byte the output of running the stage itself
+# -> (without --dedup-index); a rule may use any feature of the stage, so thresholds and rule
+# -> combinations can change without computing a single feature again
+#
+#   python sidecar.py score --stage 3 clean_stage2.jsonl -o stage3.sidecar --workers 8
+#   python sidecar.py apply --stage 3 stage3.sidecar -o clean_stage3.jsonl --policy loose.json
+
+def _narrow(col: np.ndarray) -> np.ndarray:
+    if not len(col):
+        return col
+    return col.astype(np.result_type(np.min_scalar_type(col.min()), np.min_scalar_type(col.max())))
+
+class Sidecar:
+    def __init__(self, directory: Path):
+        self.dir = directory
+        self.meta_path = directory / "meta.json"
+
+    def save(self, meta: dict, columns: dict[str, np.ndarray]) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.meta_path.unlink(missing_ok=True)
+        for name, col in columns.items():
+            path = self.dir / f"{name}.npy"
+            tmp = path.with_name(path.name + ".tmp")
+            with tmp.open("wb") as fh:
+                np.save(fh, col)
+                fh.flush()
+                os.fsync(fh.fileno())
+            tmp.replace(path)
+        fsync_dir(self.dir)
+        tmp = self.meta_path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as fh:
+            json.dump(meta, fh, ensure_ascii=False, indent=2)
+            fh.flush()
+            os.fsync(fh.fileno())
+        tmp.replace(self.meta_path)
+        fsync_dir(self.dir)
+
+    def load(self) -> tuple[dict, dict[str, np.ndarray]]:
+        with self.meta_path.open(encoding="utf-8") as fh:
+            meta = json.load(fh)
+        names = ["file", "offset", "fp"] + [f"feat.{f}" for f in meta["features"]]
+        columns = {name: np.load(self.dir / f"{name}.npy", mmap_mode="r") for name in names}
+        return meta, columns
+
+# -> scoring
+
+_stage: Stage | None = None
+
+def _init_worker(stage: Stage) -> None:
+    global _stage
+    _stage = stage
+
+def _score_docs(docs) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # -> (offset, text) pairs -> offsets, fingerprints, (n_docs, n_features) values
+    offsets, fps, values = [], [], []
+    for pos, text in docs:
+        if _stage.transform is not None:
+            text = _stage.transform(text)
+        offsets.append(pos)
+        fps.append(fingerprint(text))
+        values.append(_stage.rules.feature_values(text))
+    n_feat = len(_stage.rules.features)
+    return (np.array(offsets, dtype=np.int64), np.array(fps, dtype=np.uint64),
+            np.array(values, dtype=np.int64).reshape(len(values), n_feat))
+
+def _score_range(task):
+    # -> offsets are relative to the start of the range; a plain text file is one doc at offset 0
+    if isinstance(task, bytes):
+        data = task
+    else:
+        path, start, end = task
+        if start is None:
+            with open_read(path) as fh:
+                offsets, fps, values = _score_docs([(0, fh.read().decode("utf-8"))])
+            return offsets, fps, [_narrow(c) for c in values.T]
+        data = read_range(path, start, end)
+    offsets, fps, values = _score_docs(line_docs(block_lines(data)))
+    return offsets, fps, [_narrow(c) for c in values.T]
+
+def _keyed_tasks(files: list[Path], chunk_bytes: int):
+    # -> engine tasks with the (file index, start offset) their doc offsets are relative to;
+    # -> a plain text file is one doc at offset 0 (the engine reports it as (next file, 0))
+    for task, (fi, end) in tasks_from(files, chunk_bytes):
+        if isinstance(task, bytes):
+            yield task, (fi, end - len(task))
+        elif task[1] is None:
+            yield task, (fi - 1, 0)
+        else:
+            yield task, (fi, task[1])
+
+def score_corpus(in_paths: list[Path], sidecar_dir: Path, stage: Stage,
+                 workers: int = 1, chunk_mb: int = 64) -> int:
+    if stage.rules is None:
+        raise SystemExit(f"{stage.name} has no rule set to score")
+    files = expand_inputs(in_paths)
+    names = list(stage.rules.features)
+    file_col, offset_col, fp_col, feat_cols = [], [], [], [[] for _ in names]
+    tasks = _keyed_tasks(files, chunk_mb << 20)
+    # -> --workers 1 scores in this process, no pool
+    pool = Pool(workers, initializer=_init_worker, initargs=(stage,)) if workers > 1 else None
+    try:
+        if pool is None:
+            _init_worker(stage)
+            results = ((key, _score_range(task)) for task, key in tasks)
+        else:
+            results = ordered_results(pool, _score_range, tasks, 2 * workers)
+        for (fi, start), (offsets, fps, values) in tqdm(results, desc=f"score {stage.name}", unit="range"):
+            file_col.append(np.full(len(offsets), fi, dtype=np.int32))
+            offset_col.append(offsets + start)
+            fp_col.append(fps)
+            for col, v in zip(feat_cols, values):
+                col.append(v)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    columns = {
+        "file": _narrow(np.concatenate(file_col or [np.empty(0, np.int32)])),
+        "offset": np.concatenate(offset_col or [np.empty(0, np.int64)]),
+        "fp": np.concatenate(fp_col or [np.empty(0, np.uint64)]),
+    }
+    for name, col in zip(names, feat_cols):
+        columns[f"feat.{name}"] = np.concatenate(col or [np.empty(0, np.uint8)])
+    Sidecar(sidecar_dir).save({
+        "stage": stage.name, "files": [str(p) for p in files], "features": names,
+        "rules": stage.rules.exprs, "docs": len(columns["offset"]),
+    }, columns)
+    return len(columns["offset"])
+
+# -> applying a policy
+
+def policy_rules(stage: Stage, policy: dict | None) -> dict[str, str]:
+    # -> the stage's rules with the policy's overrides; a null expression removes a rule
+    exprs = dict(stage.rules.exprs)
+    for name, expr in (policy or {}).items():
+        if expr is None:
+            exprs.pop(name, None)
+        else:
+            exprs[name] = expr
+    return exprs
+
+def apply_policy(sidecar_dir: Path, out_path: Path, stage: Stage,
+                 policy: dict | None = None) -> tuple[int, int, dict[str, int]]:
+    meta, columns = Sidecar(sidecar_dir).load()
+    if stage.rules is None:
+        raise SystemExit(f"{stage.name} has no rule set")
+    if meta["stage"] != stage.name:
+        raise SystemExit(f"{sidecar_dir} was scored for {meta['stage']}, not {stage.name}")
+    features = {name: columns[f"feat.{name}"] for name in meta["features"]}
+    fired, drop = {}, np.zeros(meta["docs"], dtype=bool)
+    for name, expr in policy_rules(stage, policy).items():
+        rule = parse_rule(name, expr)
+        for clause in rule.clauses:
+            for c in clause:
+                if c.feature not in features:
+                    raise SystemExit(f"rule {name}: unknown feature {c.feature!r}")
+        hit = rule.mask(features)
+        fired[name] = int(np.count_nonzero(hit))
+        drop |= hit
+    keep = ~drop
+    if stage.dedup:
+        # -> the engine keeps the first doc of every fingerprint among the docs the rules let through
+        rows = np.flatnonzero(keep)
+        _, first = np.unique(columns["fp"][rows], return_index=True)
+        keep[:] = False
+        keep[rows[first]] = True
+
+    files = [Path(p) for p in meta["files"]]
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    kept = 0
+    with JsonlWriter(out_path) as out:
+        for text in tqdm(_kept_docs(files, columns, keep), total=int(keep.sum()),
+                              desc=f"apply {stage.name}", unit="doc"):
+            if stage.transform is not None:
+                text = stage.transform(text)
+            out.write_text(text)
+            kept += 1
+    return meta["docs"], kept, fired
+
+def _kept_docs(files: list[Path], columns: dict[str, np.ndarray], keep: np.ndarray):
+    # -> texts of the kept rows in input order; the stored offsets say which input lines are
+    # -> scored docs, so only the kept lines are parsed
+    file_col, offset_col = columns["file"], columns["offset"]
+    for fi, p in enumerate(files):
+        rows = np.flatnonzero(file_col == fi)
+        rows = rows[keep[rows]]
+        if not is_jsonl(p):
+            if len(rows):
+                with open_read(p) as fh:
+                    yield fh.read().decode("utf-8")
+            continue
+        wanted = set(offset_col[rows].tolist())
+        if not wanted:
+            continue
+        last = max(wanted)
+        for pos, ln in iter_lines(p):
+            if pos in wanted:
+                yield loads(ln)["text"]
+            if pos >= last:
+                break
+
+def main() -> None:
+    from fused_clean import STAGES
+    ap = argparse.ArgumentParser(description="score a cleaning stage once, apply rule policies from the scores")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sc = sub.add_parser("score", help="compute every feature of a stage into a sidecar folder")
+    sc.add_argument("paths", nargs="+", help="input .jsonl file(s) or folder(s) of the stage")
+    sc.add_argument("--stage", required=True, choices=sorted(STAGES), help="cleaning stage")
+    sc.add_argument("-o", "--output", required=True, help="sidecar folder")
+    sc.add_argument("--workers", type=int, default=1, help="worker processes (default: %(default)s)")
+    sc.add_argument("--chunk-mb", type=int, default=64,
+                    help="size of the byte ranges handed to workers (default: %(default)s)")
+    ap_ = sub.add_parser("apply", help="write the docs a policy keeps, using the sidecar scores")
+    ap_.add_argument("sidecar", help="sidecar folder written by score")
+    ap_.add_argument("--stage", required=True, choices=sorted(STAGES), help="cleaning stage")
+    ap_.add_argument("-o", "--output", required=True, help="destination .jsonl")
+    ap_.add_argument("--policy", metavar="JSON",
+                     help='rule overrides {"rule": "expression" | null}, default: the stage\'s own rules')
+    args = ap.parse_args()
+
+    stage = STAGES[args.stage]
+    if args.cmd == "score":
+        n = score_corpus([Path(p).expanduser() for p in args.paths], Path(args.output).expanduser(),
+                         stage, max(1, args.workers), max(1, args.chunk_mb))
+        print(f"\n {n:,} docs scored  ->  {Path(args.output).resolve()}")
+        return
+    policy = None
+    if args.policy:
+        with open(args.policy, encoding="utf-8") as fh:
+            policy = json.load(fh)
+    total, kept, fired = apply_policy(Path(args.sidecar).expanduser(), Path(args.output).expanduser(),
+                                      stage, policy)
+    for name, n in fired.items():
+        print(f"  {name:<20} {n:>10,}")
+    print(f"\n {total:,} docs -> {kept:,} kept   ->  {Path(args.output).resolve()}")
+
+
+if __name__ == "__main__":
+    main()
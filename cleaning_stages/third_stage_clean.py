@@ -1,24 +1,9 @@
 
-import re, json, os, argparse, hashlib
+import re, argparse
 from pathlib import Path
-from typing   import Iterator
-from tqdm     import tqdm
-
-def iter_text(p: Path) -> Iterator[str]:
-    if p.is_dir():
-        for f in p.rglob("*.jsonl"):
-            yield from iter_text(f)
-        return
-
-    with p.open(encoding="utf-8") as fh:
-        for ln in fh:
-            try:
-                obj = json.loads(ln)
-                if "text" in obj:
-                    yield obj["text"]
-            except json.JSONDecodeError:
-                continue
-
+from keyword_matcher import KeywordMatcher
+from rules import RuleSet, Count, Present, LineMatches, Keywords, Literal, length, line_count
+from engine   import Stage, clean_corpus, add_engine_args, engine_options
 
 _FORUM_BTN = [
     "vizualizări","vizite pe pagina","trebuie să vă autentificați",
@@ -28,13 +13,13 @@ _FORUM_BTN = [
 _CTA       = ["citeste mai mult","detalii","adaugă în coș","loghează-te"]
 _ATTACH_RE = re.compile(r'\.(?:jpe?g|png|gif|pdf)\s*\([\d.]+\s*(?:[kmg]i?b)\)', re.I)
 
+_JUNK_MATCH = KeywordMatcher(_FORUM_BTN + _CTA)
+
 def strip_forum_junk(txt: str) -> str:
     out = []
-    for ln in txt.splitlines():
-        low = ln.lower().strip()
+    for ln, junk in zip(txt.splitlines(), _JUNK_MATCH.line_counts(txt.lower(), limit=1)):
         if _ATTACH_RE.search(ln):           continue
-        if any(w in low for w in _FORUM_BTN):continue
-        if any(w in low for w in _CTA):      continue
+        if junk:                            continue
         out.append(ln)
     return "\n".join(out).strip()
 
@@ -44,6 +29,7 @@ _PRICE_RE    = re.compile(r'\b\d{1,3}(?:[.,]\d{3})*[.,]\d{2}\s*(lei|ron|eur|€|
 _RO_DOMAIN   = re.compile(r'\b\w+\.ro\b', re.I)
 
 _LEGAL_KW    = {"hotarare","hotărâre","ordin","ordonanța","art.","alin.","anexa","nr."}
+_LEGAL_MATCH = KeywordMatcher(_LEGAL_KW)
 _MOF_MARKER  = re.compile(r'\bmonitorul\s+oficial\b', re.I)
 _CONTRACT    = re.compile(r'\bcontract\b', re.I)
 
@@ -90,69 +76,92 @@ _ROCHIE      = re.compile(r'rochi[ei]\s+lung[ăa]', re.I)
 _TIRE_KW     = re.compile(r'\b(lățimea|latimea|înălțimea|inaltimea|diametrul)\b', re.I)
 _TIRE_ROW    = re.compile(r'\b1[3456789]5\b|\b2[0-9]{2}\b')
 
-def looks_like_official_act(t):      return sum(k in t.lower() for k in _LEGAL_KW) >= 5
-def looks_like_mof_contract(t):      return _MOF_MARKER.search(t) and _CONTRACT.search(t)
-def looks_like_directory(t):         return len(_COMP_SUFX.findall(t))>=3 and len(_DIR_KW.findall(t))>=4
-def looks_like_climb(t):             return len(_CLIMB_GRADE.findall(t))>=15 and len(_CLIMB_KW.findall(t))>=10
-def looks_like_utility(t):           return _UTILITY.search(t) and _PAGE_TIME.search(t)
-def looks_like_dex(t):               return len(_DIC_KW.findall(t))>=2 and \
-                                             sum(bool(_NUM_SENSE.match(l)) for l in t.splitlines())>=3
-def looks_like_company_catalog(t):
-    yrs = {m.group() for m in _YEAR_COL.finditer(t) if 2001 <= int(m.group()) <= 2025}
-    kw  = _COMP_SUFX.search(t) and _PRICE_RE.search(t)
-    return len(yrs) >= 4 or kw
-
-def looks_like_music_dl(t):          return len(_DL_WORDS.findall(t))>=3 and "mp3" in t.lower()
-def looks_like_parliament_log(t):    return sum(bool(_PARL_LINE.match(l)) for l in t.splitlines()) >= 5
-def looks_like_ingredient_list(t):   return len(_INCI.findall(t)) >= 10
-def looks_like_announcements(t):     return _ANN_WORD.search(t)
-def looks_like_page_modif(t):        return _PAGE_MODIF.search(t)
-def looks_like_sports_table(t):      return _SPORT_LIGA.search(t) and 'clasament' in t.lower()
-def looks_like_nursery_desc(t):      return _COACERE.search(t) and 'soiul' in t.lower()
-def looks_like_anmcs_notice(t):      return _ANMCS.search(t) and 'ordin' in t.lower()
-
-def looks_like_product_listing(t):
-    prod_tok  = _PROD_TOK.search(t)
-    phone_tok = _SHOW_PHONE.search(t)
-    price_tok = _PRICE_RE.search(t)
-    emag_tok  = 'emag' in t.lower()
-    ro_dom    = _RO_DOMAIN.search(t)
-    return prod_tok or (ro_dom and (price_tok or phone_tok or emag_tok))
-
-def looks_like_cor_table(t):         return _COR.search(t) and len(_SIXDIGIT.findall(t)) >= 10
-def looks_like_job_competition(t):   return _CONCURS.search(t) or (_FISA_POST.search(t) and 'rezultat' in t.lower())
-def looks_like_job_ad(t):            return _JOB_DESC.search(t) or _MARRIOTT.search(t)
-def looks_like_js_dump(t):           return _JQUERY.search(t) and len(t.splitlines()) > 5
-def looks_like_isostar(t):           return _ISOSTAR.search(t) and 'vitamina' in t.lower()
-def looks_like_fashion_listing(t):   return _ROCHIE.search(t) and len(re.findall(r'\d{6}', t)) > 15
-def looks_like_tyre_catalog(t):      return _TIRE_KW.search(t) and len(_TIRE_ROW.findall(t)) >= 8
+_SIX_RUN     = re.compile(r'\d{6}')
+
+def catalog_years(doc):  return len({y for y in doc.findall(_YEAR_COL) if 2001 <= int(y) <= 2025})
+
+FEATURES = {
+    "length":        length,
+    "legal_kw":      Keywords(_LEGAL_MATCH),
+    "mof":           Present(_MOF_MARKER),
+    "contract":      Present(_CONTRACT),
+    "comp_suffix":   Count(_COMP_SUFX),
+    "dir_kw":        Count(_DIR_KW),
+    "climb_grade":   Count(_CLIMB_GRADE),
+    "climb_kw":      Count(_CLIMB_KW),
+    "utility":       Present(_UTILITY),
+    "page_time":     Present(_PAGE_TIME),
+    "dic_kw":        Count(_DIC_KW),
+    "num_sense":     LineMatches(_NUM_SENSE),
+    "catalog_years": catalog_years,
+    "price":         Present(_PRICE_RE),
+    "dl_words":      Count(_DL_WORDS),
+    "mp3":           Literal("mp3"),
+    "parl_lines":    LineMatches(_PARL_LINE),
+    "inci":          Count(_INCI),
+    "announce":      Present(_ANN_WORD),
+    "page_modif":    Present(_PAGE_MODIF),
+    "sport_liga":    Present(_SPORT_LIGA),
+    "clasament":     Literal("clasament"),
+    "coacere":       Present(_COACERE),
+    "soiul":         Literal("soiul"),
+    "anmcs":         Present(_ANMCS),
+    "ordin":         Literal("ordin"),
+    "prod_tok":      Present(_PROD_TOK),
+    "show_phone":    Present(_SHOW_PHONE),
+    "emag":          Literal("emag"),
+    "ro_domain":     Present(_RO_DOMAIN),
+    "cor":           Present(_COR),
+    "six_digit":     Count(_SIXDIGIT),
+    "concurs":       Present(_CONCURS),
+    "fisa_post":     Present(_FISA_POST),
+    "rezultat":      Literal("rezultat"),
+    "job_desc":      Present(_JOB_DESC),
+    "marriott":      Present(_MARRIOTT),
+    "jquery":        Present(_JQUERY),
+    "line_count":    line_count,
+    "isostar":       Present(_ISOSTAR),
+    "vitamina":      Literal("vitamina"),
+    "rochie":        Present(_ROCHIE),
+    "six_run":       Count(_SIX_RUN),
+    "tire_kw":       Present(_TIRE_KW),
+    "tire_row":      Count(_TIRE_ROW),
+}
+
+# -> any rule that fires drops the doc; this is the order used before the warm-up re-sort and by --profile
+# -> inside a clause the cheap / selective condition comes first
+RULES = RuleSet(FEATURES, {
+    "too_short":         "length < 50",
+    "official_act":      "legal_kw >= 5",
+    "mof_contract":      "mof & contract",
+    "directory":         "dir_kw >= 4 & comp_suffix >= 3",
+    "climb":             "climb_kw >= 10 & climb_grade >= 15",
+    "utility":           "utility & page_time",
+    "dex":               "dic_kw >= 2 & num_sense >= 3",
+    "company_catalog":   "catalog_years >= 4 | price & comp_suffix",
+    "music_dl":          "mp3 & dl_words >= 3",
+    "parliament_log":    "parl_lines >= 5",
+    "ingredient_list":   "inci >= 10",
+    "announcements":     "announce",
+    "page_modif":        "page_modif",
+    "sports_table":      "sport_liga & clasament",
+    "nursery_desc":      "coacere & soiul",
+    "anmcs_notice":      "anmcs & ordin",
+    "product_listing":   "prod_tok | ro_domain & price | ro_domain & show_phone | ro_domain & emag",
+    "cor_table":         "cor & six_digit >= 10",
+    "job_competition":   "concurs | fisa_post & rezultat",
+    "job_ad":            "job_desc | marriott",
+    "js_dump":           "jquery & line_count > 5",
+    "isostar":           "isostar & vitamina",
+    "fashion_listing":   "rochie & six_run > 15",
+    "tyre_catalog":      "tire_kw & tire_row >= 8",
+})
 
 def should_drop(txt: str) -> bool:
-    if len(txt) < 50:                       return True
-    if looks_like_official_act(txt):        return True
-    if looks_like_mof_contract(txt):        return True
-    if looks_like_directory(txt):           return True
-    if looks_like_climb(txt):               return True
-    if looks_like_utility(txt):             return True
-    if looks_like_dex(txt):                 return True
-    if looks_like_company_catalog(txt):     return True
-    if looks_like_music_dl(txt):            return True
-    if looks_like_parliament_log(txt):      return True
-    if looks_like_ingredient_list(txt):     return True
-    if looks_like_announcements(txt):       return True
-    if looks_like_page_modif(txt):          return True
-    if looks_like_sports_table(txt):        return True
-    if looks_like_nursery_desc(txt):        return True
-    if looks_like_anmcs_notice(txt):        return True
-    if looks_like_product_listing(txt):     return True
-    if looks_like_cor_table(txt):           return True
-    if looks_like_job_competition(txt):     return True
-    if looks_like_job_ad(txt):              return True
-    if looks_like_js_dump(txt):             return True
-    if looks_like_isostar(txt):             return True
-    if looks_like_fashion_listing(txt):     return True
-    if looks_like_tyre_catalog(txt):        return True
-    return False
+    return RULES.should_drop(txt)
+
+
+STAGE = Stage("stage3", transform=strip_forum_junk, drop=RULES.should_drop, rules=RULES)
 
 
 def main() -> None:
@@ -161,39 +170,17 @@ def main() -> None:
     ap.add_argument("-o", "--output", default="clean_stage3.jsonl",
                     help="destination file (default: %(default)s)")
     ap.add_argument("--flush", type=int, metavar="N", default=10_000,
-                    help="flush & fsync every N lines (default: %(default)s)")
+                    help="fsync the output every N lines, 0 = only at checkpoints and the end (default: %(default)s)")
+    add_engine_args(ap)
     args = ap.parse_args()
 
     in_path   = Path(args.input).expanduser()
     out_path  = Path(args.output).expanduser()
-    FLUSH_EVERY = max(1, args.flush)
-
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    fh = out_path.open("w", encoding="utf-8")
-
-    seen_sha     = set()
-    total_raw    = total_kept = written = 0
-
-    for raw in tqdm(iter_text(in_path), desc="Stage-3", unit="obj",
-                    dynamic_ncols=True, smoothing=0.1):
-
-        total_raw += 1
-        core = strip_forum_junk(raw)
-        if should_drop(core):continue
-
-        sha = hashlib.sha1(core.encode()).hexdigest()
-        if sha in seen_sha:   continue
-        seen_sha.add(sha)
-
-        json.dump({"text": core}, fh, ensure_ascii=False)
-        fh.write("\n")
-        total_kept += 1
-        written    += 1
-
-        if written % FLUSH_EVERY == 0:
-            fh.flush(); os.fsync(fh.fileno())
+    FLUSH_EVERY = max(0, args.flush)
 
-    fh.flush(); os.fsync(fh.fileno()); fh.close()
+    total_raw, total_kept = clean_corpus([in_path], out_path, [STAGE],
+                                         desc="Stage-3", flush_every=FLUSH_EVERY,
+                                         **engine_options(args))
 
     print(f"\n {total_raw:,} raw -> {total_kept:,} kept   ->  {out_path.resolve()}")
 
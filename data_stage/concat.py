@@ -1,29 +1,147 @@
 import os
+import sys
+import errno
+import mmap
+import argparse
+from pathlib import Path
+import numpy as np
 from tqdm import tqdm
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))     # -> repo root, for jsonl_io
+from jsonl_io import BLOCK_BYTES, is_zst, iter_blocks, open_write
+from doc_index import IndexWriter, index_path, line_starts
+
+# -> concatenates jsonl files and writes the document offset index of the result (<output>.idx, see
+# -> doc_index.py) in the same pass, so DocIndex.open(output) never has to scan it
+# -> plain files: the bytes are copied by the kernel (copy_file_range, sendfile on linux without
+# -> it, plain writes from the mmap elsewhere) while the same mmap'd block is scanned for newlines
+# -> with numpy, so every byte is read from disk once and never goes through a python str
+# -> any of the paths may end in .zst, inputs are then decompressed and the output compressed
+# -> (a compressed output gets no index, it can't be read at an offset anyway)
+# -> an input that doesn't end with a newline gets one, so its last line stays a line of its own
 FILE1 = "data/CLEANED_CORPUS.jsonl"
 FILE2 = "data/final_data.jsonl"
 OUTPUT = "/Volumes/KINGSTON/WEB_BOOKS_LITERARY.jsonl"
 
-total_lines = 0
-
-with open(OUTPUT, 'w', encoding='utf-8') as out:
-    # -> append file 1
-    print(f"appending {FILE1}...")
-    with open(FILE1, 'r', encoding='utf-8') as f:
-        for line in tqdm(f):
-            out.write(line)
-            total_lines += 1
-    
-    # -> append file 2
-    print(f"appending {FILE2}...")
-    with open(FILE2, 'r', encoding='utf-8') as f:
-        for line in tqdm(f):
-            out.write(line)
-            total_lines += 1
-
-# -> create file first
-file_size_gb = os.path.getsize(OUTPUT) / (1024**3)
-print(f"total lines: {total_lines:,}")
-print(f"output size: {file_size_gb:.2f}GB")
-print(f"output: {OUTPUT}")
+# -> errors that mean "this copy method doesn't work for these two files", the next one is tried
+_UNSUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+def copy_methods() -> list[str]:
+    methods = []
+    if hasattr(os, "copy_file_range"):
+        methods.append("copy_file_range")
+    if sys.platform.startswith("linux"):
+        methods.append("sendfile")
+    return methods + ["write"]
+
+def _copy(method: str, src: int, dst: int, src_pos: int, dst_pos: int, count: int, view) -> int:
+    if method == "copy_file_range":
+        return os.copy_file_range(src, dst, count, src_pos, dst_pos)
+    if method == "sendfile":
+        os.lseek(dst, dst_pos, os.SEEK_SET)
+        return os.sendfile(dst, src, src_pos, count)
+    return os.pwrite(dst, view[src_pos:src_pos + count], dst_pos)
+
+def copy_span(src: int, dst: int, src_pos: int, dst_pos: int, count: int, view, methods: list[str]) -> None:
+    # -> `methods` is shared by the whole run, a method the files don't support is dropped for good
+    while count:
+        try:
+            n = _copy(methods[0], src, dst, src_pos, dst_pos, count, view)
+        except OSError as e:
+            if methods[0] == "write" or e.errno not in _UNSUPPORTED:
+                raise
+            methods.pop(0)
+            continue
+        if n <= 0:
+            raise OSError(f"{methods[0]} copied nothing at offset {src_pos}")
+        src_pos += n
+        dst_pos += n
+        count -= n
+
+def _concat_plain(in_paths: list[Path], out_path: Path, idx) -> tuple[int, int]:
+    methods = copy_methods()
+    docs = out_pos = 0
+    dst = os.open(out_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        for p in in_paths:
+            print(f"appending {p}...")
+            with open(p, "rb") as fh:
+                size = os.fstat(fh.fileno()).st_size
+                if not size:
+                    continue
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                    if hasattr(mm, "madvise"):
+                        mm.madvise(mmap.MADV_SEQUENTIAL)
+                    data = np.frombuffer(view, dtype=np.uint8)
+                    with tqdm(total=size, unit="B", unit_scale=True, desc=p.name) as bar:
+                        for pos in range(0, size, BLOCK_BYTES):
+                            end = min(pos + BLOCK_BYTES, size)
+                            starts = line_starts(data[pos:end], out_pos + pos, pos == 0 or data[pos - 1] == 10)
+                            if idx is not None:
+                                idx.add(starts)
+                            docs += len(starts)
+                            copy_span(fh.fileno(), dst, pos, out_pos + pos, end - pos, view, methods)
+                            bar.update(end - pos)
+                    missing_nl = data[-1] != 10
+                    del data
+            out_pos += size
+            if missing_nl:
+                os.pwrite(dst, b"\n", out_pos)
+                out_pos += 1
+    finally:
+        os.close(dst)
+    print(f"copied with {methods[0]}")
+    return docs, out_pos
+
+def _concat_stream(in_paths: list[Path], out_path: Path, idx) -> tuple[int, int]:
+    docs = out_pos = 0
+    with open_write(out_path) as out:
+        for p in in_paths:
+            print(f"appending {p}...")
+            last = b"\n"
+            with tqdm(unit="B", unit_scale=True, desc=p.name) as bar:
+                for _, block in iter_blocks(p):
+                    starts = line_starts(np.frombuffer(block, dtype=np.uint8), out_pos)
+                    if idx is not None:
+                        idx.add(starts)
+                    docs += len(starts)
+                    out.write(block)
+                    out_pos += len(block)
+                    last = block[-1:]
+                    bar.update(len(block))
+            if last != b"\n":
+                out.write(b"\n")
+                out_pos += 1
+    return docs, out_pos
+
+def concat(in_paths: list[Path], out_path: Path) -> tuple[int, int]:
+    # -> (documents, output bytes); a plain output gets its index at <output>.idx
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    idx = None if is_zst(out_path) else IndexWriter(out_path)
+    if is_zst(out_path) or any(is_zst(p) for p in in_paths):
+        docs, size = _concat_stream(in_paths, out_path, idx)
+    else:
+        docs, size = _concat_plain(in_paths, out_path, idx)
+    if idx is not None:
+        idx.close()
+    return docs, size
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="concatenate jsonl files and index their documents")
+    ap.add_argument("paths", nargs="*", default=[FILE1, FILE2], help="input files, in order (default: %(default)s)")
+    ap.add_argument("-o", "--output", default=OUTPUT, help="destination file (default: %(default)s)")
+    args = ap.parse_args()
+
+    out_path = Path(args.output).expanduser()
+    total_lines, _ = concat([Path(p).expanduser() for p in args.paths], out_path)
+
+    file_size_gb = os.path.getsize(out_path) / (1024**3)
+    print(f"total lines: {total_lines:,}")
+    print(f"output size: {file_size_gb:.2f}GB")
+    print(f"output: {out_path}")
+    if not is_zst(out_path):
+        print(f"index: {index_path(out_path)}")
+
+
+if __name__ == "__main__":
+    main()
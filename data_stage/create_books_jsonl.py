@@ -1,9 +1,13 @@
-import json
 import os
+import sys
 from random import shuffle
 import re
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))     # -> repo root, for jsonl_io
+from jsonl_io import JsonlWriter
+from char_stats import CharStats, codepoints, drop_chars
+
 books_folder = "Extracted_Texts"
 books_jsonl_file = "books.jsonl"
 agonia_jsonl_file = "agonia.jsonl"
@@ -16,16 +20,17 @@ OUTPUT_JSONL = "/Volumes/KINGSTON/data.jsonl"
 # -> a type of aggressive cleaning that tries to remove as much noise as possible, while keeping the text structure and formatting as much as possible
 def clean_text_aggressive(text):
     text = text.encode('utf-8', errors='ignore').decode('utf-8')
-    text = ''.join(ch for ch in text if not (ord(ch) < 32 and ch not in '\n\t\r'))
+    cp = codepoints(text)
+    text = drop_chars(text, (cp < 32) & (cp != 10) & (cp != 9) & (cp != 13), cp)
     
     # -> remove all angle brackets with garbage (OCR artifacts like <XOPT]youvtO>)
     text = re.sub(r'<[^>]*>', '', text)
     
     lines = text.split('\n')
+    special = CharStats(text).special('ăâîșțçéèêëàìíîïòóôõöùúûüýÿœæĂÂÎȘȚ.,;:!?"\'-()[]{}').tolist()
     cleaned_lines = []
-    for line in lines:
+    for line, special_count in zip(lines, special):
         # -> skip lines with >30% special characters
-        special_count = sum(1 for c in line if not (c.isalnum() or c.isspace() or c in 'ăâîșțçéèêëàìíîïòóôõöùúûüýÿœæĂÂÎȘȚ.,;:!?"\'-()[]{}'))
         if special_count / (len(line) + 1e-9) > 0.3:
             continue
         
@@ -48,9 +53,8 @@ def clean_text_aggressive(text):
     
     lines = text.split('\n')
     cleaned_lines = []
-    for line in lines:
+    for line, rare_unicode in zip(lines, CharStats(text).above(0x3000).tolist()):
         # -> skip lines with too many CJK or rare unicode
-        rare_unicode = sum(1 for c in line if ord(c) > 0x3000)
         if rare_unicode / (len(line) + 1e-9) > 0.2:
             continue
         cleaned_lines.append(line)
@@ -162,7 +166,7 @@ def convert_to_jsonl(cleaned_dir, output_jsonl, chunk_size=2048):
     txt_files = sorted(list(cleaned_path.glob('*.txt')))
     total_records = 0
     
-    with open(output_jsonl, 'w', encoding='utf-8') as jsonl_file:
+    with JsonlWriter(output_jsonl) as jsonl_file:
         for txt_file in txt_files:
             with open(txt_file, 'r', encoding='utf-8') as f:
                 text = f.read()
@@ -172,8 +176,7 @@ def convert_to_jsonl(cleaned_dir, output_jsonl, chunk_size=2048):
             
             for chunk in chunks:
                 if len(chunk) > 100:
-                    record = {'text': chunk}
-                    jsonl_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    jsonl_file.write_text(chunk)
                     total_records += 1
     
     print(f"created {output_jsonl} with {total_records} records")
@@ -3,11 +3,15 @@ import PyPDF2
 from pathlib import Path
 from multiprocessing import Pool, cpu_count
 import re
-import unicodedata
 import gc
 import psutil
 import json
+import sys
 import time
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))     # -> repo root, for char_stats
+from char_stats import ALPHA, OTHER, codepoints, char_flags, drop_chars
 
 # -> we have around 5000 books -> around 160GB of pdfs
 # -> in this script we will try and extract text from all the books in Romanian that I have scraped off the web
@@ -46,7 +50,8 @@ def is_gibberish(text):
         return True
     
     # -> check if most characters are readable (letters, digits, common punctuation)
-    problematic = sum(1 for c in text if ord(c) > 127 and not unicodedata.category(c)[0] == 'L')
+    cp = codepoints(text)
+    problematic = int(np.count_nonzero((cp > 127) & ((char_flags(cp) & ALPHA) == 0)))
     if problematic / len(text) > 0.2: 
         return True
     
@@ -62,7 +67,8 @@ def clean_text(text):
         return ""
     
     # -> remove control characters
-    text = "".join(ch for ch in text if unicodedata.category(ch)[0] != "C" or ch in "\n\t\r")
+    cp = codepoints(text)
+    text = drop_chars(text, ((char_flags(cp) & OTHER) != 0) & (cp != 10) & (cp != 9) & (cp != 13), cp)
     text = text.encode('utf-8', errors='ignore').decode('utf-8')
     
     # -> fix split words
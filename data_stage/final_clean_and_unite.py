@@ -1,20 +1,31 @@
-import json
 import os
 import re
+import sys
+import argparse
+from multiprocessing import Pool, cpu_count
 from pathlib import Path
 from tqdm import tqdm
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))     # -> repo root, for jsonl_io
+from jsonl_io import JsonlWriter, open_text, iter_text_batches, bounded_imap
+from char_stats import CharStats, codepoints, drop_chars
+
 # -> final cleaning script before training tokenizer
+# -> every mode streams: records are written as they are read (and cleaned), only the running
+# -> stats and a few batches in flight are kept, so memory stays flat whatever the corpus size
 BOOKS_CLEANED_FILE = "data/books_cleaned.jsonl"
 CLEANED_CORPUS_FILE = "data/CLEANED_CORPUS.jsonl"
 AGONIA_FILE = "data/agonia.jsonl"
 OUTPUT_JSONL = "data/final_data.jsonl"
 FINAL_OUTPUT = "data/WEB_BOOKS_LITERARY.jsonl"
+MIN_CHARS = 500     # -> cleaned texts this short are dropped
+BATCH = 1000        # -> texts per worker task
 
 def clean_final_text(text):
     # -> remove control characters but keep newlines
     text = text.encode('utf-8', errors='ignore').decode('utf-8')
-    text = ''.join(ch for ch in text if not (ord(ch) < 32 and ch not in '\n\t\r'))
+    cp = codepoints(text)
+    text = drop_chars(text, (cp < 32) & (cp != 10) & (cp != 9) & (cp != 13), cp)
     
     # -> remove angle brackets with garbage
     text = re.sub(r'<[^>]*>', '', text)
@@ -35,18 +46,17 @@ def clean_final_text(text):
     
     # -> filter out metadata/garbage lines
     lines = text.split('\n')
+    stats = CharStats(text)
     filtered_lines = []
-    for line in lines:
-        # -> count actual letters (Romanian + English)
-        letter_count = sum(1 for c in line if c.isalpha())
+    # -> letters (Romanian + English) and special chars of every line, counted in one go
+    for line, letter_count, special_chars in zip(lines, stats.alpha().tolist(),
+                                                 stats.special('ăâîșț.,;:!?"\'-()[]{}').tolist()):
         # -> if line has less than 30% letters, it's probably garbage (ISBN, emails, phone numbers, etc)
         if len(line) > 20 and letter_count / len(line) < 0.3:
             continue
         # -> skip lines that are mostly special chars
-        if len(line) > 10:
-            special_chars = sum(1 for c in line if not (c.isalnum() or c.isspace() or c in 'ăâîșț.,;:!?"\'-()[]{}'))
-            if special_chars / len(line) > 0.4:
-                continue
+        if len(line) > 10 and special_chars / len(line) > 0.4:
+            continue
         filtered_lines.append(line)
     
     text = '\n'.join(filtered_lines)
@@ -54,78 +64,111 @@ def clean_final_text(text):
     text = text.strip()
     return text
 
-# -> process each file, clean the text, and return a list of records
-def process_jsonl_file(file_path):
-    records = []
-    try:
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            for line in f:
-                try:
-                    record = json.loads(line)
-                    if 'text' in record:
-                        cleaned_text = clean_final_text(record['text'])
-                        if len(cleaned_text) > 500:
-                            records.append({'text': cleaned_text})
-                except json.JSONDecodeError:
-                    continue
-    except Exception as e:
-        print(f"Error processing {file_path}: {e}")
-    return records
-
 # -> process txt files (if any) and return records
 def process_txt_file(file_path):
     records = []
     try:
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        with open_text(file_path, errors='ignore') as f:
             text = f.read()
             cleaned_text = clean_final_text(text)
-            if len(cleaned_text) > 500:
+            if len(cleaned_text) > MIN_CHARS:
                 records.append({'text': cleaned_text})
     except Exception as e:
         print(f"Error processing {file_path}: {e}")
     
     return records
 
-# -> cleaning function to check if text is mostly garbage (too many non-ASCII chars, too many newlines, etc)
-def concatenate_and_clean(file1, file2, output_file):
-    all_records = []
-    total_chars = 0
-    
-    input_files = [file1, file2]
-    input_files = [f for f in input_files if os.path.exists(f)]
-    print(f"found {len(input_files)} files to process")
-    
-    for file_path in tqdm(input_files, desc="processing files"):
-        records = process_jsonl_file(file_path)
-        
-        for record in records:
-            all_records.append(record)
-            total_chars += len(record['text'])
-    
-    # -> write to output jsonl
-    print("writing to output file...")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for record in tqdm(all_records, desc="writing records"):
-            f.write(json.dumps(record, ensure_ascii=False) + '\n')
-    
-    # -> calculate final size
+def clean_batch(texts):
+    cleaned = (clean_final_text(text) for text in texts)
+    return [text for text in cleaned if len(text) > MIN_CHARS]
+
+def keep_batch(texts):
+    return [text for text in texts if text]
+
+def file_batches(file_path, func, pool=None, workers=1):
+    # -> `func` applied to the batches of one file, in a worker pool if there is one
+    # -> invalid utf-8 bytes are dropped and the rest of the line kept, as reading the files with
+    # -> errors='ignore' always did
+    batches = iter_text_batches(file_path, BATCH, errors="ignore")
+    if pool is None:
+        return map(func, batches)
+    return bounded_imap(pool, func, batches, 2 * workers)
+
+def unite(input_files, output_file, clean=False, workers=1):
+    # -> stream every input into one output; clean=True runs clean_final_text and drops short texts
+    # -> records go to a temporary file next to the output, renamed over it only when every input was
+    # -> read to the end and records were written; a file that fails half way is reported, the others
+    # -> are still read (to report their errors too), then the run raises and the output is untouched
+    func = clean_batch if clean else keep_batch
+    total_records = total_chars = 0
+    failed = []
+    output_file = Path(output_file)
+    tmp = output_file.with_name(".tmp." + output_file.name)     # -> keeps the .jsonl(.zst) suffix
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        with JsonlWriter(tmp) as f:
+            for file_path in input_files:
+                print(f"reading {file_path}...")
+                file_records = file_chars = 0
+                try:
+                    bar = tqdm(desc=f"processing {os.path.basename(file_path)}", unit="rec")
+                    for texts in file_batches(file_path, func, pool, workers):
+                        for text in texts:
+                            f.write_text(text)
+                            file_records += 1
+                            file_chars += len(text)
+                        bar.update(len(texts))
+                    bar.close()
+                except Exception as e:
+                    print(f"error reading {file_path}: {e}")
+                    failed.append(file_path)
+                print(f"-> records: {file_records:,}")
+                print(f"-> characters: {file_chars:,}")
+                total_records += file_records
+                total_chars += file_chars
+        if failed:
+            raise RuntimeError(f"could not read {', '.join(map(str, failed))}; {output_file} left untouched")
+        if total_records:
+            tmp.replace(output_file)
+    finally:
+        tmp.unlink(missing_ok=True)
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return total_records, total_chars
+
+def print_stats(output_file, total_records, total_chars):
     file_size_mb = os.path.getsize(output_file) / (1024 * 1024)
     file_size_gb = file_size_mb / 1024
-    print(f"total records: {len(all_records)}")
+    print(f"total records: {total_records:,}")
     print(f"total characters: {total_chars:,}")
     print(f"total characters (GB): {total_chars / (1024**3):.2f}GB")
     print(f"output file size: {file_size_mb:.2f}MB ({file_size_gb:.2f}GB)")
     print(f"output file: {output_file}")
-    return all_records, total_chars
+
+# -> cleaning function to check if text is mostly garbage (too many non-ASCII chars, too many newlines, etc)
+def concatenate_and_clean(file1, file2, output_file, workers=1):
+    input_files = [file1, file2]
+    input_files = [f for f in input_files if os.path.exists(f)]
+    print(f"found {len(input_files)} files to process")
+    
+    total_records, total_chars = unite(input_files, output_file, clean=True, workers=workers)
+    print_stats(output_file, total_records, total_chars)
+    return total_records, total_chars
 
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="unite the cleaned web corpus and the books into the final file")
+    ap.add_argument("paths", nargs="*", default=[CLEANED_CORPUS_FILE, OUTPUT_JSONL],
+                    help="input .jsonl files, in order (default: %(default)s)")
+    ap.add_argument("-o", "--output", default=FINAL_OUTPUT, help="destination file (default: %(default)s)")
+    ap.add_argument("--clean", action="store_true",
+                    help=f"run clean_final_text on every record and drop results of {MIN_CHARS} chars or less")
+    ap.add_argument("--workers", type=int, default=1,
+                    help=f"worker processes for --clean (default: %(default)s, this machine has {cpu_count()})")
+    args = ap.parse_args()
     try:
-        final_records = []
-        total_chars = 0
-        
-        input_files = [CLEANED_CORPUS_FILE, OUTPUT_JSONL]
-        input_files = [f for f in input_files if os.path.exists(f)]
+        input_files = [f for f in args.paths if os.path.exists(f)]
         
         print(f"found {len(input_files)} files to concatenate")
         print()
@@ -134,60 +177,21 @@ if __name__ == "__main__":
             print("error: no input files found!")
             exit(1)
         
-        # -> read both files and concatenate
-        for file_path in input_files:
-            print(f"reading {file_path}...")
-            file_records = 0
-            file_chars = 0
-            
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    for line in tqdm(f, desc=f"processing {os.path.basename(file_path)}"):
-                        try:
-                            record = json.loads(line.strip())
-                            if 'text' in record and record['text']:
-                                final_records.append(record)
-                                file_records += 1
-                                file_chars += len(record['text'])
-                                total_chars += len(record['text'])
-                        except (json.JSONDecodeError, ValueError):
-                            continue
-                
-                print(f"-> records: {file_records}")
-                print(f"-> characters: {file_chars:,}")            
-            except Exception as e:
-                print(f"error reading {file_path}: {e}")
-                continue
-        
-        if len(final_records) == 0:
-            print("error: no records found in input files!")
-            exit(1)
-        
-        # -> write final combined file
-        print("writing final combined file...")
+        # -> read the files one after another, writing every record as it comes
         try:
-            with open(FINAL_OUTPUT, 'w', encoding='utf-8') as f:
-                for record in tqdm(final_records, desc="writing records"):
-                    try:
-                        f.write(json.dumps(record, ensure_ascii=False) + '\n')
-                    except Exception as e:
-                        print(f"error writing record: {e}")
-                        continue
-        
+            total_records, total_chars = unite(input_files, args.output, clean=args.clean,
+                                               workers=max(1, args.workers) if args.clean else 1)
         except Exception as e:
-            print(f"error writing output file: {e}")
+            print(f"error: {e}")
+            exit(1)
+        
+        if total_records == 0:
+            print("error: no records found in input files!")
             exit(1)
         
         # -> final stats
         try:
-            file_size_mb = os.path.getsize(FINAL_OUTPUT) / (1024 * 1024)
-            file_size_gb = file_size_mb / 1024
-            
-            print(f"total records: {len(final_records):,}")
-            print(f"total characters: {total_chars:,}")
-            print(f"total characters (GB): {total_chars / (1024**3):.2f}GB")
-            print(f"output file size: {file_size_mb:.2f}MB ({file_size_gb:.2f}GB)")
-            print(f"output file: {FINAL_OUTPUT}")        
+            print_stats(args.output, total_records, total_chars)
         except Exception as e:
             print(f"error calculating stats: {e}")
     
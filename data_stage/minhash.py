@@ -0,0 +1,104 @@
+import re
+from functools import lru_cache
+import numpy as np
+from datasketch import MinHash, MinHashLSH
+
+# -> minhash helpers shared by the contamination test and the corpus near-dedup
+# -> a doc is lowercased, whitespace-collapsed and cut into character 5-grams
+# -> make_minhash() is the reference: one MinHash.update() (sha1 + 128 permutations) per 5-gram
+# -> batch_signatures() gives the same kind of signature for many docs at once:
+# ->   - the 5-grams are hashed with a numpy rolling (FNV) hash over the code points, no python loop
+# ->   - the datasketch permutations (same seed, same affine32 scheme) are applied to all shingles
+# ->     of a block of docs as one (shingles x num_perm) array and min-reduced per doc
+# -> the shingle hash differs from sha1, so batch and reference signatures must not be mixed in one
+# -> index, but to_minhash() turns a batch signature into a regular MinHash for MinHashLSH
+NUM_PERM = 128      # -> MinHash permutations
+NGRAM_SIZE = 5      # -> character n-grams
+SCHEME = "affine32" # -> datasketch permutation scheme (a * fmix32(h) + b mod 2^32)
+_BLOCK = 1 << 14    # -> shingles per permutation block -> (16k x 128) uint32 = 8MB
+_MAX_HASH = np.uint32(0xFFFFFFFF)
+
+def normalize(text: str) -> str:
+    text = text.lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text
+
+def make_minhash(text: str, num_perm: int = NUM_PERM) -> MinHash:
+    m = MinHash(num_perm=num_perm)
+    text = normalize(text)
+    for i in range(len(text) - NGRAM_SIZE + 1):
+        m.update(text[i:i+NGRAM_SIZE].encode("utf-8"))
+    return m
+
+def lsh_params(threshold: float, num_perm: int = NUM_PERM) -> tuple[int, int]:
+    # -> (bands, rows per band) -> same choice MinHashLSH makes for this threshold
+    lsh = MinHashLSH(threshold=threshold, num_perm=num_perm)
+    return lsh.b, lsh.r
+
+def band_keys(hashvalues: np.ndarray, bands: int, rows: int) -> np.ndarray:
+    # -> (n_docs, num_perm) signatures -> (n_docs, bands) 64-bit bucket keys
+    # -> each band's `rows` hash values are folded with FNV-1a style mixing (uint64 wraps around)
+    hv = np.ascontiguousarray(hashvalues, dtype=np.uint64)[:, :bands * rows].reshape(len(hashvalues), bands, rows)
+    keys = np.full((len(hashvalues), bands), 0xCBF29CE484222325, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for j in range(rows):
+            keys ^= hv[:, :, j]
+            keys *= np.uint64(0x100000001B3)
+    return keys
+
+@lru_cache(maxsize=None)
+def _permutations(num_perm: int) -> tuple[np.ndarray, np.ndarray]:
+    a, b = MinHash(num_perm=num_perm, scheme=SCHEME).permutations
+    return a, b
+
+def _fmix32(h: np.ndarray) -> np.ndarray:
+    # -> MurmurHash3 finalizer (same one datasketch applies before the affine permutation)
+    h = h ^ (h >> np.uint32(16))
+    h = h * np.uint32(0x85EBCA6B)
+    h = h ^ (h >> np.uint32(13))
+    h = h * np.uint32(0xC2B2AE35)
+    return h ^ (h >> np.uint32(16))
+
+def shingle_hashes(text: str) -> np.ndarray:
+    # -> 32-bit hash of every character NGRAM_SIZE-gram of normalize(text)
+    cp = np.frombuffer(normalize(text).encode("utf-32-le"), dtype=np.uint32)
+    n = len(cp) - NGRAM_SIZE + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.uint32)
+    h = np.full(n, 0x811C9DC5, dtype=np.uint32)
+    for k in range(NGRAM_SIZE):
+        h = (h * np.uint32(0x01000193)) ^ cp[k:k + n]
+    return h
+
+def _permuted(hv: np.ndarray, num_perm: int) -> np.ndarray:
+    a, b = _permutations(num_perm)
+    return _fmix32(hv)[:, None] * a + b
+
+def batch_signatures(texts: list[str], num_perm: int = NUM_PERM) -> np.ndarray:
+    # -> (len(texts), num_perm) uint32 signatures; docs shorter than one shingle keep the empty
+    # -> MinHash value (all 0xFFFFFFFF), like make_minhash
+    shingles = [shingle_hashes(t) for t in texts]
+    sigs = np.full((len(texts), num_perm), _MAX_HASH, dtype=np.uint32)
+    with np.errstate(over="ignore"):
+        i = 0
+        while i < len(shingles):
+            # -> group consecutive docs into blocks of <= _BLOCK shingles, a bigger doc goes alone
+            j, rows = i + 1, len(shingles[i])
+            while j < len(shingles) and rows + len(shingles[j]) <= _BLOCK:
+                rows += len(shingles[j])
+                j += 1
+            group = [k for k in range(i, j) if len(shingles[k])]
+            if rows > _BLOCK:
+                hv = shingles[i]
+                for c in range(0, len(hv), _BLOCK):
+                    sigs[i] = np.minimum(sigs[i], _permuted(hv[c:c + _BLOCK], num_perm).min(axis=0))
+            elif group:
+                starts = np.cumsum([0] + [len(shingles[k]) for k in group[:-1]])
+                hv = np.concatenate([shingles[k] for k in group])
+                sigs[group] = np.minimum.reduceat(_permuted(hv, num_perm), starts, axis=0)
+            i = j
+    return sigs
+
+def to_minhash(signature: np.ndarray) -> MinHash:
+    a, b = _permutations(len(signature))
+    return MinHash(num_perm=len(signature), hashvalues=signature, permutations=(a, b), scheme=SCHEME)
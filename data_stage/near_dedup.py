@@ -0,0 +1,130 @@
+import sys
+import argparse
+from pathlib import Path
+from multiprocessing import Pool, cpu_count
+import numpy as np
+from tqdm import tqdm
+from minhash import batch_signatures, lsh_params, band_keys
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT / "cleaning_stages"), str(ROOT)]     # -> cleaning_stages for engine, repo root for jsonl_io
+from jsonl_io import open_write, iter_blocks, read_range, block_lines, line_docs, is_zst, bounded_imap
+from engine import expand_inputs, byte_ranges
+
+# -> near-duplicate removal for the whole training corpus (web + books)
+# -> the cleaning stages only drop exact duplicates (sha of the text), but web crawls are full of
+# -> pages that differ by a date, a counter or a menu -> same boilerplate, thousands of copies
+# -> pass 1: every doc gets a MinHash signature (char 5-grams, batch_signatures) that is
+# ->         cut into LSH bands; workers handle newline-aligned byte ranges of the jsonl files
+# -> dedup:  a doc is dropped if it shares a band bucket with any earlier doc -> per band we sort the
+# ->         bucket keys once (stable, so the first doc of a bucket wins), no giant in-memory LSH index
+# -> pass 2: the surviving lines are copied byte for byte, in input order
+# -> .jsonl.zst inputs / output work too: compressed inputs are decompressed by the parent and handed
+# -> to the workers as newline-aligned chunks (twice, once per pass)
+# -> input folders and byte ranges are the cleaning engine's (expand_inputs / byte_ranges, which cut
+# -> a plain file with a fresh doc_index.py index on its document starts)
+# -> band / row counts come from MinHashLSH for the threshold, so "near duplicate" means the same
+# -> thing as in the contamination test
+INPUT_FILE = "data/WEB_BOOKS_LITERARY.jsonl"
+OUTPUT_FILE = "data/WEB_BOOKS_LITERARY.neardedup.jsonl"
+THRESHOLD = 0.85    # -> Jaccard similarity above which two docs count as near duplicates
+BATCH_DOCS = 1024   # -> docs per batch_signatures() call
+
+def chunks(path: Path, chunk_bytes: int):
+    # -> plain files: (path, start, end) byte ranges, read by whoever processes them
+    # -> .zst files: the decompressed newline-aligned chunks themselves
+    if is_zst(path):
+        yield from (data for _, data in iter_blocks(path, 0, chunk_bytes))
+    else:
+        yield from ((path, a, b) for a, b in byte_ranges(path, chunk_bytes))
+
+def load_chunk(task) -> bytes:
+    return task if isinstance(task, bytes) else read_range(*task)
+
+def iter_docs(data: bytes):
+    # -> (line start, line end, text) for every line of the chunk that holds a json doc with a string "text"
+    for (a, b), text in line_docs(line_spans(data)):
+        if isinstance(text, str):
+            yield a, b, text
+
+def line_spans(data: bytes):
+    # -> block_lines with (line start, line end) instead of the offset after the newline
+    for pos, ln in block_lines(data):
+        end = pos - (data[pos - 1] == 10)
+        yield (end - len(ln), end), ln
+
+_bands = _rows = 0
+
+def _init_worker(bands: int, rows: int) -> None:
+    global _bands, _rows
+    _bands, _rows = bands, rows
+
+def _signature_range(task):
+    # -> pass 1 for one byte range -> line offsets + LSH band keys of its docs
+    spans, texts = [], []
+    for a, b, text in iter_docs(load_chunk(task)):
+        spans.append((a, b))
+        texts.append(text)
+    spans = np.array(spans, dtype=np.int64).reshape(-1, 2)
+    keys = [band_keys(batch_signatures(texts[i:i + BATCH_DOCS]), _bands, _rows)
+            for i in range(0, len(texts), BATCH_DOCS)]
+    return spans, np.concatenate(keys) if keys else np.empty((0, _bands), dtype=np.uint64)
+
+def find_duplicates(keys: np.ndarray) -> np.ndarray:
+    # -> keys (n_docs, bands) -> bool mask of docs that share a bucket with an earlier doc
+    dup = np.zeros(len(keys), dtype=bool)
+    for j in range(keys.shape[1]):
+        order = np.argsort(keys[:, j], kind="stable")
+        col = keys[order, j]
+        dup[order[1:][col[1:] == col[:-1]]] = True
+    return dup
+
+def near_dedup(in_paths: list[Path], out_path: Path, threshold: float = THRESHOLD,
+               workers: int = 1, chunk_mb: int = 64) -> tuple[int, int]:
+    bands, rows = lsh_params(threshold)
+    files = expand_inputs(in_paths)
+
+    def tasks():
+        return (t for p in files for t in chunks(p, chunk_mb << 20))
+
+    print(f"threshold {threshold} -> {bands} bands x {rows} rows")
+
+    spans, keys = [], []
+    with Pool(workers, initializer=_init_worker, initargs=(bands, rows)) as pool:
+        for s, k in tqdm(bounded_imap(pool, _signature_range, tasks(), 2 * workers), desc="minhash", unit="chunk"):
+            spans.append(s)
+            keys.append(k)
+
+    dup = find_duplicates(np.concatenate(keys))
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    first = 0
+    with open_write(out_path) as out:
+        for task, s in tqdm(zip(tasks(), spans), total=len(spans), desc="writing", unit="chunk"):
+            data = load_chunk(task)
+            for (a, b), is_dup in zip(s.tolist(), dup[first:first + len(s)].tolist()):
+                if not is_dup:
+                    out.write(data[a:b])
+                    out.write(b"\n")
+            first += len(s)
+    return len(dup), int(len(dup) - dup.sum())
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="MinHash LSH near-duplicate removal")
+    ap.add_argument("paths", nargs="*", default=[INPUT_FILE], help="input .jsonl file(s) or folder(s)")
+    ap.add_argument("-o", "--output", default=OUTPUT_FILE, help="destination file (default: %(default)s)")
+    ap.add_argument("--threshold", type=float, default=THRESHOLD,
+                    help="Jaccard similarity that counts as near duplicate (default: %(default)s)")
+    ap.add_argument("--workers", type=int, default=cpu_count(),
+                    help="worker processes for the signatures (default: %(default)s)")
+    ap.add_argument("--chunk-mb", type=int, default=64,
+                    help="size of the byte ranges handed to workers (default: %(default)s)")
+    args = ap.parse_args()
+
+    out_path = Path(args.output).expanduser()
+    total, kept = near_dedup([Path(p).expanduser() for p in args.paths], out_path,
+                             args.threshold, max(1, args.workers), max(1, args.chunk_mb))
+    print(f"\n {total:,} docs -> {kept:,} kept ({total - kept:,} near duplicates)   ->  {out_path.resolve()}")
+
+
+if __name__ == "__main__":
+    main()
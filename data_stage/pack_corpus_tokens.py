@@ -1,47 +1,102 @@
-from transformers import PreTrainedTokenizerFast
-import json
+import os
+import sys
+import argparse
+from itertools import chain
+from multiprocessing import Pool, cpu_count
+from pathlib import Path
+import numpy as np
 import tqdm
 
-# -> here we read the cleaned jsonl corpus, tokenize it and pack it into a new jsonl file where
-# -> each object is a continuous stream of tokens up to 2048 tokens long, without splitting words across objects
-# -> this way we dont have to use padding so we dont lose compute efficiency
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))     # -> repo root, for jsonl_io
+from jsonl_io import iter_text_batches, bounded_imap
+from token_store import TokenWriter, file_sha256, token_dtype
+
+# -> here we read the cleaned jsonl corpus, tokenize it and pack it into one flat binary token file
+# -> (see token_store.py): every document's ids framed as <s> ids </s> like the trainer's inline
+# -> pack_fn (doc attention finds document starts by <s>), back to back, and block i of the
+# -> continuous stream is tokens[i * 2048:(i + 1) * 2048]
+# -> this way we dont have to use padding so we dont lose compute efficiency, and the trainer maps
+# -> the file instead of parsing json lists of ints (uint16 ids: ~2 bytes per token on disk)
+# -> the metadata next to it records vocab size, block size, the tokenizer's sha256, the bos / eos ids
+# -> and where every document starts
+# -> documents are tokenized in batches with the fast tokenizer's batch call, one batch per worker
+# -> process; results are written in input order, so the output is the same for any --workers
 corpus_path = "/Volumes/KINGSTON/WEB_BOOKS_LITERARY.jsonl"
-output_path = "/Volumes/KINGSTON/PACKED_CORPUS_READY.jsonl"
+output_path = "/Volumes/KINGSTON/PACKED_CORPUS_READY.bin"
 tokenizer_path = "/Volumes/KINGSTON/ro_tokenizer.json"
 CONTEXT_LENGTH = 2048
+BATCH = 1000        # -> documents per worker task
+
+_tokenizer = None
 
-# -> initialize tokenizer
-tokenizer = PreTrainedTokenizerFast(tokenizer_file=tokenizer_path)
-tokenizer.eos_token = "</s>" 
-current_block = []
+def load_tokenizer(path, threads=True):
+    # -> threads=False in worker processes: one rust thread each, the pool already uses every core
+    global _tokenizer
+    if not threads:
+        os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    from transformers import PreTrainedTokenizerFast
+    _tokenizer = PreTrainedTokenizerFast(tokenizer_file=str(path))
+    _tokenizer.bos_token, _tokenizer.eos_token = "<s>", "</s>"
+    return _tokenizer
 
-# -> stream through the corpus line by line to avoid loading everything into memory
-# -> for each line, we tokenize the text and add the tokens to a continuous stream until we hit 2048 tokens
-# -> at which point we save that block and start a new one
-with open(corpus_path, 'r', encoding='utf-8') as f_in, open(output_path, 'w', encoding='utf-8') as f_out:
-    for line in tqdm.tqdm(f_in, desc="streaming and packing"):
+def _encode_each(texts):
+    # -> one at a time, for a batch the batch call failed on: bad documents are skipped
+    ids = []
+    for text in texts:
         try:
-            data = json.loads(line)
-            text = data['text']
-            
-            # -> tokenize the text
-            tokens = tokenizer.encode(text, add_special_tokens=False)
-            tokens.append(tokenizer.eos_token_id)
-            
-            # -> add tokens to the continuous stream
-            for token_id in tokens:
-                current_block.append(token_id)
-                
-                # -> as soon as we hit 2048, we save and clear
-                if len(current_block) == CONTEXT_LENGTH:
-                    json.dump({'input_ids': current_block}, f_out)
-                    f_out.write('\n')
-                    current_block = []
-                    
+            ids.append(_tokenizer.encode(text, add_special_tokens=False))
         except Exception:
             continue
+    return ids
+
+def encode_batch(texts):
+    # -> (ids of the batch back to back, every document as bos ids eos, tokens per document)
+    try:
+        ids = _tokenizer(texts, add_special_tokens=False)["input_ids"]
+    except Exception:
+        ids = _encode_each(texts)
+    lengths = np.fromiter((len(x) + 2 for x in ids), dtype=np.int64, count=len(ids))
+    flat = np.empty(int(lengths.sum()), dtype=token_dtype(len(_tokenizer)))
+    ends = np.cumsum(lengths)
+    marker = np.zeros(len(flat), dtype=bool)
+    marker[ends - lengths] = marker[ends - 1] = True
+    flat[ends - lengths] = _tokenizer.bos_token_id
+    flat[ends - 1] = _tokenizer.eos_token_id
+    flat[~marker] = np.fromiter(chain.from_iterable(ids), dtype=flat.dtype, count=len(flat) - 2 * len(ids))
+    return flat, lengths
+
+def pack(corpus, output, tokenizer_file, block_size=CONTEXT_LENGTH, workers=1):
+    tokenizer = load_tokenizer(tokenizer_file)
+    batches = iter_text_batches(corpus, BATCH)
+    pool = Pool(workers, load_tokenizer, (tokenizer_file, False)) if workers > 1 else None
+    try:
+        encoded = map(encode_batch, batches) if pool is None else bounded_imap(pool, encode_batch, batches, 2 * workers)
+        # -> stream through the corpus batch by batch to avoid loading everything into memory
+        # -> and append the tokens of every batch to the continuous stream on disk
+        with TokenWriter(output, len(tokenizer), block_size, file_sha256(tokenizer_file),
+                         tokenizer.eos_token_id, tokenizer.bos_token_id) as f_out:
+            bar = tqdm.tqdm(desc="streaming and packing", unit="doc")
+            for flat, lengths in encoded:
+                f_out.add_docs(flat, lengths)
+                bar.update(len(lengths))
+            bar.close()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return f_out
+
 
-    # -> save the final partial block if it exists
-    if current_block:
-        json.dump({'input_ids': current_block}, f_out)
-        f_out.write('\n')
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="tokenize the corpus into a packed token store")
+    ap.add_argument("corpus", nargs="?", default=corpus_path, help="input .jsonl (default: %(default)s)")
+    ap.add_argument("-o", "--output", default=output_path, help="destination .bin (default: %(default)s)")
+    ap.add_argument("--tokenizer", default=tokenizer_path, help="tokenizer.json (default: %(default)s)")
+    ap.add_argument("--block-size", type=int, default=CONTEXT_LENGTH, help="tokens per block (default: %(default)s)")
+    ap.add_argument("--workers", type=int, default=cpu_count(),
+                    help="tokenizer processes (default: %(default)s); 1 tokenizes in this process, "
+                         "on the tokenizer's own threads")
+    args = ap.parse_args()
+    f_out = pack(args.corpus, args.output, args.tokenizer, args.block_size, max(1, args.workers))
+    # -> the tokens after the last full block stay in the file but are not a block
+    print(f"{f_out.tokens:,} tokens, {f_out.tokens // args.block_size:,} blocks of {args.block_size} -> {f_out.bin_path}")
@@ -1,8 +1,12 @@
-import json
-import re
 import sys
+from itertools import islice
 from pathlib import Path
-from datasketch import MinHash, MinHashLSH
+from datasketch import MinHashLSH
+from minhash import NUM_PERM, NGRAM_SIZE, batch_signatures, to_minhash
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))     # -> repo root, for jsonl_io
+from jsonl_io import iter_texts, is_zst
+from doc_index import DocIndex
 
 
 # -> we employ this in order to test the contamination degree of our saved datasets
@@ -21,42 +25,21 @@ EVAL_FILES = {
 
 # -> some parameters 
 THRESHOLD = 0.85    # -> Jaccard similarity threshold to call a "match"
-NUM_PERM = 128    # -> MinHash permutations 
-NGRAM_SIZE = 5      # -> character n-grams 
 MAX_TRAIN = None  
 REPORT_EVERY = 100_000
-
-def normalize(text: str) -> str:
-    text = text.lower()
-    text = re.sub(r"\s+", " ", text).strip()
-    return text
-
-def make_minhash(text: str, num_perm: int = NUM_PERM) -> MinHash:
-    m = MinHash(num_perm=num_perm)
-    text = normalize(text)
-    for i in range(len(text) - NGRAM_SIZE + 1):
-        m.update(text[i:i+NGRAM_SIZE].encode("utf-8"))
-    return m
-
-def read_texts(jsonl_path: Path, max_docs=None):
-    with open(jsonl_path, "r", encoding="utf-8") as f:
-        for i, line in enumerate(f):
-            if max_docs and i >= max_docs:
-                break
-            try:
-                yield json.loads(line)["text"]
-            except (json.JSONDecodeError, KeyError):
-                continue
+BATCH_DOCS = 1024   # -> train docs hashed per batch_signatures() call
+SHOW_MATCHES = 3    # -> (eval doc, train doc) pairs printed per contaminated dataset
 
 # -> hash all eval docs upfront -> small -> fit RAM
 eval_hashes = {}   # {dataset_name: [(doc_index, MinHash)]}
+eval_texts = {}
 for name, path in EVAL_FILES.items():
     if not path.exists():
         print(f"warning: {path} not found -> skip")
         continue
-    hashes = []
-    for i, text in enumerate(read_texts(path)):
-        hashes.append((i, make_minhash(text)))
+    eval_texts[name] = list(iter_texts(path))
+    sigs = batch_signatures(eval_texts[name])
+    hashes = [(i, to_minhash(sig)) for i, sig in enumerate(sigs)]
     eval_hashes[name] = hashes
     print(f"{name}: {len(hashes)} docs hashed")
 
@@ -76,40 +59,53 @@ for name, hashes in eval_hashes.items():
 total_eval = sum(len(v) for v in eval_hashes.values())
 print(f"-> inndex contains {total_eval} eval docs total")
 
-# -> stream train corpus
+# -> stream train corpus in batches of (train doc number, text), so every match knows its train doc
+# -> a plain file goes through its document index (doc number = line of the file); a .zst file can't
+# -> be read at an offset and is streamed instead (doc number = n-th text of the file)
+def train_batches():
+    if is_zst(TRAIN_FILE):
+        docs = enumerate(iter_texts(TRAIN_FILE, limit=MAX_TRAIN))
+        while batch := list(islice(docs, BATCH_DOCS)):
+            yield batch
+        return
+    train_index = DocIndex.open(TRAIN_FILE)
+    n_train = len(train_index) if MAX_TRAIN is None else min(MAX_TRAIN, len(train_index))
+    for a in range(0, n_train, BATCH_DOCS):
+        yield [(i, t) for i, t in enumerate(train_index.iter_range(a, min(a + BATCH_DOCS, n_train)), a)
+               if isinstance(t, str)]
+
 print(f"\n-> {TRAIN_FILE}")
 print(f"sim threshold: {THRESHOLD} -- n-gram size: {NGRAM_SIZE}")
 print(f"this may take a while....\n")
 
 # -> contamination counters per eval dataset
 hit_counts = {name: 0 for name in eval_hashes}
+matches = {name: [] for name in eval_hashes}   # -> (eval doc, train doc, train text) of every match
 total_train  = 0
 
-with open(TRAIN_FILE, "r", encoding="utf-8") as f:
-    for line in f:
-        if MAX_TRAIN and total_train >= MAX_TRAIN:
-            break
+done = False
+for batch in train_batches():
+    for (train_doc, train_text), sig in zip(batch, batch_signatures([t for _, t in batch])):
         total_train += 1
 
         if total_train % REPORT_EVERY == 0:
             print(f"processed {total_train:,} training docs...", flush=True)
-        try:
-            text = json.loads(line)["text"]
-        except (json.JSONDecodeError, KeyError):
-            continue
 
-        mh = make_minhash(text)
-        results = lsh.query(mh)
+        results = lsh.query(to_minhash(sig))
 
         for key in results:
             dataset = key_to_dataset[key]
             hit_counts[dataset] += 1
+            matches[dataset].append((int(key.rsplit("_", 1)[1]), train_doc, train_text[:200]))
             lsh.remove(key)
             del key_to_dataset[key]
 
         if not key_to_dataset:
             print("all eval docs accounted for — stopping early.")
+            done = True
             break
+    if done:
+        break
 
 # -> report
 print(f"training docs scanned: {total_train:,}")
@@ -126,6 +122,13 @@ for name, hashes in eval_hashes.items():
     if pct > 5:
         any_contamination = True
 
+for name, pairs in matches.items():
+    for eval_doc, train_doc, train_text in pairs[:SHOW_MATCHES]:
+        print(f"\n{name} doc {eval_doc} ~ train doc {train_doc}")
+        print(f"  eval:  {eval_texts[name][eval_doc][:200]!r}")
+        print(f"  train: {train_text!r}")
+print()
+
 if any_contamination:
     print("warning: some eval sets have significant overlap with training data")
 else:
@@ -1,8 +1,13 @@
 from tokenizers import Tokenizer, models, trainers, pre_tokenizers, decoders, processors
 from tokenizers.normalizers import Sequence, NFD
-import json
+import sys
+from pathlib import Path
 from tqdm import tqdm
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))     # -> repo root, for jsonl_io
+from jsonl_io import iter_text_batches, is_zst
+from doc_index import DocIndex, reservoir_texts
+
 # -> high-quality monolingual tokenizer for Romanian
 # -> 21GB of text ensures robust subword statistics
 # -> architecture:
@@ -13,26 +18,25 @@ from tqdm import tqdm
 special_tokens = ["<s>", "</s>", "<unk>", "<pad>", "<mask>", "<cls>", "<sep>"]
 DATA = "/Volumes/KINGSTON/WEB_BOOKS_LITERARY.jsonl"
 OUTPUT_TOKENIZER = "/Volumes/KINGSTON/ro_tokenizer.json"
+SAMPLE_DOCS = None      # -> train on this many random docs (read through the document index, .zst: one
+                        # -> streaming pass), None = all
+SAMPLE_SEED = 0
+
+def sample_batches(file_path, n_docs, batch_size=1000):
+    texts = (reservoir_texts(file_path, n_docs, SAMPLE_SEED) if is_zst(file_path)
+             else [t for t in DocIndex.open(file_path).sample(n_docs, SAMPLE_SEED) if isinstance(t, str)])
+    for a in range(0, len(texts), batch_size):
+        yield texts[a:a + batch_size]
 
 # -> for RAM efficiency, batch iterator with progress tracking
 def batch_iterator(file_path, batch_size=1000):
-    batch = []
     line_count = 0
+    batches = (iter_text_batches(file_path, batch_size) if SAMPLE_DOCS is None
+               else sample_batches(file_path, SAMPLE_DOCS, batch_size))
     
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in tqdm(f, desc="reading training data"):
-            try:
-                article = json.loads(line)
-                if 'text' in article and article['text']:
-                    batch.append(article['text'])
-                    line_count += 1
-                    if len(batch) == batch_size:
-                        yield batch
-                        batch = []
-            except json.JSONDecodeError:
-                continue
-    
-    if batch:
+    for batch in tqdm(batches, desc="reading training data", unit="batch"):
+        batch = [text for text in batch if text]
+        line_count += len(batch)
         yield batch
     
     print(f"total lines processed: {line_count}")
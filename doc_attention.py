@@ -0,0 +1,47 @@
+import numpy as np
+import torch
+
+# -> attention that stays inside documents for packed blocks (several documents back to back in one
+# -> block of CONTEXT_LENGTH, no padding)
+# -> every block carries position_ids that restart at 0 where a document starts; the 4D mask built
+# -> from them lets token q see token k only when k <= q and both belong to the same document
+# -> document starts come from a TokenStore's document offsets or from the <s> of every document in
+# -> an inline-packed block; both packers frame documents <s> ... </s>, so the two agree
+# -> (and q - k < sliding_window for Mistral, a custom 4D mask replaces the model's own window)
+# -> the mask is additive (0 = attend, dtype min = blocked), which eager and sdpa attention of the
+# -> Llama / Mistral / Falcon models take as it is; it costs block_size^2 floats per sequence
+# -> with attn_implementation="flash_attention_2" the position_ids alone are enough: the model
+# -> turns the restarts into variable-length sequences, drop the mask then
+# -> the first token of every document gets label -100: predicting it from the end of the previous
+# -> document is noise once that document isn't visible
+# -> check_doc_attention.py compares packed forward passes against one pass per document
+
+def block_position_ids(starts, block_size: int) -> np.ndarray:
+    # -> positions within the document for a block whose documents start at offsets `starts`;
+    # -> a block that begins mid-document counts its first fragment from 0
+    starts = np.union1d([0], np.asarray(starts, dtype=np.int64))
+    pos = np.arange(block_size)
+    return pos - starts[np.searchsorted(starts, pos, side="right") - 1]
+
+def marker_position_ids(ids, marker_id: int) -> np.ndarray:
+    # -> for blocks where every document begins with a marker token (<s>)
+    ids = np.asarray(ids)
+    return block_position_ids(np.flatnonzero(ids == marker_id), len(ids))
+
+def doc_attention_mask(position_ids: torch.Tensor, dtype: torch.dtype,
+                       sliding_window: int | None = None) -> torch.Tensor:
+    # -> (batch, block) position ids -> (batch, 1, block, block) additive causal mask per document,
+    # -> in the dtype the attention scores are computed in (sdpa wants the query's dtype)
+    n = position_ids.shape[-1]
+    doc = (position_ids == 0).cumsum(-1)
+    allowed = (doc[:, :, None] == doc[:, None, :]) & torch.ones(n, n, dtype=torch.bool).tril()
+    if sliding_window:
+        allowed &= ~torch.ones(n, n, dtype=torch.bool).tril(-sliding_window)
+    mask = torch.zeros(allowed.shape, dtype=dtype)
+    mask.masked_fill_(~allowed, torch.finfo(dtype).min)
+    return mask[:, None]
+
+def doc_labels(labels: torch.Tensor, position_ids: torch.Tensor) -> torch.Tensor:
+    labels = labels.clone()
+    labels[position_ids == 0] = -100
+    return labels
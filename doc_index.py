@@ -0,0 +1,233 @@
+import os, mmap, random, argparse
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Iterator
+import numpy as np
+
+from jsonl_io import BLOCK_BYTES, is_zst, loads, iter_texts
+
+# -> random access into a plain .jsonl: <file>.idx holds the byte offset where every document
+# -> (non-empty line) starts, so document i is one pread away instead of a scan from the top
+# -> layout, all little-endian uint64:
+# ->   magic "DOCIDX01" | file size | file mtime (ns) | n docs | n + 1 offsets (the last = file size)
+# -> the size + mtime in the header tie the index to one version of the file; a stale index is
+# -> never used, DocIndex.open() rebuilds it (the newline scan runs in parallel over byte ranges)
+# -> doc i is file[offsets[i]:offsets[i + 1]] minus the trailing newline(s), so ranges of documents
+# -> are contiguous and shard() can cut a file into n parts of ~equal bytes on document boundaries
+# -> .zst files can't be read at an offset without decompressing everything before it -> no index
+# -> data_stage/concat.py writes the index of its output in the same pass as the copy
+# -> sample_texts() is the "first k or k random documents" reader of the evaluation scripts; for
+# -> .zst it draws the random documents with reservoir_texts() in one streaming pass instead
+# -> scripts living in a subfolder put the repo root on sys.path to import it:
+# ->   sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+MAGIC = b"DOCIDX01"
+HEADER_BYTES = 32
+CHUNK_BYTES = 64 << 20          # -> byte range per worker when building
+
+def index_path(path) -> Path:
+    p = Path(path)
+    return p.with_name(p.name + ".idx")
+
+def line_starts(block: np.ndarray, base: int, first: bool = True) -> np.ndarray:
+    # -> offsets of the non-empty lines starting in a uint8 block that sits at `base` in the file;
+    # -> `first`: the block begins a line (it doesn't when a block boundary cuts a line)
+    nl = np.flatnonzero(block == 10)
+    starts = np.concatenate(([0], nl + 1)) if first else nl + 1
+    starts = starts[starts < len(block)]
+    return (starts[block[starts] != 10] + base).astype("<u8")
+
+def _header(data_path, n_docs: int) -> bytes:
+    st = os.stat(data_path)
+    return MAGIC + np.array([st.st_size, st.st_mtime_ns, n_docs], dtype="<u8").tobytes()
+
+class IndexWriter:
+    # -> streams the offsets of a file being written; close() after the data file is complete,
+    # -> the header takes its final size and mtime
+    def __init__(self, data_path):
+        self.data_path = Path(data_path)
+        self.fh = open(index_path(data_path), "wb")
+        self.fh.write(bytes(HEADER_BYTES))
+        self.docs = 0
+
+    def add(self, starts: np.ndarray) -> None:
+        self.fh.write(starts.astype("<u8").tobytes())
+        self.docs += len(starts)
+
+    def close(self) -> None:
+        size = os.path.getsize(self.data_path)
+        self.fh.write(np.array([size], dtype="<u8").tobytes())
+        self.fh.seek(0)
+        self.fh.write(_header(self.data_path, self.docs))
+        self.fh.close()
+
+def _scan_range(task) -> np.ndarray:
+    path, start, end = task
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = np.frombuffer(mm, dtype=np.uint8)
+        starts = line_starts(data[start:end], start, start == 0 or data[start - 1] == 10)
+        del data
+    return starts
+
+def build_offsets(path, workers: int = 1, chunk_bytes: int = CHUNK_BYTES) -> np.ndarray:
+    # -> start offsets of all documents, then the file size
+    size = os.path.getsize(path)
+    tasks = [(str(path), a, min(a + chunk_bytes, size)) for a in range(0, size, chunk_bytes)]
+    if workers > 1 and len(tasks) > 1:
+        with Pool(min(workers, len(tasks))) as pool:
+            parts = pool.map(_scan_range, tasks)
+    else:
+        parts = [_scan_range(t) for t in tasks]
+    return np.concatenate(parts + [np.array([size], dtype="<u8")])
+
+class DocIndex:
+    def __init__(self, path, offsets: np.ndarray):
+        self.path = Path(path)
+        self.offsets = offsets
+        self._fd = None
+
+    @classmethod
+    def load(cls, path) -> "DocIndex | None":
+        # -> the saved index if it matches the current file, None if missing or stale
+        ip = index_path(path)
+        if not ip.exists() or not Path(path).exists():
+            return None
+        with open(ip, "rb") as fh:
+            head = fh.read(HEADER_BYTES)
+        if len(head) < HEADER_BYTES or head[:8] != MAGIC:
+            return None
+        size, mtime, n = np.frombuffer(head, dtype="<u8", count=3, offset=8).tolist()
+        st = os.stat(path)
+        if (size, mtime) != (st.st_size, st.st_mtime_ns) or ip.stat().st_size != HEADER_BYTES + 8 * (n + 1):
+            return None
+        offsets = np.memmap(ip, dtype="<u8", mode="r", offset=HEADER_BYTES, shape=(n + 1,))
+        return cls(path, offsets)
+
+    @classmethod
+    def build(cls, path, workers: int = 1) -> "DocIndex":
+        if is_zst(path):
+            raise ValueError(f"{path}: compressed files can't be read at an offset, no document index")
+        offsets = build_offsets(path, workers)
+        ip = index_path(path)
+        tmp = ip.with_name(ip.name + ".tmp")
+        with open(tmp, "wb") as fh:
+            fh.write(_header(path, len(offsets) - 1))
+            fh.write(offsets.tobytes())
+        tmp.replace(ip)
+        return cls(path, offsets)
+
+    @classmethod
+    def open(cls, path, workers: int = 1) -> "DocIndex":
+        # -> the saved index, (re)built and saved first when missing or stale
+        return cls.load(path) or cls.build(path, workers)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getstate__(self) -> dict:
+        return {**self.__dict__, "_fd": None}
+
+    def __del__(self) -> None:
+        if getattr(self, "_fd", None) is not None:
+            os.close(self._fd)
+
+    def _read(self, start: int, end: int) -> bytes:
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDONLY)
+        return os.pread(self._fd, end - start, start)
+
+    def span(self, i: int) -> tuple[int, int]:
+        if not -len(self) <= i < len(self):
+            raise IndexError(f"document {i} out of range ({len(self)} documents)")
+        i %= len(self)
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def line(self, i: int) -> bytes:
+        return self._read(*self.span(i)).rstrip(b"\n")
+
+    def get(self, i: int, field: str | None = "text"):
+        # -> value of `field` in document i, the whole record with field=None
+        obj = loads(self.line(i))
+        return obj if field is None else obj.get(field)
+
+    def lines(self, a: int, b: int) -> Iterator[bytes]:
+        # -> raw lines of documents a..b-1, read in blocks of about BLOCK_BYTES
+        a, b, _ = slice(a, b).indices(len(self))
+        while a < b:
+            end = min(b, max(a + 1, int(np.searchsorted(self.offsets, self.offsets[a] + BLOCK_BYTES))))
+            data = self._read(int(self.offsets[a]), int(self.offsets[end]))
+            yield from (ln for ln in data.split(b"\n") if ln)
+            a = end
+
+    def iter_range(self, a: int, b: int, field: str | None = "text") -> Iterator:
+        # -> field values of documents a..b-1, None for a line that doesn't parse
+        for ln in self.lines(a, b):
+            yield _value(ln, field)
+
+    def slice(self, a: int, b: int, field: str | None = "text") -> list:
+        return list(self.iter_range(a, b, field))
+
+    def shard(self, k: int, n: int) -> tuple[int, int]:
+        # -> document range [a, b) of the k-th of n shards of ~equal bytes
+        if not 0 <= k < n:
+            raise IndexError(f"shard {k} of {n}")
+        total = int(self.offsets[-1] - self.offsets[0])
+        cuts = self.offsets[0] + np.array([total * k // n, total * (k + 1) // n], dtype="<u8")
+        a, b = np.searchsorted(self.offsets[:-1], cuts).tolist()
+        return a, b
+
+    def sample_ids(self, k: int, seed: int | None = None) -> np.ndarray:
+        # -> k distinct document numbers drawn uniformly, in file order
+        rng = np.random.default_rng(seed)
+        return np.sort(rng.choice(len(self), size=min(k, len(self)), replace=False))
+
+    def sample(self, k: int, seed: int | None = None, field: str | None = "text") -> list:
+        # -> like iter_range, None for a line that doesn't parse (get() raises instead)
+        return [_value(self.line(int(i)), field) for i in self.sample_ids(k, seed)]
+
+def _value(ln: bytes, field: str | None):
+    try:
+        obj = loads(ln)
+    except ValueError:
+        return None
+    return obj if field is None else (obj.get(field) if isinstance(obj, dict) else None)
+
+def reservoir_texts(path, k: int, seed: int | None = None, field: str = "text") -> list[str]:
+    # -> k string values of `field` drawn uniformly in one pass over the file (reservoir sampling),
+    # -> in file order; for the .zst files that have no offset index
+    rng = random.Random(seed)
+    picked = []
+    for n, text in enumerate(iter_texts(path, field)):
+        if n < k:
+            picked.append((n, text))
+        elif (j := rng.randrange(n + 1)) < k:
+            picked[j] = (n, text)
+    return [text for _, text in sorted(picked)]
+
+def sample_texts(path, k: int | None = None, seed: int | None = None, field: str = "text") -> Iterator[str]:
+    # -> string values of `field`: every document in file order when seed is None or k is 0 / None
+    # -> (the caller stops after the first k it keeps), else k random documents through the offset
+    # -> index, no scan (one streaming pass for .zst); either way lines that don't parse or don't
+    # -> hold a string are skipped
+    if seed is None or not k:
+        return iter_texts(path, field)
+    if is_zst(path):
+        return iter(reservoir_texts(path, k, seed, field))
+    return (t for t in DocIndex.open(path).sample(k, seed, field) if isinstance(t, str))
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="build the document offset index of .jsonl files")
+    ap.add_argument("paths", nargs="+", help="plain .jsonl files")
+    ap.add_argument("--workers", type=int, default=os.cpu_count(),
+                    help="processes scanning byte ranges in parallel (default: %(default)s)")
+    ap.add_argument("--force", action="store_true", help="rebuild even when the saved index is fresh")
+    ap.add_argument("--show", type=int, metavar="K", default=0, help="print K random documents")
+    args = ap.parse_args()
+    for p in args.paths:
+        idx = DocIndex.build(p, max(1, args.workers)) if args.force else DocIndex.open(p, max(1, args.workers))
+        print(f"{p}: {len(idx):,} docs  ->  {index_path(p)}")
+        for i in idx.sample_ids(args.show).tolist():
+            print(f"  [{i}] {str(idx.get(i))[:200]!r}")
+
+
+if __name__ == "__main__":
+    main()
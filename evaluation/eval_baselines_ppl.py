@@ -1,9 +1,12 @@
-import json
+import sys
 import math
 import torch
 from pathlib import Path
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))     # -> repo root, for doc_index
+from doc_index import sample_texts
+
 
 # -> in this code we want to compute pplx for some models that are publicly available
 # -> it's just a general comparison becuase the models differ so much in config
@@ -21,6 +24,7 @@ MODELS = [
 ]
 CONTEXT_LENGTH = 2048  
 MAX_ARTICLES = 2000
+SAMPLE_SEED = None    # -> None: the first MAX_ARTICLES docs, a seed: MAX_ARTICLES random docs of the whole file
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
 # -> iterate just like for normal pplx
@@ -30,31 +34,26 @@ def iter_blocks(jsonl_path, tokenizer, block_size, max_articles=MAX_ARTICLES):
     bos = tokenizer.bos_token_id or tokenizer.eos_token_id
     eos = tokenizer.eos_token_id
 
-    with open(jsonl_path, "r", encoding="utf-8") as f:
-        for line in f:
-            if max_articles and n >= max_articles:
-                break
-            try:
-                text = json.loads(line)["text"]
-            except (json.JSONDecodeError, KeyError):
-                continue
-            if not text.strip():
-                continue
-            ids = tokenizer.encode(text, add_special_tokens=False)
-            if bos is not None:
-                ids = [bos] + ids
-            if eos is not None:
-                ids = ids + [eos]
-            buffer += ids
-            n += 1
-
-            while len(buffer) >= block_size:
-                block  = buffer[:block_size]
-                buffer = buffer[block_size:]
-                input_ids = torch.tensor(block, dtype=torch.long)
-                labels    = input_ids.clone()
-                labels[0] = -100
-                yield input_ids, labels
+    for text in sample_texts(jsonl_path, max_articles, SAMPLE_SEED):
+        if max_articles and n >= max_articles:
+            break
+        if not text.strip():
+            continue
+        ids = tokenizer.encode(text, add_special_tokens=False)
+        if bos is not None:
+            ids = [bos] + ids
+        if eos is not None:
+            ids = ids + [eos]
+        buffer += ids
+        n += 1
+
+        while len(buffer) >= block_size:
+            block  = buffer[:block_size]
+            buffer = buffer[block_size:]
+            input_ids = torch.tensor(block, dtype=torch.long)
+            labels    = input_ids.clone()
+            labels[0] = -100
+            yield input_ids, labels
 
 # -> compute pplx
 @torch.no_grad()
@@ -1,9 +1,12 @@
-import json
+import sys
 import math
 import torch
 from pathlib import Path
 from transformers import AutoModelForCausalLM, PreTrainedTokenizerFast
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))     # -> repo root, for doc_index
+from doc_index import sample_texts
+
 BASE = Path("")
 MODELS_DIR = BASE / "models/models-good"
 TOK_FILE = str(BASE / "ro_tokenizer_40k.json")
@@ -25,6 +28,7 @@ DATASETS = {
 
 CONTEXT_LENGTH = 2048  
 MAX_ARTICLES = 2000
+SAMPLE_SEED = None    # -> None: the first MAX_ARTICLES docs, a seed: MAX_ARTICLES random docs of the whole file
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 DTYPE = torch.bfloat16 if DEVICE == "cuda" else torch.float32
 def load_tokenizer():
@@ -40,27 +44,22 @@ def iter_blocks(jsonl_path, tokenizer, block_size=CONTEXT_LENGTH,
     buffer = []
     n = 0
 
-    with open(jsonl_path, "r", encoding="utf-8") as f:
-        for line in f:
-            if max_articles and n >= max_articles:
-                break
-            try:
-                text = json.loads(line)["text"]
-            except (json.JSONDecodeError, KeyError):
-                continue
-            if not text.strip():
-                continue
-            ids = tokenizer.encode(text, add_special_tokens=False)
-            buffer += [bos] + ids + [eos]
-            n += 1
-
-            while len(buffer) >= block_size:
-                block  = buffer[:block_size]
-                buffer = buffer[block_size:]
-                input_ids = torch.tensor(block, dtype=torch.long)
-                labels    = input_ids.clone()
-                labels[0] = -100
-                yield input_ids, labels
+    for text in sample_texts(jsonl_path, max_articles, SAMPLE_SEED):
+        if max_articles and n >= max_articles:
+            break
+        if not text.strip():
+            continue
+        ids = tokenizer.encode(text, add_special_tokens=False)
+        buffer += [bos] + ids + [eos]
+        n += 1
+
+        while len(buffer) >= block_size:
+            block  = buffer[:block_size]
+            buffer = buffer[block_size:]
+            input_ids = torch.tensor(block, dtype=torch.long)
+            labels    = input_ids.clone()
+            labels[0] = -100
+            yield input_ids, labels
 
 
 # -> actual pplx
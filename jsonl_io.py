@@ -0,0 +1,317 @@
+import io, json, mmap, os
+from collections import deque
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# -> one place for corpus file I/O shared by cleaning_stages/, data_stage/ and evaluation/
+# -> every path can be plain (.jsonl, .txt) or zstd compressed (.jsonl.zst, .txt.zst), the suffix decides
+# -> romanian text compresses ~4x, which is 4x less to push through the usb drive on every hop
+# -> compression runs multi-threaded in zstd, reads and writes go through large buffers
+# -> jsonl files are read in newline-aligned blocks (mmap for plain files) and decoded with orjson or
+# -> msgspec when installed, the stdlib json otherwise; iter_docs / iter_texts / iter_text_batches
+# -> replace the `for line in f: json.loads(line)["text"]` loop every script used to carry
+# -> JsonlWriter writes records through the large output buffer and fsyncs every `sync_every`
+# -> records (0 -> only on sync() / close), instead of scripts calling os.fsync themselves
+# -> bounded_imap feeds the blocks / batches of a file to a process pool without reading ahead of it
+# -> scripts living in a subfolder put the repo root on sys.path to import it:
+# ->   sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+ZSTD_LEVEL = 3                  # -> ~4x on romanian text at several hundred MB/s
+ZSTD_THREADS = -1               # -> one compression thread per core
+BUFFER_BYTES = 8 << 20          # -> raw read / write buffer
+BLOCK_BYTES = 8 << 20           # -> newline-aligned block handed to the line splitter
+
+def is_zst(path) -> bool:
+    return str(path).endswith(".zst")
+
+def base_suffix(path) -> str:
+    # -> "data.jsonl.zst" -> ".jsonl", "data.jsonl" -> ".jsonl"
+    p = Path(path)
+    return Path(p.stem).suffix if is_zst(p) else p.suffix
+
+def is_jsonl(path) -> bool:
+    return base_suffix(path) == ".jsonl"
+
+def _need_zstd(path) -> None:
+    if zstd is None:
+        raise ImportError(f"{path}: reading / writing .zst files needs the zstandard package (pip install zstandard)")
+
+def open_read(path, offset: int = 0) -> io.BufferedIOBase:
+    # -> binary stream of the (decompressed) file content, starting at byte `offset` of that content
+    # -> (a .zst stream can only get there by decompressing and discarding everything before it)
+    if not is_zst(path):
+        fh = open(path, "rb", buffering=BUFFER_BYTES)
+        fh.seek(offset)
+        return fh
+    _need_zstd(path)
+    raw = open(path, "rb", buffering=BUFFER_BYTES)
+    reader = zstd.ZstdDecompressor().stream_reader(raw, read_size=1 << 20, closefd=True)
+    if offset:
+        reader.seek(offset)
+    return io.BufferedReader(reader, buffer_size=BUFFER_BYTES)
+
+class Sink(io.BufferedIOBase):
+    # -> binary output file, zstd compressed when the path ends in .zst
+    # -> sync() makes everything written so far durable and returns the byte offset of the file at
+    # -> that point; for .zst it also closes the current zstd frame, so a resumed run can truncate
+    # -> the file back to that offset and append new frames (a .zst file may hold many frames)
+    def __init__(self, path, offset: int | None = None):
+        self.path = Path(path)
+        if offset is None:
+            self.raw = open(self.path, "wb", buffering=BUFFER_BYTES)
+        else:
+            self.raw = open(self.path, "r+b", buffering=BUFFER_BYTES)
+            self.raw.truncate(offset)
+            self.raw.seek(offset)
+        self._z = None
+        if is_zst(self.path):
+            _need_zstd(self.path)
+            cctx = zstd.ZstdCompressor(level=ZSTD_LEVEL, threads=ZSTD_THREADS)
+            self._z = cctx.stream_writer(self.raw, closefd=False)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        return (self._z if self._z is not None else self.raw).write(data)
+
+    def flush(self) -> None:
+        # -> hands buffered bytes to the OS (a zstd frame stays open until sync / close)
+        if not self.raw.closed:
+            self.raw.flush()
+
+    def sync(self) -> int:
+        if self._z is not None:
+            self._z.flush(zstd.FLUSH_FRAME)
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        return self.raw.tell()
+
+    def close(self) -> None:
+        if self.raw.closed:
+            return
+        if self._z is not None:
+            self._z.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.raw.close()
+        super().close()
+
+def open_write(path, offset: int | None = None) -> Sink:
+    return Sink(path, offset)
+
+def open_text(path, mode: str = "r", errors: str = "strict"):
+    # -> text-mode counterpart for the simple `with open(...) as f: for line in f` scripts
+    if mode.startswith("r"):
+        return io.TextIOWrapper(open_read(path), encoding="utf-8", errors=errors)
+    if mode.startswith("w"):
+        return io.TextIOWrapper(open_write(path), encoding="utf-8", errors=errors, write_through=False)
+    raise ValueError(f"unsupported mode {mode!r}")
+
+# -> decoding / encoding
+
+if orjson is not None:
+    _fast_loads, _fast_error = orjson.loads, orjson.JSONDecodeError
+elif msgspec is not None:
+    _fast_loads, _fast_error = msgspec.json.decode, msgspec.DecodeError
+else:
+    _fast_loads = _fast_error = None
+
+def loads(line: bytes | str):
+    # -> raises ValueError (JSONDecodeError / UnicodeDecodeError) for a broken line
+    if _fast_loads is not None:
+        try:
+            return _fast_loads(line)
+        except _fast_error:
+            pass    # -> the stdlib still takes what the fast parsers refuse (lone surrogates, NaN)
+    return json.loads(line)
+
+def dumps(obj) -> bytes:
+    # -> compact json for records other than {"text": ...}
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+def dumps_text(text: str, field: str = "text") -> bytes:
+    # -> byte for byte json.dumps({field: text}, ensure_ascii=False), the layout of every corpus file
+    # -> so far; orjson escapes strings exactly like the stdlib with ensure_ascii=False
+    if orjson is not None and type(text) is str:
+        try:
+            return b"{" + orjson.dumps(field) + b": " + orjson.dumps(text) + b"}"
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps({field: text}, ensure_ascii=False).encode()
+
+# -> reading
+# -> errors="ignore" / "replace" treats invalid utf-8 in a line like open(..., errors=...) does (the
+# -> bytes are dropped / replaced and the line is kept), "strict" skips such a line
+
+def parse_line(ln: bytes, errors: str = "strict"):
+    try:
+        return loads(ln)
+    except ValueError:
+        if errors == "strict":
+            raise
+        return loads(ln.decode("utf-8", errors))
+
+def read_range(path, start: int, end: int) -> bytes:
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        return fh.read(end - start)
+
+def iter_blocks(path, offset: int = 0, block_bytes: int = BLOCK_BYTES) -> Iterator[tuple[int, bytes]]:
+    # -> (offset right after the block, block) where a block is whole lines of the (decompressed)
+    # -> content starting at `offset`; plain files are memory-mapped, .zst goes through open_read
+    if is_zst(path):
+        with open_read(path, offset) as fh:
+            pos = offset
+            while data := fh.read(block_bytes):
+                data += fh.readline()
+                pos += len(data)
+                yield pos, data
+        return
+    with open(path, "rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if offset >= size:
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            pos = offset
+            while pos < size:
+                end = min(pos + block_bytes, size)
+                if end < size:
+                    nl = mm.find(b"\n", end - 1)
+                    end = size if nl < 0 else nl + 1
+                yield end, mm[pos:end]
+                pos = end
+
+def block_lines(block: bytes, start: int = 0) -> Iterator[tuple[int, bytes]]:
+    # -> (offset right after the line, line without its newline) for a block that begins at `start`
+    pos, end = start, start + len(block)
+    for ln in block.split(b"\n"):
+        pos = min(pos + len(ln) + 1, end)
+        if ln:
+            yield pos, ln
+
+def iter_lines(path, offset: int = 0) -> Iterator[tuple[int, bytes]]:
+    for end, block in iter_blocks(path, offset):
+        yield from block_lines(block, end - len(block))
+
+def block_docs(block: bytes, field: str = "text", errors: str = "strict") -> list:
+    # -> the `field` values of all lines of a block that hold a json object with that field
+    docs = []
+    for ln in block.split(b"\n"):
+        if not ln:
+            continue
+        try:
+            obj = parse_line(ln, errors)
+        except ValueError:
+            continue
+        if isinstance(obj, dict) and field in obj:
+            docs.append(obj[field])
+    return docs
+
+def line_docs(lines, field: str = "text") -> Iterator[tuple[int, object]]:
+    # -> (offset, line) pairs -> (offset, value of `field`), lines that don't parse or lack it are skipped
+    for pos, ln in lines:
+        try:
+            obj = loads(ln)
+        except ValueError:
+            continue
+        if isinstance(obj, dict) and field in obj:
+            yield pos, obj[field]
+
+def iter_docs(path, offset: int = 0, field: str = "text") -> Iterator[tuple[int, object]]:
+    # -> (offset right after the line, value of `field`)
+    return line_docs(iter_lines(path, offset), field)
+
+def iter_texts(path, field: str = "text", limit: int | None = None,
+               errors: str = "strict") -> Iterator[str]:
+    # -> string values of `field`, at most `limit` of them
+    n = 0
+    for _, block in iter_blocks(path):
+        for text in block_docs(block, field, errors):
+            if not isinstance(text, str):
+                continue
+            if limit and n >= limit:
+                return
+            n += 1
+            yield text
+
+def iter_text_batches(path, batch_size: int = 1000, field: str = "text",
+                      limit: int | None = None, errors: str = "strict") -> Iterator[list[str]]:
+    batch = []
+    for text in iter_texts(path, field, limit, errors):
+        batch.append(text)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# -> worker pools
+
+def bounded_imap(pool, func, tasks, window: int):
+    # -> ordered like pool.imap, but only `window` tasks in flight (imap reads the whole input into its
+    # -> queue when the workers are slower than the reader, e.g. a whole decompressed .zst file)
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+# -> writing
+
+class JsonlWriter:
+    # -> one json record per line into a Sink; sync_every N records makes the output durable every
+    # -> N records, 0 leaves that to sync() / close()
+    def __init__(self, path, sync_every: int = 0, offset: int | None = None):
+        self.sink = open_write(path, offset)
+        self.sync_every = sync_every
+        self.records = 0
+
+    def write_bytes(self, line: bytes) -> None:
+        # -> one already encoded record, without the newline
+        self.sink.write(line)
+        self.sink.write(b"\n")
+        self.records += 1
+        if self.sync_every and self.records % self.sync_every == 0:
+            self.sink.sync()
+
+    def write(self, obj) -> None:
+        self.write_bytes(dumps(obj))
+
+    def write_text(self, text: str, field: str = "text") -> None:
+        self.write_bytes(dumps_text(text, field))
+
+    def sync(self) -> int:
+        return self.sink.sync()
+
+    def close(self) -> None:
+        self.sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
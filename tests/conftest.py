@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+# -> the cleaning stages import each other as bare modules, jsonl_io & co live at the repo root,
+# -> minhash next to the data_stage scripts that use it
+sys.path[:0] = [str(ROOT / "cleaning_stages"), str(ROOT / "data_stage"), str(ROOT)]
@@ -0,0 +1,28 @@
+import random
+from pathlib import Path
+
+from clean_text import clean, clean_steps
+from jsonl_io import iter_texts
+
+# -> golden-output check for the fused stage-1 clean(): it must give byte-identical text to
+# -> clean_steps() (one pass per filter, the reference); bench_clean.py runs the same comparison
+# -> on a real corpus sample and times the two
+SAMPLE = Path(__file__).parent / "data" / "clean_sample.jsonl"
+
+# -> pieces that trigger every filter of the chain, glued at random by the fuzz test
+PIECES = ["Acesta este un text obișnuit", ".", "!", "?", " ", "  ", "\n", "\n\n", "\r\n", "\t", " ",
+          "ş", "Ţ", "<b>", "</i>", "&nbsp;", "&lt;poem&gt;", "www.a.ro", "http://x.ro/y", "a@b.ro",
+          "function f(", "{", ";", "@media", "|", "[[link]]", "---", "sex", "porno", "chat", "Titlu Mare",
+          "pret", "lei", "12,50 lei", "oferte", "1.234", "45%", "──", "•", "ABCDE", "😀", "©", "x"]
+
+def test_clean_matches_clean_steps_on_sample():
+    docs = list(iter_texts(SAMPLE))
+    assert len(docs) > 100
+    bad = [i for i, d in enumerate(docs) if clean(d) != clean_steps(d)]
+    assert not bad, f"clean() differs from clean_steps() on sample docs {bad[:10]}"
+
+def test_clean_matches_clean_steps_on_random_text():
+    rng = random.Random(0)
+    for _ in range(3000):
+        text = "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 60)))
+        assert clean(text) == clean_steps(text), repr(text)
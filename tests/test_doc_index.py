@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from doc_index import DocIndex, build_offsets, index_path, reservoir_texts, sample_texts
+from jsonl_io import JsonlWriter, iter_texts, loads
+
+# -> the offset index against a plain scan of the same file: document i is the i-th non-empty line
+LINES = [json.dumps({"text": f"doc {i} " + "ă" * (i % 7)}, ensure_ascii=False) for i in range(200)]
+LINES[17] = "not json"
+LINES[42] = "[1, 2]"
+LINES[99] = json.dumps({"title": "no text"})
+
+@pytest.fixture
+def corpus(tmp_path):
+    path = tmp_path / "corpus.jsonl"
+    # -> blank lines between documents are not documents
+    path.write_text("\n".join(ln + ("\n" if i % 13 == 0 else "") for i, ln in enumerate(LINES)) + "\n",
+                    encoding="utf-8")
+    return path
+
+def scan(path):
+    return [ln for ln in path.read_text(encoding="utf-8").split("\n") if ln]
+
+def value(ln):
+    try:
+        obj = loads(ln)
+    except ValueError:
+        return None
+    return obj.get("text") if isinstance(obj, dict) else None
+
+def test_index_matches_line_scan(corpus):
+    lines = scan(corpus)
+    idx = DocIndex.build(corpus, workers=1)
+    assert len(idx) == len(lines) == len(LINES)
+    assert [idx.line(i).decode() for i in range(len(idx))] == lines
+    assert idx.get(5) == value(lines[5]) and idx.get(-1) == value(lines[-1])
+    assert idx.slice(10, 60) == [value(ln) for ln in lines[10:60]]
+    with pytest.raises(IndexError):
+        idx.span(len(lines))
+
+def test_index_saved_and_reloaded(corpus):
+    built = DocIndex.build(corpus)
+    loaded = DocIndex.load(corpus)
+    assert loaded is not None and list(loaded.offsets) == list(built.offsets)
+    with corpus.open("a", encoding="utf-8") as fh:
+        fh.write(json.dumps({"text": "appended"}) + "\n")
+    assert DocIndex.load(corpus) is None                # -> stale after the file changed
+    assert DocIndex.open(corpus).get(-1) == "appended"
+    assert index_path(corpus).exists()
+
+def test_parallel_build_matches(corpus):
+    # -> tiny byte ranges, so range boundaries cut lines and land on blank lines
+    assert list(build_offsets(corpus, workers=3, chunk_bytes=97)) == list(build_offsets(corpus))
+
+def test_shards_cover_every_document_once(corpus):
+    idx = DocIndex.build(corpus)
+    for n in (1, 3, 7):
+        ranges = [idx.shard(k, n) for k in range(n)]
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(idx)
+        assert all(b == c for (_, b), (c, _) in zip(ranges, ranges[1:]))
+        assert [v for a, b in ranges for v in idx.slice(a, b)] == idx.slice(0, len(idx))
+
+def test_sample_ids_and_sample(corpus):
+    lines = scan(corpus)
+    idx = DocIndex.build(corpus)
+    ids = idx.sample_ids(50, seed=3).tolist()
+    assert ids == sorted(set(ids)) and len(ids) == 50 and 0 <= ids[0] and ids[-1] < len(idx)
+    assert ids == idx.sample_ids(50, seed=3).tolist()
+    assert idx.sample(50, seed=3) == [value(lines[i]) for i in ids]
+    assert len(idx.sample_ids(10_000)) == len(idx)
+
+def test_sample_texts_plain_and_zst(corpus, tmp_path):
+    pytest.importorskip("zstandard")
+    texts = list(iter_texts(corpus))
+    zst = tmp_path / "corpus.jsonl.zst"
+    with JsonlWriter(zst) as w:
+        for t in texts:
+            w.write_text(t)
+    assert list(sample_texts(zst)) == texts
+    # -> the index draws 40 documents and drops the ones without text, the reservoir draws 40 texts
+    for path, n in ((corpus, 40 - sum(value(ln) is None for ln in LINES)), (zst, 40)):
+        picked = list(sample_texts(path, 40, seed=1))
+        assert n <= len(picked) <= 40 and set(picked) <= set(texts)
+        assert picked == sorted(picked, key=texts.index)        # -> file order
+    assert len(list(sample_texts(zst, 40, seed=1))) == 40
+    assert reservoir_texts(zst, 40, 1) == reservoir_texts(zst, 40, 1)
+    assert reservoir_texts(zst, 10_000) == texts
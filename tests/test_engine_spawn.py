@@ -0,0 +1,47 @@
+import csv, json, pickle, subprocess, sys
+from pathlib import Path
+import pytest
+
+import second_stage_clean, third_stage_clean, four_stage_clean
+from conftest import ROOT
+
+# -> under spawn (the macOS default) a worker gets the stages as a pickled copy: the drop it runs
+# -> must be the copy's own RuleSet, or --rule-warmup and --profile never reach the rules evaluated
+STAGES = [second_stage_clean.STAGE, third_stage_clean.STAGE, four_stage_clean.STAGE]
+
+@pytest.mark.parametrize("stage", STAGES, ids=lambda st: st.name)
+def test_pickled_stage_drops_with_its_own_rules(stage):
+    warmup = stage.rules.warmup
+    try:
+        stage.rules.set_warmup(7)
+        copy = pickle.loads(pickle.dumps(stage))
+    finally:
+        stage.rules.set_warmup(warmup)
+    assert copy.drop.__self__ is copy.rules
+    assert copy.rules.warmup == 7
+
+RUN = """
+import sys, multiprocessing as mp
+from pathlib import Path
+sys.path[:0] = [{cleaning!r}, {root!r}]
+
+if __name__ == "__main__":
+    mp.set_start_method("spawn", force=True)
+    import second_stage_clean
+    from engine import clean_corpus
+    clean_corpus([Path(sys.argv[1])], Path(sys.argv[2]), [second_stage_clean.STAGE],
+                 workers=2, profile=Path(sys.argv[3]), rule_warmup=5, checkpoint_secs=0)
+"""
+
+def test_profile_counts_come_back_from_spawned_workers(tmp_path):
+    docs = [f"documentul {i} " + "un text obisnuit despre vreme si oameni. " * (i % 7) for i in range(200)]
+    src = tmp_path / "in.jsonl"
+    src.write_text("".join(json.dumps({"text": d}, ensure_ascii=False) + "\n" for d in docs), encoding="utf-8")
+    script = tmp_path / "run.py"
+    script.write_text(RUN.format(cleaning=str(ROOT / "cleaning_stages"), root=str(ROOT)))
+    subprocess.run([sys.executable, str(script), str(src), str(tmp_path / "out.jsonl"), str(tmp_path / "prof.csv")],
+                   check=True, capture_output=True)
+    with (tmp_path / "prof.csv").open(newline="") as fh:
+        rows = list(csv.DictReader(fh))
+    # -> with profiling every rule is evaluated on every doc that reaches the stage
+    assert rows and all(int(r["evaluated"]) == len(docs) for r in rows)
@@ -0,0 +1,95 @@
+import random
+
+import numpy as np
+import pytest
+
+pytest.importorskip("datasketch")
+from datasketch import MinHashLSH
+from minhash import (NGRAM_SIZE, NUM_PERM, normalize, make_minhash, batch_signatures, to_minhash,
+                     lsh_params, band_keys)
+
+# -> batch_signatures() hashes shingles with FNV instead of sha1, so its signatures differ from
+# -> make_minhash(); what has to hold is that they estimate the same Jaccard similarity, since the
+# -> 0.85 thresholds of near_dedup and test_contamination are chosen on that scale
+# -> with 128 permutations the estimate has a standard deviation of at most ~0.045
+TOLERANCE = 0.15
+LETTERS = "abcdefghijklmnopqrstuvwxyzăâîșț"
+
+def shingles(text: str) -> set[str]:
+    t = normalize(text)
+    return {t[i:i + NGRAM_SIZE] for i in range(len(t) - NGRAM_SIZE + 1)}
+
+def exact_jaccard(a: str, b: str) -> float:
+    sa, sb = shingles(a), shingles(b)
+    return len(sa & sb) / len(sa | sb)
+
+def estimate(sa: np.ndarray, sb: np.ndarray) -> float:
+    return float(np.mean(sa == sb))
+
+def word(rng: random.Random) -> str:
+    return "".join(rng.choice(LETTERS) for _ in range(rng.randint(2, 9)))
+
+def text(rng: random.Random, n: int) -> str:
+    return " ".join(word(rng) for _ in range(n))
+
+def edited(rng: random.Random, base: str, changes: int) -> str:
+    words = base.split()
+    for _ in range(changes):
+        words[rng.randrange(len(words))] = word(rng)
+    return " ".join(words)
+
+def pairs():
+    rng = random.Random(0)
+    out = []
+    for n in (60, 200, 800):
+        base = text(rng, n)
+        out.append((base, base.upper() + "  \n"))                     # -> same after normalize
+        for frac in (0.01, 0.03, 0.08, 0.2):
+            out.append((base, edited(rng, base, max(1, int(n * frac)))))
+        out.append((base, text(rng, n)))                                # -> unrelated
+    return out
+
+def test_batch_estimate_matches_exact_and_reference():
+    ps = pairs()
+    sigs = batch_signatures([t for p in ps for t in p])
+    for k, (a, b) in enumerate(ps):
+        exact = exact_jaccard(a, b)
+        batch = estimate(sigs[2 * k], sigs[2 * k + 1])
+        ref = make_minhash(a).jaccard(make_minhash(b))
+        assert abs(batch - exact) <= TOLERANCE, (k, batch, exact)
+        assert abs(batch - ref) <= TOLERANCE, (k, batch, ref)
+        assert to_minhash(sigs[2 * k]).jaccard(to_minhash(sigs[2 * k + 1])) == pytest.approx(batch)
+
+def test_identical_and_short_docs():
+    sigs = batch_signatures(["Ana are mere", "ana   ARE mere", "abc", ""])
+    assert np.array_equal(sigs[0], sigs[1])
+    assert (sigs[2:] == 0xFFFFFFFF).all()       # -> shorter than one shingle: the empty MinHash
+    assert np.array_equal(sigs[2], make_minhash("abc").hashvalues.astype(np.uint32))
+
+def test_block_grouping_does_not_change_signatures():
+    # -> docs hashed together in one block, alone, or split over several blocks give the same rows
+    rng = random.Random(1)
+    texts = [text(rng, n) for n in (5, 40, 3000, 2, 900, 4000)]
+    together = batch_signatures(texts)
+    for i, t in enumerate(texts):
+        assert np.array_equal(batch_signatures([t])[0], together[i])
+
+def test_lsh_finds_near_duplicates_only():
+    threshold = 0.85
+    ps = pairs()
+    lsh = MinHashLSH(threshold=threshold, num_perm=NUM_PERM)
+    sigs = batch_signatures([a for a, _ in ps] + [b for _, b in ps])
+    n = len(ps)
+    for k in range(n):
+        lsh.insert(k, to_minhash(sigs[k]), check_duplication=False)
+    bands, rows = lsh_params(threshold)
+    keys = band_keys(sigs, bands, rows)
+    for k, (a, b) in enumerate(ps):
+        exact = exact_jaccard(a, b)
+        found = k in lsh.query(to_minhash(sigs[n + k]))
+        shared = bool((keys[k] == keys[n + k]).any())
+        assert found == shared                  # -> band_keys buckets agree with MinHashLSH
+        if exact >= 0.95:
+            assert found, (k, exact)
+        elif exact <= 0.5:
+            assert not found, (k, exact)
@@ -0,0 +1,154 @@
+import json, hashlib
+from array import array
+from pathlib import Path
+import numpy as np
+
+# -> packed token corpus as one flat binary file, read back through a memmap
+# ->   <name>.bin        -> every token id of every document, back to back, each document framed as
+# ->                        bos ids eos (<s> ... </s>, the same framing as the trainer's inline packing),
+# ->                        uint16 when the vocab fits (40k does), uint32 otherwise, little-endian
+# ->   <name>.meta.json  -> dtype, vocab size, block size, sha256 of the tokenizer file, bos / eos ids, counts
+# ->   <name>.docs.npy   -> token offset where every document starts, then the total token count
+# -> block i is tokens[i * block_size:(i + 1) * block_size], the same blocks the packer used to write as
+# -> json lists of ints (documents run on across block edges), but 2 bytes per token instead of ~6
+# -> and nothing to parse: TokenStore maps the file and hands out numpy views, no copies
+# -> the tokens after the last full block are kept in the .bin but are not a block
+# -> the .meta.json is written last and only by a clean close(): TokenWriter removes the old one
+# -> before truncating the .bin, and a `with` block left by an exception writes no meta / docs, so a
+# -> half-written store can't be opened as a complete one
+# -> scripts living in a subfolder put the repo root on sys.path to import it:
+# ->   sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+FORMAT = 1
+
+def file_sha256(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while chunk := fh.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _paths(path) -> tuple[Path, Path, Path]:
+    p = Path(path)
+    stem = p.with_suffix("") if p.suffix == ".bin" else p
+    return stem.with_suffix(".bin"), Path(f"{stem}.meta.json"), Path(f"{stem}.docs.npy")
+
+def token_dtype(vocab_size: int) -> np.dtype:
+    return np.dtype("<u2") if vocab_size <= 1 << 16 else np.dtype("<u4")
+
+class TokenWriter:
+    def __init__(self, path, vocab_size: int, block_size: int, tokenizer_hash: str = "",
+                 eos_id: int | None = None, bos_id: int | None = None):
+        self.bin_path, self.meta_path, self.docs_path = _paths(path)
+        self.bin_path.parent.mkdir(parents=True, exist_ok=True)
+        self.meta_path.unlink(missing_ok=True)      # -> the .bin is about to be rewritten
+        self.dtype = token_dtype(vocab_size)
+        self.meta = {"format": FORMAT, "dtype": self.dtype.str, "vocab_size": vocab_size,
+                     "block_size": block_size, "tokenizer_sha256": tokenizer_hash, "bos_id": bos_id, "eos_id": eos_id}
+        self.fh = open(self.bin_path, "wb", buffering=8 << 20)
+        self.doc_starts = array("Q")
+        self.tokens = 0
+
+    def add_doc(self, ids) -> None:
+        ids = np.asarray(ids, dtype=self.dtype)
+        self.doc_starts.append(self.tokens)
+        self.fh.write(ids.tobytes())
+        self.tokens += len(ids)
+
+    def add_docs(self, flat: np.ndarray, lengths: np.ndarray) -> None:
+        # -> many documents at once: their ids back to back in `flat`, `lengths` tokens each
+        starts = self.tokens + np.cumsum(lengths, dtype=np.uint64) - np.asarray(lengths, dtype=np.uint64)
+        self.doc_starts.frombytes(starts.astype(np.uint64).tobytes())
+        self.fh.write(np.ascontiguousarray(flat, dtype=self.dtype).tobytes())
+        self.tokens += len(flat)
+
+    def close(self) -> None:
+        self.fh.close()
+        docs = np.frombuffer(self.doc_starts, dtype=np.uint64) if self.doc_starts else np.empty(0, np.uint64)
+        np.save(self.docs_path, np.append(docs, np.uint64(self.tokens)))
+        meta = {**self.meta, "tokens": self.tokens, "docs": len(self.doc_starts),
+                "blocks": self.tokens // self.meta["block_size"]}
+        tmp = self.meta_path.with_name(self.meta_path.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as fh:
+            json.dump(meta, fh, indent=2)
+        tmp.replace(self.meta_path)
+
+    def __enter__(self):
+        return self
+
+    def abort(self) -> None:
+        # -> drop a store that won't be finished, no meta / docs written
+        self.fh.close()
+        self.bin_path.unlink(missing_ok=True)
+        self.docs_path.unlink(missing_ok=True)
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+class TokenStore:
+    def __init__(self, path):
+        self.bin_path, self.meta_path, self.docs_path = _paths(path)
+        with self.meta_path.open(encoding="utf-8") as fh:
+            self.meta = json.load(fh)
+        if self.meta.get("format") != FORMAT:
+            raise ValueError(f"{self.meta_path}: unknown token store format {self.meta.get('format')}")
+        self.block_size = self.meta["block_size"]
+        self.vocab_size = self.meta["vocab_size"]
+        n = self.meta["tokens"]
+        dtype = np.dtype(self.meta["dtype"])
+        if self.bin_path.stat().st_size < n * dtype.itemsize:
+            raise ValueError(f"{self.bin_path} is shorter than its metadata says ({n:,} tokens)")
+        self.tokens = (np.memmap(self.bin_path, dtype=dtype, mode="r", shape=(n,)) if n
+                       else np.empty(0, dtype=dtype))
+        self.doc_offsets = np.load(self.docs_path, mmap_mode="r")
+
+    def __getstate__(self) -> dict:
+        # -> pickled as its path (a memmap would pickle its whole contents), mapped again on load
+        return {"path": str(self.bin_path)}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["path"])
+
+    def __len__(self) -> int:
+        return len(self.tokens) // self.block_size
+
+    def block(self, i: int) -> np.ndarray:
+        if not 0 <= i < len(self):
+            raise IndexError(f"block {i} out of range ({len(self)} blocks)")
+        return self.tokens[i * self.block_size:(i + 1) * self.block_size]
+
+    __getitem__ = block
+
+    def blocks(self, a: int = 0, b: int | None = None) -> np.ndarray:
+        # -> (b - a, block_size) view of blocks a..b-1
+        b = len(self) if b is None else min(b, len(self))
+        return self.tokens[a * self.block_size:b * self.block_size].reshape(-1, self.block_size)
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_offsets) - 1
+
+    def doc(self, i: int) -> np.ndarray:
+        return self.tokens[int(self.doc_offsets[i]):int(self.doc_offsets[i + 1])]
+
+    def block_doc_starts(self, i: int) -> np.ndarray:
+        # -> offsets within block i where a document starts
+        a = i * self.block_size
+        lo, hi = np.searchsorted(self.doc_offsets, [a, a + self.block_size])
+        return (self.doc_offsets[lo:hi] - np.uint64(a)).astype(np.int64)
+
+    def check_tokenizer(self, tokenizer_path) -> None:
+        # -> refuse to train on ids produced by another tokenizer
+        expected = self.meta.get("tokenizer_sha256")
+        if expected and file_sha256(tokenizer_path) != expected:
+            raise ValueError(f"{self.bin_path} was packed with a different tokenizer than {tokenizer_path}")
+
+    def check_framing(self, bos_id: int | None, eos_id: int | None) -> None:
+        # -> refuse a store whose documents aren't framed with these bos / eos ids (stores packed
+        # -> before bos was written have no bos_id and are refused too: repack them)
+        found = (self.meta.get("bos_id"), self.meta.get("eos_id"))
+        if found != (bos_id, eos_id):
+            raise ValueError(f"{self.bin_path} frames documents with bos / eos {found}, expected {(bos_id, eos_id)}; "
+                             f"repack it with data_stage/pack_corpus_tokens.py")
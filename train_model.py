@@ -6,11 +6,17 @@ from transformers import (
     PreTrainedTokenizerFast, Trainer, TrainingArguments,
     DataCollatorForLanguageModeling
 )
-from datasets import load_dataset
+from datasets import load_dataset, Dataset as HFDataset
+import pyarrow.compute as pc
 import copy
-from torch.utils.data import default_collate
+from pathlib import Path
+from torch.utils.data import Dataset, default_collate
+import numpy as np
 import torch
 
+from token_store import TokenStore
+from doc_attention import block_position_ids, marker_position_ids, doc_attention_mask, doc_labels
+
 # -> we will train some model architectures: Llama, Mistral, Falcon, Mamba and a Llama-MHA baseline
 # -> the idea is to have models of similar size and context window but different intelligence methods
 # -> this way we can find out, for small language models, which architecture is best at understanding language
@@ -143,11 +149,18 @@ if spread_pct > 15:
 else:
     print("models are within 15% of each other —> fair comparison.")
 
-# -> data loading — raw text jsonl, we tokenize and pack inline during dataset preparation
+# -> data loading — preferably the packed token store written by data_stage/pack_corpus_tokens.py:
+# -> blocks are read straight from the uint16 memmap, so training starts in seconds and every
+# -> architecture run below reads the same file (through the OS page cache)
+# -> without a store: raw text jsonl, we tokenize and pack inline during dataset preparation
 # -> this mirrors the old successful training approach (FULL_CORPUS_BIG.jsonl pipeline)
-# -> packing inline at 4096 gives the model longer context windows for better coherence
+TOKEN_STORE = 'preprocessing/PACKED_CORPUS_READY.bin'
 TRAINING_CORPUS = 'preprocessing/WEB_BOOKS_LITERARY.jsonl'
 OUTPUT_DIR = 'models'
+EVAL_BLOCKS = 2000
+# -> True: attention stays inside each document of a packed block (per-document position_ids and a
+# -> block-diagonal causal mask, see doc_attention.py); False: every token sees the whole block
+DOC_ATTENTION = False
 
 tokenizer = PreTrainedTokenizerFast(tokenizer_file=TOKENIZER_NAME)
 tokenizer.bos_token, tokenizer.eos_token = "<s>", "</s>"
@@ -161,9 +174,45 @@ print("EOS id:", tokenizer.eos_token_id)
 print("PAD id:", tokenizer.pad_token_id)
 print("Vocab size:", tokenizer.vocab_size)
 
-print("loading raw corpus...")
-dataset = load_dataset('json', data_files=TRAINING_CORPUS, split='train')
-print(f"loaded {len(dataset)} raw documents")
+# -> fixed-length blocks of a TokenStore as tensors: one numpy view per block, widened to int64,
+# -> no python lists; pickles as the store's path, so dataloader workers map the file themselves
+class TokenBlockDataset(Dataset):
+    def __init__(self, store, indices, doc_attention=False):
+        self.store = store
+        self.indices = indices
+        self.doc_attention = doc_attention
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        block = int(self.indices[i])
+        ids = torch.from_numpy(self.store.block(block).astype(np.int64))
+        item = {"input_ids": ids, "attention_mask": torch.ones_like(ids), "labels": ids}
+        if self.doc_attention:
+            # -> document boundaries of the block from the store's document offsets
+            starts = self.store.block_doc_starts(block)
+            item["position_ids"] = torch.from_numpy(block_position_ids(starts, len(ids)))
+        return item
+
+def load_token_store():
+    store = TokenStore(TOKEN_STORE)
+    # -> ids from another tokenizer or blocks of another length would train silently on garbage
+    store.check_tokenizer(TOKENIZER_NAME)
+    # -> documents must be framed <s> ... </s> exactly like pack_fn frames them
+    store.check_framing(tokenizer.bos_token_id, tokenizer.eos_token_id)
+    if store.block_size != CONTEXT_LENGTH:
+        raise ValueError(f"{TOKEN_STORE} has {store.block_size}-token blocks, CONTEXT_LENGTH is {CONTEXT_LENGTH}")
+    if store.vocab_size > VOCAB_SIZE:
+        raise ValueError(f"{TOKEN_STORE} was packed with a {store.vocab_size} vocab, models have {VOCAB_SIZE}")
+    print(f"token store: {len(store)} blocks of {CONTEXT_LENGTH} tokens from {store.n_docs} documents")
+    print(f"total tokens: ~{len(store) * CONTEXT_LENGTH / 1e9:.2f}B")
+    print(f"tokens packed: {len(store) * CONTEXT_LENGTH:,} of {len(store.tokens):,} | "
+          f"discarded (final partial block): {len(store.tokens) - len(store) * CONTEXT_LENGTH:,}")
+    # -> same split for every run: EVAL_BLOCKS random blocks held out
+    order = np.random.default_rng(42).permutation(len(store))
+    return (TokenBlockDataset(store, np.sort(order[EVAL_BLOCKS:]), DOC_ATTENTION),
+            TokenBlockDataset(store, np.sort(order[:EVAL_BLOCKS]), DOC_ATTENTION))
 
 # -> tokenize each document individually, no special tokens (we add BOS/EOS manually in pack_fn)
 def tok_fn(ex):
@@ -178,8 +227,11 @@ def tok_fn(ex):
 # -> pack tokenized documents into fixed-size blocks of CONTEXT_LENGTH
 # -> each document is wrapped with BOS/EOS so model learns document boundaries
 # -> tokens stream continuously across documents — no padding, no wasted compute
-def pack_fn(ex):
-    ids = []
+# -> the tokens that don't fill a last block are carried over into the next batch, so only the
+# -> final partial block of the whole corpus is dropped
+def pack_fn(ex, carry):
+    # -> (full blocks, leftover ids to prepend to the next batch)
+    ids = carry
     bos_id = tokenizer.bos_token_id
     eos_id = tokenizer.eos_token_id
     for seq in ex["input_ids"]:
@@ -187,61 +239,99 @@ def pack_fn(ex):
         ids.append(bos_id)
         ids.extend(seq)
         ids.append(eos_id)
-    # -> trim to exact multiple of CONTEXT_LENGTH (discard leftover partial block)
     total = (len(ids) // CONTEXT_LENGTH) * CONTEXT_LENGTH
-    if total == 0:
-        return {"input_ids": [], "attention_mask": [], "labels": []}
-    ids = ids[:total]
     chunks = [ids[i:i + CONTEXT_LENGTH] for i in range(0, total, CONTEXT_LENGTH)]
-    return {
-        "input_ids": chunks,
-        "attention_mask": [[1] * CONTEXT_LENGTH for _ in chunks],
-        "labels": [c.copy() for c in chunks],  # -> causal LM: labels = input_ids
-    }
-
-print("tokenizing corpus...")
-tok_ds = dataset.map(
-    tok_fn,
-    batched=True,
-    remove_columns=dataset.column_names,
-    desc="tokenizing",
-)
+    return chunks, ids[total:]
 
-# -> remove any extra columns before packing (attention_mask etc from tokenizer)
-cols_to_keep = ["input_ids"]
-extra_cols = [c for c in tok_ds.column_names if c not in cols_to_keep]
-if extra_cols:
-    tok_ds = tok_ds.remove_columns(extra_cols)
-
-print(f"packing into {CONTEXT_LENGTH}-token blocks...")
-train_ds = tok_ds.map(
-    pack_fn,
-    batched=True,
-    remove_columns=tok_ds.column_names,
-    desc=f"packing to {CONTEXT_LENGTH}",
-)
+def packed_blocks(tok_ds, doc_attention=False):
+    # -> runs through the batches in order (datasets.map batches can't hand state to each other)
+    carry = []
+    for ex in tok_ds.iter(batch_size=1000):
+        chunks, carry = pack_fn(ex, carry)
+        for c in chunks:
+            block = {
+                "input_ids": c,
+                "attention_mask": [1] * CONTEXT_LENGTH,
+                "labels": c.copy(),  # -> causal LM: labels = input_ids
+            }
+            if doc_attention:
+                # -> every document starts with <s>, that's where its positions restart
+                block["position_ids"] = marker_position_ids(c, tokenizer.bos_token_id).tolist()
+            yield block
+
+def count_tokens(tok_ds):
+    # -> tokens pack_fn sees, BOS/EOS included, summed in arrow without building python lists
+    lengths = pc.list_value_length(tok_ds.data.column("input_ids"))
+    return (pc.sum(lengths).as_py() or 0) + 2 * len(tok_ds)
+
+def tokenize_corpus():
+    print("loading raw corpus...")
+    dataset = load_dataset('json', data_files=TRAINING_CORPUS, split='train')
+    print(f"loaded {len(dataset)} raw documents")
+
+    print("tokenizing corpus...")
+    tok_ds = dataset.map(
+        tok_fn,
+        batched=True,
+        remove_columns=dataset.column_names,
+        desc="tokenizing",
+    )
+
+    # -> remove any extra columns before packing (attention_mask etc from tokenizer)
+    cols_to_keep = ["input_ids"]
+    extra_cols = [c for c in tok_ds.column_names if c not in cols_to_keep]
+    if extra_cols:
+        tok_ds = tok_ds.remove_columns(extra_cols)
+
+    print(f"packing into {CONTEXT_LENGTH}-token blocks...")
+    packed = HFDataset.from_generator(packed_blocks, gen_kwargs={"tok_ds": tok_ds, "doc_attention": DOC_ATTENTION})
 
-print(f"packed dataset: {len(train_ds)} sequences of {CONTEXT_LENGTH} tokens")
-print(f"total tokens: ~{len(train_ds) * CONTEXT_LENGTH / 1e9:.2f}B")
+    # -> counted from the datasets themselves, so the numbers hold when the packing came from cache
+    n_tokens = count_tokens(tok_ds)
+    n_packed = len(packed) * CONTEXT_LENGTH
+    print(f"packed dataset: {len(packed)} sequences of {CONTEXT_LENGTH} tokens")
+    print(f"total tokens: ~{n_packed / 1e9:.2f}B")
+    print(f"tokens packed: {n_packed:,} of {n_tokens:,} | discarded (final partial block): {n_tokens - n_packed:,}")
 
-# -> split into train/eval
-train_ds = train_ds.train_test_split(test_size=2000, seed=42)
-print(f"train: {len(train_ds['train'])} sequences | eval: {len(train_ds['test'])} sequences")
+    # -> split into train/eval
+    split = packed.train_test_split(test_size=EVAL_BLOCKS, seed=42)
+    return split['train'], split['test']
+
+if Path(TOKEN_STORE).exists():
+    train_ds, eval_ds = load_token_store()
+else:
+    print(f"no token store at {TOKEN_STORE}, tokenizing the raw corpus")
+    train_ds, eval_ds = tokenize_corpus()
+print(f"train: {len(train_ds)} sequences | eval: {len(eval_ds)} sequences")
 
 # -> simple collator — data is already packed with labels, just stack into tensors
 # -> DataCollatorForLanguageModeling is NOT used here because it may corrupt packed sequences
+def _stack(values):
+    # -> tensors from TokenBlockDataset, lists of ints from the inline pipeline
+    if isinstance(values[0], torch.Tensor):
+        return torch.stack(values)
+    return torch.tensor(values, dtype=torch.long)
+
+# -> doc_attention: blocks carry position_ids, the 2D all-ones mask becomes the per-document 4D mask
+# -> (with the model's sliding window folded in, a 4D mask replaces the model's own)
 class SimpleCollator:
+    def __init__(self, doc_attention=False, sliding_window=None, dtype=torch.float32):
+        self.doc_attention = doc_attention
+        self.sliding_window = sliding_window
+        self.dtype = dtype
+
     def __call__(self, batch):
-        input_ids = torch.tensor([item['input_ids'] for item in batch], dtype=torch.long)
-        labels = torch.tensor([item['labels'] for item in batch], dtype=torch.long)
-        attention_mask = torch.tensor([item['attention_mask'] for item in batch], dtype=torch.long)
-        return {
-            'input_ids': input_ids,
-            'attention_mask': attention_mask,
-            'labels': labels,
+        out = {
+            'input_ids': _stack([item['input_ids'] for item in batch]),
+            'attention_mask': _stack([item['attention_mask'] for item in batch]),
+            'labels': _stack([item['labels'] for item in batch]),
         }
-
-data_collator = SimpleCollator()
+        if self.doc_attention:
+            position_ids = _stack([item['position_ids'] for item in batch])
+            out['position_ids'] = position_ids
+            out['attention_mask'] = doc_attention_mask(position_ids, self.dtype, self.sliding_window)
+            out['labels'] = doc_labels(out['labels'], position_ids)
+        return out
 
 # -> training arguments
 print("initializing training arguments...")
@@ -277,12 +367,19 @@ for model_class, model_config, model_name in arch_selectors:
 
     model_args = copy.deepcopy(training_args)
     model_args.output_dir = f"{OUTPUT_DIR}/{model_name}"
+    # -> Mamba has no attention to keep inside documents
+    data_collator = SimpleCollator(
+        doc_attention=DOC_ATTENTION and model_class is not Mamba2ForCausalLM,
+        sliding_window=getattr(model_config, "sliding_window", None),
+        # -> bf16 autocast computes attention in bf16
+        dtype=torch.bfloat16 if model_args.bf16 else torch.float32,
+    )
 
     trainer = Trainer(
         model=model,
         args=model_args,
-        train_dataset=train_ds['train'],
-        eval_dataset=train_ds['test'],
+        train_dataset=train_ds,
+        eval_dataset=eval_ds,
         data_collator=data_collator
     )
 